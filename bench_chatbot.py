@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+CoachEduAI chatbot load benchmark
+Registers a batch of users against a running server, has them all ask the
+chatbot concurrently and reports latency, time-to-first-token and throughput.
+Offline fallback answers are counted separately from LLM answers.
+Run it against mock_llm_server.py to avoid spending API credit:
+
+    python mock_llm_server.py &
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python main.py &
+    python bench_chatbot.py --users 40 --requests 5
+"""
+
+import argparse
+import http.cookiejar
+import json
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+QUESTIONS = [
+    'Giải phương trình bậc hai x² - 5x + 6 = 0',
+    'Tạo cho mình 3 bài tập Vật lý về chuyển động thẳng đều',
+    'Giải thích cấu hình electron của nguyên tử Fe',
+    'Gợi ý dàn ý phân tích nhân vật Chí Phèo',
+    'Cách dùng thì hiện tại hoàn thành trong tiếng Anh',
+    'Tóm tắt quá trình quang hợp ở thực vật',
+]
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def format_ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f} ms"
+
+def post(opener, url, fields, headers=None, timeout=120):
+    data = urllib.parse.urlencode(fields).encode()
+    return opener.open(urllib.request.Request(url, data=data, headers=headers or {}), timeout=timeout)
+
+def create_session(base_url, index, run_id):
+    """Register and log in a fresh user; returns a cookie-aware opener"""
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+    username = f"bench_{run_id}_{index}"
+    password = 'bench123'
+    post(opener, base_url + '/register/step1', {'full_name': f'Bench User {index}',
+                                               'email': f'{username}@bench.local', 'birth_date': '2008-01-01'}).read()
+    post(opener, base_url + '/register/step2', {'username': username, 'password': password,
+                                               'school_name': 'Bench School', 'city': 'Hà Nội'}).read()
+    post(opener, base_url + '/register/step3', {}).read()
+    response = post(opener, base_url + '/login', {'username_or_email': username, 'password': password})
+    response.read()
+    if not response.geturl().rstrip('/').endswith('/home'):
+        raise RuntimeError(f"login failed for {username}")
+    return opener
+
+def ask(opener, base_url, message, stream):
+    """Send one question; returns (status, latency, ttft, queued_events, fallback)"""
+    started = time.monotonic()
+    headers = {'Accept': 'text/event-stream' if stream else 'application/json'}
+    try:
+        response = post(opener, base_url + '/chatbot', {'message': message}, headers)
+    except urllib.error.HTTPError as e:
+        e.read()
+        return e.code, time.monotonic() - started, None, 0, False
+
+    ttft = None
+    queued = 0
+    fallback = False
+    with response:
+        if not stream:
+            fallback = bool(json.loads(response.read()).get('fallback'))
+            return response.status, time.monotonic() - started, None, 0, fallback
+        event = None
+        for line in response:
+            if line.startswith(b'event: '):
+                event = line[7:].strip()
+                if event == b'token' and ttft is None:
+                    ttft = time.monotonic() - started
+                elif event == b'queued':
+                    queued += 1
+            elif line.startswith(b'data: ') and event == b'done':
+                # The offline fallback answer is marked so it isn't mistaken for an LLM answer
+                fallback = bool(json.loads(line[6:]).get('fallback'))
+    return response.status, time.monotonic() - started, ttft, queued, fallback
+
+def run_user(args, opener, index, results, lock, barrier):
+    barrier.wait()
+    for i in range(args.requests):
+        question = QUESTIONS[(index + i) % len(QUESTIONS)]
+        if not args.repeat:
+            # Make every question unique so the answer cache cannot serve it
+            question += f" (#{index}-{i}-{uuid.uuid4().hex[:6]})"
+        try:
+            outcome = ask(opener, args.url, question, not args.no_stream)
+        except Exception as e:
+            outcome = ('error', None, None, 0, False)
+            print(f"Request error: {e}")
+        with lock:
+            results.append(outcome)
+        if args.think_time:
+            time.sleep(args.think_time)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load test the CoachEduAI chatbot')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--users', type=int, default=20, help='concurrent chat sessions')
+    parser.add_argument('--requests', type=int, default=5, help='questions per user')
+    parser.add_argument('--think-time', type=float, default=0, help='pause between questions (s)')
+    parser.add_argument('--no-stream', action='store_true', help='use the JSON endpoint instead of SSE')
+    parser.add_argument('--repeat', action='store_true', help='reuse identical questions (exercises the cache)')
+    args = parser.parse_args()
+    args.url = args.url.rstrip('/')
+
+    run_id = uuid.uuid4().hex[:8]
+    print(f"👥 Registering {args.users} users...")
+    openers = [create_session(args.url, i, run_id) for i in range(args.users)]
+
+    results = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(args.users + 1)
+    threads = [threading.Thread(target=run_user, args=(args, opener, i, results, lock, barrier))
+               for i, opener in enumerate(openers)]
+    for thread in threads:
+        thread.start()
+
+    print(f"🚀 Sending {args.users * args.requests} questions "
+          f"({'JSON' if args.no_stream else 'streaming'})...")
+    barrier.wait()
+    started = time.monotonic()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    answered = [r for r in results if r[0] == 200]
+    ok = [r for r in answered if not r[4]]
+    fallbacks = len(answered) - len(ok)
+    latencies = [r[1] for r in ok]
+    ttfts = [r[2] for r in ok if r[2] is not None]
+    statuses = {}
+    for r in results:
+        statuses[r[0]] = statuses.get(r[0], 0) + 1
+
+    print()
+    print(f"Requests:       {len(results)} in {elapsed:.1f} s")
+    print(f"Status codes:   {', '.join(f'{code}: {count}' for code, count in sorted(statuses.items(), key=str))}")
+    print(f"LLM answers:    {len(ok)}")
+    print(f"Fallbacks:      {fallbacks}" + ("  ⚠️ the LLM path is failing" if fallbacks and not ok else ""))
+    print(f"Throughput:     {len(ok) / elapsed:.2f} LLM answers/s" if elapsed else "Throughput:     -")
+    print(f"Latency:        p50 {format_ms(percentile(latencies, 0.5))}, p99 {format_ms(percentile(latencies, 0.99))}")
+    if not args.no_stream:
+        print(f"First token:    p50 {format_ms(percentile(ttfts, 0.5))}, p99 {format_ms(percentile(ttfts, 0.99))}")
+        print(f"Queued answers: {sum(1 for r in ok if r[3])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+CoachEduAI ranking broadcast benchmark
+Replays ranking ticks for a synthetic population through the server's own
+frame builders and the Socket.IO packet encoder, and reports wire bytes per
+client and serialization CPU for every ranking format against the original
+'json' one. No server or database is needed:
+
+    python bench_ranking_payloads.py --users 2000 --ticks 30 --churn 0.02
+"""
+
+import argparse
+import random
+import time
+
+from socketio import packet
+
+import main
+
+FIRST_NAMES = ['An', 'Bình', 'Chi', 'Dũng', 'Giang', 'Hà', 'Hải', 'Hương', 'Khoa', 'Lan',
+               'Linh', 'Minh', 'Nam', 'Ngọc', 'Phúc', 'Quân', 'Tâm', 'Thảo', 'Trang', 'Vy']
+LAST_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng']
+CITIES = ['Hà Nội', 'TP. Hồ Chí Minh', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Huế', 'Nha Trang']
+
+def make_users(count, first_id=1):
+    users = []
+    for user_id in range(first_id, first_id + count):
+        city = random.choice(CITIES)
+        users.append({
+            'id': user_id,
+            'username': f"hocsinh{user_id}",
+            'full_name': f"{random.choice(LAST_NAMES)} {random.choice(FIRST_NAMES)} {random.choice(FIRST_NAMES)}",
+            'school': f"THPT Chuyên {random.choice(FIRST_NAMES)} {city}",
+            'city': city,
+        })
+    return users
+
+def rank(users, scores, solved):
+    """Rows shaped like get_current_rankings(): best score first, earliest user on ties"""
+    order = sorted(users, key=lambda user: (-scores[user['id']], user['id']))
+    return [dict(user, total_score=scores[user['id']], exercises_solved=solved[user['id']], rank=position)
+            for position, user in enumerate(order, 1)]
+
+def wire_size(event, payload):
+    """Bytes of the Socket.IO packet(s) a client receives for one emit"""
+    encoded = packet.Packet(packet.EVENT, data=[event, payload], namespace='/').encode()
+    parts = encoded if isinstance(encoded, list) else [encoded]
+    return sum(len(part) if isinstance(part, bytes) else len(part.encode()) for part in parts)
+
+def main_bench():
+    parser = argparse.ArgumentParser(description='Compare ranking broadcast formats')
+    parser.add_argument('--users', type=int, default=2000, help='users in every subject ranking')
+    parser.add_argument('--ticks', type=int, default=30, help='broadcast rounds to replay')
+    parser.add_argument('--churn', type=float, default=0.02, help='fraction of users scoring per tick')
+    parser.add_argument('--new-users', type=int, default=2, help='users registering per tick')
+    parser.add_argument('--interval', type=float, default=1.0, help='seconds between broadcasts')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    formats = ['json', 'columnar', 'deflate'] + (['msgpack'] if main.msgpack else [])
+    subjects = main.RANKING_SUBJECTS
+    users = make_users(args.users)
+    scores = {subject: {user['id']: random.randint(0, 500) for user in users} for subject in subjects}
+    solved = {subject: {user['id']: random.randint(0, 50) for user in users} for subject in subjects}
+
+    known = {fmt: {} for fmt in formats}
+    snapshot_bytes = dict.fromkeys(formats, 0)
+    tick_bytes = dict.fromkeys(formats, 0)
+    cpu = dict.fromkeys(formats, 0.0)
+
+    print(f"📊 {args.users} users x {len(subjects)} subjects, {args.ticks} ticks, "
+          f"{args.churn:.0%} churn, {args.new_users} new users/tick")
+    if not main.msgpack:
+        print("   msgpack is not installed; skipping the MessagePack format")
+
+    for tick in range(args.ticks + 1):
+        if tick:
+            for user in make_users(args.new_users, len(users) + 1):
+                users.append(user)
+                for subject in subjects:
+                    scores[subject][user['id']] = 0
+                    solved[subject][user['id']] = 0
+            for user in random.sample(users, int(len(users) * args.churn)):
+                subject = random.choice(subjects)
+                scores[subject][user['id']] += random.randint(5, 20)
+                solved[subject][user['id']] += 1
+
+        rankings = {subject: rank(users, scores[subject], solved[subject]) for subject in subjects}
+        for fmt in formats:
+            started = time.process_time()
+            size = 0
+            for subject in subjects:
+                frame = main.build_ranking_frame(subject, rankings[subject], known[fmt]) if fmt != 'json' else None
+                payload = main.encode_ranking_frame(subject, rankings[subject], frame, fmt)
+                size += wire_size(main.RANKING_EVENTS[fmt], payload)
+            elapsed = time.process_time() - started
+            # Tick 0 plays the snapshot a client receives when it joins
+            if tick:
+                tick_bytes[fmt] += size
+                cpu[fmt] += elapsed
+            else:
+                snapshot_bytes[fmt] = size
+
+    baseline_bytes = tick_bytes['json'] / args.ticks
+    baseline_cpu = cpu['json'] / args.ticks
+    print()
+    print(f"{'Format':<10} {'Snapshot':>10} {'Bytes/tick':>12} {'KB/s/client':>12} {'vs json':>8} "
+          f"{'CPU ms/tick':>12} {'vs json':>8}")
+    for fmt in formats:
+        per_tick = tick_bytes[fmt] / args.ticks
+        cpu_per_tick = cpu[fmt] / args.ticks
+        print(f"{fmt:<10} {snapshot_bytes[fmt]:>10} {per_tick:>12.0f} "
+              f"{per_tick / args.interval / 1024:>12.1f} {per_tick / baseline_bytes:>8.2f} "
+              f"{cpu_per_tick * 1000:>12.1f} {cpu_per_tick / baseline_cpu:>8.2f}")
+
+if __name__ == '__main__':
+    main_bench()
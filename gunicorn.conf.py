@@ -0,0 +1,33 @@
+"""
+Gunicorn settings for running CoachEduAI on several eventlet workers
+
+    export SOCKETIO_MESSAGE_QUEUE=unix:///tmp/coachedual-socketio   # or redis://localhost:6379/0
+    gunicorn -c gunicorn.conf.py main:app
+
+The database is initialized once in the master before the workers start.
+Every worker then starts its own background tasks, and the periodic jobs
+run only in the worker that holds the leader lock (see main.py).
+"""
+
+import multiprocessing
+import os
+import subprocess
+import sys
+
+bind = f"{os.environ.get('HOST', '0.0.0.0')}:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'eventlet'
+worker_connections = int(os.environ.get('WORKER_CONNECTIONS', 1000))
+timeout = 120
+
+def on_starting(server):
+    if workers > 1 and not os.environ.get('SOCKETIO_MESSAGE_QUEUE'):
+        server.log.warning("SOCKETIO_MESSAGE_QUEUE is not set: Socket.IO events will only reach "
+                           "clients connected to the same worker")
+    # Run in a child process: importing main here would create the Socket.IO
+    # manager (and its queue connection) in the master, to be shared by every fork
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'main', 'init-db'], check=True)
+
+def post_worker_init(worker):
+    from main import start_background_tasks
+    start_background_tasks()
@@ -104,12 +104,17 @@ function initializeRealTime() {
     if (window.CURRENT_USER_ID) {
         // Initialize Socket.IO for real-time features
         if (typeof io !== 'undefined') {
-            socket = io();
+            socket = io(window.SOCKET_OPTIONS || {});
 
             // Join user's notification room
             socket.emit('join_notifications');
 
             // Listen for notifications
+            // Re-join group and contest rooms after joining one elsewhere
+            socket.on('audience_changed', function() {
+                socket.emit('sync_audiences');
+            });
+
             socket.on('new_notification', function(data) {
                 showNotification(data.content || data, 'info');
                 updateNotificationBadge();
@@ -183,14 +188,26 @@ function updateNotificationBadge() {
 // Chat Functions
 function displayChatMessage(data) {
     const messagesContainer = document.getElementById('chatMessages');
-    if (!messagesContainer) return;
+    if (!messagesContainer || String(data.room) !== getCurrentChatRoom()) return;
+
+    const emptyState = messagesContainer.querySelector('.chat-empty');
+    if (emptyState) emptyState.remove();
 
+    const isSent = data.sender_id === window.CURRENT_USER_ID;
     const messageDiv = document.createElement('div');
-    messageDiv.className = `message ${data.sender_id === window.CURRENT_USER_ID ? 'message-sent' : 'message-received'}`;
+    messageDiv.className = `message ${isSent ? 'message-sent' : 'message-received'}`;
     messageDiv.innerHTML = `
-        <div class="message-content">${data.content}</div>
-        <div class="message-time">${formatTime(data.timestamp)}</div>
+        <div class="message-avatar ${isSent ? 'bg-success' : 'bg-primary'} text-white">
+            <i class="fas fa-user"></i>
+        </div>
+        <div class="message-content">
+            <div class="message-text"></div>
+            <div class="message-info"></div>
+        </div>
     `;
+    // Chat text is user input: never render it as HTML
+    messageDiv.querySelector('.message-text').textContent = data.content;
+    messageDiv.querySelector('.message-info').textContent = `${data.sender || ''} • ${formatTime(data.timestamp)}`;
 
     messagesContainer.appendChild(messageDiv);
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
@@ -213,7 +230,8 @@ function sendChatMessage() {
 }
 
 function getCurrentChatRoom() {
-    // Determine current chat room based on URL or context
+    // The chat page sets the open group; otherwise fall back to the URL
+    if (window.currentChatRoom) return String(window.currentChatRoom);
     const pathParts = window.location.pathname.split('/');
     return pathParts[pathParts.length - 1] || 'general';
 }
@@ -256,6 +274,7 @@ function submitExercise(exerciseId) {
         })
     })
     .then(response => response.json())
+    .then(waitForGradingResult)
     .then(data => {
         if (data.success) {
             showNotification(`Chính xác! Bạn được ${data.score} điểm`, 'success');
@@ -272,6 +291,40 @@ function submitExercise(exerciseId) {
     });
 }
 
+// Submissions are graded asynchronously: the result arrives as a
+// 'grading_result' socket event, with polling as a fallback
+function waitForGradingResult(data) {
+    if (!data.queued) {
+        return Promise.resolve(data);
+    }
+
+    return new Promise(resolve => {
+        let done = false;
+        let poller = null;
+
+        const finish = result => {
+            if (done) return;
+            done = true;
+            if (socket) socket.off('grading_result', onResult);
+            clearInterval(poller);
+            resolve(result);
+        };
+        const onResult = result => {
+            if (result.job_id === data.job_id) finish(result);
+        };
+
+        if (socket) socket.on('grading_result', onResult);
+        poller = setInterval(() => {
+            fetch(`/api/submission_result/${data.job_id}`)
+                .then(response => response.json())
+                .then(status => {
+                    if (status.success && status.ready) finish(status.result);
+                })
+                .catch(() => {});
+        }, 2000);
+    });
+}
+
 // Timer Functions
 function startTimer(timerElement, duration = null) {
     if (!duration) {
@@ -497,18 +550,85 @@ function filterContests(query) {
 }
 
 // Real-time ranking functionality
+// The server picks the most compact format this browser can decode; compact
+// frames carry columns plus dictionary entries for users we haven't seen yet.
+const rankingUsers = new Map();
+let rankingFrames = Promise.resolve();
+
+function getRankingFormats() {
+    const formats = [];
+    if (typeof DecompressionStream !== 'undefined') formats.push('deflate');
+    if (typeof MessagePack !== 'undefined') formats.push('msgpack');
+    formats.push('columnar', 'json');
+    return formats;
+}
+
+function inflateRankingFrame(buffer) {
+    const stream = new Blob([buffer]).stream().pipeThrough(new DecompressionStream('deflate'));
+    return new Response(stream).json();
+}
+
+function fetchRankingUsers(rankingSocket, ids) {
+    return new Promise(resolve => {
+        rankingSocket.emit('ranking_users', { ids: ids }, function(response) {
+            resolve((response && response.users) || []);
+        });
+    });
+}
+
+async function applyRankingFrame(rankingSocket, frame) {
+    frame.users.forEach(entry => rankingUsers.set(entry[0], entry));
+    const missing = frame.id.filter(id => !rankingUsers.has(id));
+    if (missing.length) {
+        (await fetchRankingUsers(rankingSocket, missing)).forEach(entry => rankingUsers.set(entry[0], entry));
+    }
+
+    const rankings = frame.id.map((id, index) => {
+        const user = rankingUsers.get(id) || [id, '', '', null, null];
+        return {
+            rank: index + 1,
+            username: user[1],
+            full_name: user[2],
+            school: user[3],
+            city: user[4],
+            score: frame.score[index],
+            exercises_solved: frame.solved[index]
+        };
+    });
+    updateRankingTable(frame.subject, rankings);
+}
+
+function queueRankingFrame(rankingSocket, decode) {
+    // Inflating is asynchronous; chaining keeps frames in arrival order
+    rankingFrames = rankingFrames
+        .then(() => decode())
+        .then(frame => applyRankingFrame(rankingSocket, frame))
+        .catch(error => console.log('Ranking update error:', error));
+}
+
 function initializeRanking() {
-    if (typeof io !== 'undefined') {
-        const socket = io();
+    if (typeof io !== 'undefined' && document.querySelector('.ranking-table')) {
+        const rankingSocket = socket || io(window.SOCKET_OPTIONS || {});
 
-        socket.on('connect', function() {
+        rankingSocket.on('connect', function() {
             console.log('Connected to ranking updates');
-            socket.emit('join_ranking');
+            rankingSocket.emit('join_ranking', { formats: getRankingFormats() }, function(response) {
+                console.log('Ranking format:', response && response.format);
+            });
         });
 
-        socket.on('ranking_update', function(data) {
+        rankingSocket.on('ranking_update', function(data) {
             updateRankingTable(data.subject, data.rankings);
         });
+        rankingSocket.on('ranking_columns', function(frame) {
+            queueRankingFrame(rankingSocket, () => frame);
+        });
+        rankingSocket.on('ranking_msgpack', function(data) {
+            queueRankingFrame(rankingSocket, () => MessagePack.decode(new Uint8Array(data.frame)));
+        });
+        rankingSocket.on('ranking_deflate', function(data) {
+            queueRankingFrame(rankingSocket, () => inflateRankingFrame(data.frame));
+        });
     }
 }
 
@@ -616,6 +736,7 @@ const CoachEduAI = {
             })
         })
         .then(response => response.json())
+        .then(waitForGradingResult)
         .then(data => {
             if (data.success) {
                 showNotification(data.message, data.is_correct ? 'success' : 'warning');
@@ -635,8 +756,8 @@ const CoachEduAI = {
 };
 
 // Contest functionality
-function joinContest(contestId) {
-    if (!confirm('Bạn có chắc chắn muốn tham gia cuộc thi này?')) {
+function joinContest(contestId, isRetry = false) {
+    if (!isRetry && !confirm('Bạn có chắc chắn muốn tham gia cuộc thi này?')) {
         return;
     }
 
@@ -660,6 +781,10 @@ function joinContest(contestId) {
                 button.disabled = true;
                 button.className = 'btn btn-success btn-lg';
             }
+        } else if (data.status === 'busy') {
+            // Server is admitting a join rush; retry after the suggested delay
+            showNotification(data.message, 'warning');
+            setTimeout(() => joinContest(contestId, true), (data.retry_after || 2) * 1000);
         } else {
             showNotification('Lỗi: ' + data.message, 'danger');
         }
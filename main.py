@@ -1,5 +1,9 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, Response, stream_with_context
 from flask_socketio import SocketIO, emit, join_room, leave_room
+from socketio import PubSubManager, Manager as SocketManager, RedisManager, KafkaManager, ZmqManager, KombuManager
+from socketio import packet as socketio_packet
+from engineio import packet as eio_packet
+from markupsafe import escape
 import sqlite3
 import hashlib
 import datetime
@@ -9,6 +13,35 @@ import time
 import openai
 from dotenv import load_dotenv
 import json
+import csv
+import io
+import click
+import zlib
+import heapq
+import uuid
+import re
+import unicodedata
+import pickle
+import socket
+from collections import OrderedDict, deque
+from contextlib import nullcontext
+
+try:
+    import numpy  # optional: vectorized exercise retrieval
+except ImportError:
+    numpy = None
+
+try:
+    import msgpack  # optional: binary ranking broadcasts
+except ImportError:
+    msgpack = None
+
+try:
+    import fcntl  # leader election lock on POSIX
+    msvcrt = None
+except ImportError:
+    fcntl = None
+    import msvcrt  # Windows
 
 # Load environment variables
 load_dotenv()
@@ -16,20 +49,314 @@ load_dotenv()
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
+# Several worker processes share Socket.IO rooms through a message queue:
+# SOCKETIO_MESSAGE_QUEUE takes a redis://, amqp://, kafka:// or zmq+tcp://
+# URL, or unix:///some/dir for LocalSocketManager between workers on one host.
+SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+SOCKETIO_CHANNEL = os.environ.get('SOCKETIO_CHANNEL', 'coachedual')
+LOCAL_QUEUE_BUFFER = 1 << 20
+# Long polling needs sticky sessions, which several workers behind one port don't have
+SOCKETIO_CLIENT_OPTIONS = {'transports': ['websocket']} if SOCKETIO_MESSAGE_QUEUE else {}
+
+class LocalSocketManager(PubSubManager):
+    """Socket.IO message queue over UNIX datagram sockets for workers on one host
+
+    Each worker binds '<dir>/<channel>/<host_id>.sock' and publishes by
+    sending every message to all the other sockets in that directory, so no
+    broker is needed. A message must fit in one datagram (the kernel's
+    socket buffer limit, usually about 200 KB); larger ones are dropped and
+    logged. The directory is private to the user running the workers.
+    """
+    name = 'unix'
+
+    def __init__(self, url, channel='socketio', write_only=False, logger=None, json=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger, json=json)
+        self.directory = os.path.join(url[len('unix://'):], channel)
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        self.sender = None
+        self.receiver = None
+
+    def initialize(self):
+        # Runs lazily in each worker after the fork, so workers never share an identity
+        self.host_id = uuid.uuid4().hex
+        if not self.write_only:
+            self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.receiver.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, LOCAL_QUEUE_BUFFER)
+            self.receiver.bind(os.path.join(self.directory, f'{self.host_id}.sock'))
+        super().initialize()
+
+    def _publish(self, data):
+        if self.sender is None:
+            self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.sender.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, LOCAL_QUEUE_BUFFER)
+            # A worker that stops reading must not block the others
+            self.sender.setblocking(False)
+        message = pickle.dumps(data)
+        own = f'{self.host_id}.sock'
+        for name in os.listdir(self.directory):
+            if not name.endswith('.sock') or name == own:
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self.sender.sendto(message, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Left behind by a worker that has exited
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            except OSError as e:
+                print(f"Socket.IO queue publish error ({name}): {e}")
+
+    def _listen(self):
+        while True:
+            yield pickle.loads(self.receiver.recv(LOCAL_QUEUE_BUFFER))
+
+# Slow consumers. A client on a bad connection can't drain its outbound
+# Engine.IO queue, which then holds every frame we emit to it. Before each
+# emit the recipient's queue is inspected: a 'json' ranking frame still
+# queued for the same subject is replaced in place by the new one, so only
+# the latest is delivered, and a client with more than SOCKET_BACKLOG_LIMIT bytes
+# queued has those packets dropped and is disconnected (it reconnects and
+# asks for a fresh snapshot). How far behind each room's members are is
+# kept for /api/queue_stats.
+SOCKET_BACKLOG_LIMIT = int(os.environ.get('SOCKET_BACKLOG_LIMIT', 8 << 20))
+SOCKET_LAG_ROOMS = 1000
+
+socket_lag = OrderedDict()
+socket_behind_since = {}
+socket_lag_lock = threading.Lock()
+slow_consumer_stats = {'conflated': 0, 'disconnected': 0, 'dropped_bytes': 0}
+
+def _outbound_queue(eio_socket):
+    """The lock and deque behind an Engine.IO socket's queue (green queues need no lock)"""
+    queue = getattr(eio_socket, 'queue', None)
+    return getattr(queue, 'mutex', None) or nullcontext(), getattr(queue, 'queue', None)
+
+def _packet_size(pkt):
+    data = getattr(pkt, 'data', None)
+    return len(data) if isinstance(data, (str, bytes)) else 0
+
+def inspect_outbound_queue(eio_socket, replacements=None, key=None):
+    """Bytes waiting in a client's queue, replacing queued packets tagged with `key`
+
+    Returns (queued_bytes, replaced). Conflated frames are tagged with
+    (event, subject, part); a binary frame's placeholder and attachment
+    are separate packets, so each part is replaced by the same part.
+    """
+    lock, packets = _outbound_queue(eio_socket)
+    if packets is None:
+        return 0, False
+    queued = 0
+    replaced = False
+    with lock:
+        for index, pkt in enumerate(packets):
+            tag = getattr(pkt, 'conflate_key', None)
+            if key and tag and tag[:2] == key and tag[2] < len(replacements):
+                packets[index] = replacements[tag[2]]
+                replaced = True
+            queued += _packet_size(pkt)
+    return queued, replaced
+
+def drop_outbound_queue(eio_socket):
+    """Swap every queued packet for a no-op so its memory is freed; returns bytes dropped"""
+    lock, packets = _outbound_queue(eio_socket)
+    if packets is None:
+        return 0
+    dropped = 0
+    noop = eio_packet.Packet(eio_packet.NOOP)
+    with lock:
+        for index, pkt in enumerate(packets):
+            if pkt is not None:
+                dropped += _packet_size(pkt)
+                packets[index] = noop
+    return dropped
+
+def record_socket_lag(room, recipients, lags, backlogs, conflated, disconnected):
+    now = time.time()
+    with socket_lag_lock:
+        entry = socket_lag.pop(room, None) or {'conflated': 0, 'disconnected': 0}
+        entry.update(recipients=recipients, backlogged=sum(1 for queued in backlogs if queued),
+                     max_backlog=max(backlogs, default=0), max_lag=round(max(lags, default=0), 3),
+                     conflated=entry['conflated'] + conflated,
+                     disconnected=entry['disconnected'] + disconnected, updated=now)
+        socket_lag[room] = entry
+        while len(socket_lag) > SOCKET_LAG_ROOMS:
+            socket_lag.popitem(last=False)
+        slow_consumer_stats['conflated'] += conflated
+        slow_consumer_stats['disconnected'] += disconnected
+
+def get_slow_consumer_stats(limit=20):
+    """Totals plus the rooms whose members are furthest behind"""
+    with socket_lag_lock:
+        rooms = sorted(socket_lag.items(), key=lambda item: item[1]['max_lag'], reverse=True)[:limit]
+        return dict(slow_consumer_stats, lagging_sockets=len(socket_behind_since),
+                    rooms={room: dict(entry) for room, entry in rooms})
+
+class SlowConsumerManager(SocketManager):
+    """Client manager that inspects each recipient's outbound queue before emitting
+
+    Mixed into whichever manager SOCKETIO_MESSAGE_QUEUE selects, so emits
+    that arrive from other workers are checked by the worker that holds
+    the client's connection. Cache changes published by other workers
+    arrive here too and are applied instead of being sent to clients.
+    """
+
+    def emit(self, event, data, namespace, room=None, skip_sid=None, callback=None, to=None, **kwargs):
+        if event == CACHE_CHANGE_EVENT:
+            apply_cache_change(data)
+            return
+        room = to or room
+        if callback or namespace not in self.rooms:
+            return super().emit(event, data, namespace, room=room, skip_sid=skip_sid, callback=callback, **kwargs)
+        if isinstance(data, tuple):
+            data = list(data)
+        elif data is not None:
+            data = [data]
+        else:
+            data = []
+        if not isinstance(skip_sid, list):
+            skip_sid = [skip_sid]
+
+        # Encode once for every recipient, as the base manager does
+        encoded = self.server.packet_class(socketio_packet.EVENT, namespace=namespace,
+                                           data=[event] + data).encode()
+        eio_pkts = [eio_packet.Packet(eio_packet.MESSAGE, part)
+                    for part in (encoded if isinstance(encoded, list) else [encoded])]
+        key = None
+        if event in CONFLATED_EVENTS and data and isinstance(data[0], dict):
+            key = (event, data[0].get('subject'))
+            for part, pkt in enumerate(eio_pkts):
+                pkt.conflate_key = key + (part,)
+
+        now = time.time()
+        lags, backlogs, slow = [], [], []
+        conflated = 0
+        for sid, eio_sid in self.get_participants(namespace, room):
+            if sid in skip_sid:
+                continue
+            eio_socket = self.server.eio.sockets.get(eio_sid)
+            queued, replaced = inspect_outbound_queue(eio_socket, eio_pkts, key) if eio_socket else (0, False)
+            if queued > SOCKET_BACKLOG_LIMIT:
+                slow.append((sid, eio_socket, queued))
+                continue
+            with socket_lag_lock:
+                if queued:
+                    lags.append(now - socket_behind_since.setdefault(eio_sid, now))
+                else:
+                    socket_behind_since.pop(eio_sid, None)
+            backlogs.append(queued)
+            if replaced:
+                conflated += 1
+                continue
+            for pkt in eio_pkts:
+                self.server._send_eio_packet(eio_sid, pkt)
+
+        # Closing runs disconnect handlers, which change the rooms iterated above
+        for sid, eio_socket, queued in slow:
+            print(f"Disconnecting slow socket {sid}: {queued} bytes queued")
+            dropped = drop_outbound_queue(eio_socket)
+            with socket_lag_lock:
+                slow_consumer_stats['dropped_bytes'] += dropped
+            eio_socket.close(wait=False)
+
+        # Emits to a single socket (room == sid) would crowd out the real rooms
+        if room is None or not self.is_connected(room, namespace):
+            record_socket_lag(room or '*', len(backlogs) + len(slow), lags, backlogs, conflated, len(slow))
+
+    def disconnect(self, sid, namespace, **kwargs):
+        eio_sid = self.eio_sid_from_sid(sid, namespace)
+        with socket_lag_lock:
+            socket_behind_since.pop(eio_sid, None)
+        return super().disconnect(sid, namespace, **kwargs)
+
+def create_client_manager():
+    """Socket.IO client manager for SOCKETIO_MESSAGE_QUEUE, with slow-consumer handling"""
+    url = SOCKETIO_MESSAGE_QUEUE
+    if not url:
+        return SlowConsumerManager()
+    # Same URL schemes Flask-SocketIO understands, plus unix://
+    if url.startswith('unix://'):
+        queue_class = LocalSocketManager
+    elif url.startswith(('redis://', 'rediss://')):
+        queue_class = RedisManager
+    elif url.startswith('kafka://'):
+        queue_class = KafkaManager
+    elif url.startswith('zmq'):
+        queue_class = ZmqManager
+    else:
+        queue_class = KombuManager
+    manager_class = type(queue_class.__name__, (queue_class, SlowConsumerManager), {})
+    return manager_class(url, channel=SOCKETIO_CHANNEL)
+
+socketio_options = {'cors_allowed_origins': '*', 'client_manager': create_client_manager()}
+
 # Configure SocketIO with compatible async driver
 try:
     # Try to use eventlet first
     import eventlet
-    socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
+    socketio = SocketIO(app, async_mode='eventlet', **socketio_options)
 except (ImportError, AttributeError):
     try:
         # Fallback to threading mode
-        socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
+        socketio = SocketIO(app, async_mode='threading', **socketio_options)
     except Exception:
         # Final fallback - disable SocketIO
         socketio = None
         print("Warning: SocketIO disabled due to compatibility issues")
 
+# Background helpers that follow the active async mode (green threads under
+# eventlet, OS threads otherwise)
+def start_background_task(target, *args):
+    if socketio:
+        return socketio.start_background_task(target, *args)
+    thread = threading.Thread(target=target, args=args, daemon=True)
+    thread.start()
+    return thread
+
+def background_sleep(seconds):
+    if socketio:
+        socketio.sleep(seconds)
+    else:
+        time.sleep(seconds)
+
+def create_event():
+    if socketio:
+        return socketio.server.eio.create_event()
+    return threading.Event()
+
+# Cross-worker cache changes. Each worker caches exercises, unread
+# notification counts, group chat history and grading results in its own
+# memory, so with a message queue every change is also published as a
+# CACHE_CHANGE_EVENT that the other workers apply (see SlowConsumerManager.emit).
+# Other workers only drop what they cached, except for chat messages and
+# grading results, which they add. Leaving a group is published the same way
+# so every worker detaches the user's sockets from that group's chat.
+CACHE_CHANGE_EVENT = 'cache_change'
+CACHE_CHANGE_MAX_IDS = 1000  # longer user lists are published as "forget every count"
+WORKER_ID = uuid.uuid4().hex
+
+def publish_cache_change(kind, *args):
+    if socketio and SOCKETIO_MESSAGE_QUEUE:
+        socketio.emit(CACHE_CHANGE_EVENT, {'worker': WORKER_ID, 'kind': kind, 'args': list(args)},
+                      to=CACHE_CHANGE_EVENT)
+
+def apply_cache_change(change):
+    """Apply a cache change published by another worker"""
+    if not isinstance(change, dict) or change.get('worker') == WORKER_ID:
+        return
+    kind, args = change.get('kind'), change.get('args') or []
+    if kind == 'exercise':
+        drop_cached_exercise(*args)
+    elif kind == 'unread':
+        drop_unread_counts(*args)
+    elif kind == 'chat':
+        append_chat_buffer(*args)
+    elif kind == 'grading':
+        store_grading_result(*args)
+    elif kind == 'group_left':
+        close_member_chats(*args)
+
 # Database initialization
 def init_db():
     conn = sqlite3.connect('coachedual.db')
@@ -50,7 +377,8 @@ def init_db():
         city TEXT,
         avatar TEXT DEFAULT 'default-avatar.png',
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        is_admin BOOLEAN DEFAULT FALSE
+        is_admin BOOLEAN DEFAULT FALSE,
+        is_teacher BOOLEAN DEFAULT FALSE
     )''')
 
     # Contests table
@@ -197,6 +525,124 @@ def init_db():
         FOREIGN KEY (user_id) REFERENCES users (id)
     )''')
 
+    # Solved exercises table (one row per user and exercise, first solve only)
+    c.execute('''CREATE TABLE IF NOT EXISTS solved_exercises (
+        user_id INTEGER NOT NULL,
+        exercise_id INTEGER NOT NULL,
+        solved_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, exercise_id),
+        FOREIGN KEY (user_id) REFERENCES users (id),
+        FOREIGN KEY (exercise_id) REFERENCES exercises (id)
+    )''')
+
+    # Backfill solves from correct submissions made before the table existed
+    c.execute('''INSERT OR IGNORE INTO solved_exercises (user_id, exercise_id, solved_at)
+                 SELECT user_id, exercise_id, MIN(submitted_at) FROM exercise_submissions
+                 WHERE is_correct GROUP BY user_id, exercise_id''')
+
+    # Per-user progress summary, maintained incrementally on each submission
+    c.execute('''CREATE TABLE IF NOT EXISTS user_progress (
+        user_id INTEGER PRIMARY KEY,
+        attempts INTEGER DEFAULT 0,
+        correct_attempts INTEGER DEFAULT 0,
+        solved_total INTEGER DEFAULT 0,
+        solved_by_subject TEXT DEFAULT '{}',
+        solved_by_difficulty TEXT DEFAULT '{}',
+        current_streak INTEGER DEFAULT 0,
+        best_streak INTEGER DEFAULT 0,
+        last_active_date TEXT,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+
+    # Persistent tier of the chatbot answer cache
+    c.execute('''CREATE TABLE IF NOT EXISTS chatbot_cache (
+        prompt_key TEXT PRIMARY KEY,
+        prompt TEXT NOT NULL,
+        response TEXT NOT NULL,
+        hits INTEGER DEFAULT 0,
+        created_at REAL NOT NULL,
+        last_hit_at REAL NOT NULL
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_chatbot_cache_last_hit ON chatbot_cache (last_hit_at)')
+
+    # Notification tabs are paged per user by id
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notifications_user ON notifications (user_id, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notifications_unread ON notifications (user_id, is_read, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_notifications_type ON notifications (user_id, type, id)')
+
+    # Title, message and data shared by every row of one audience fan-out
+    c.execute('''CREATE TABLE IF NOT EXISTS notification_payloads (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        title TEXT NOT NULL,
+        message TEXT NOT NULL,
+        data TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''')
+
+    # Batch generation of practice exercises by the LLM
+    c.execute('''CREATE TABLE IF NOT EXISTS generation_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        created_by INTEGER NOT NULL,
+        subject TEXT NOT NULL,
+        difficulty TEXT NOT NULL,
+        topic TEXT,
+        requested INTEGER NOT NULL,
+        generated INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        status TEXT DEFAULT 'pending',
+        error TEXT,
+        owner TEXT,
+        heartbeat_at TIMESTAMP,
+        cancel_requested INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (created_by) REFERENCES users (id)
+    )''')
+
+    # Chat history is paged per user by id; old conversations move to chat_archives
+    c.execute('CREATE INDEX IF NOT EXISTS idx_chat_messages_user ON chat_messages (user_id, id)')
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_archives (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        first_message_id INTEGER NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        message_count INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_chat_archives_user ON chat_archives (user_id, last_message_id)')
+
+    # Group chat messages, written in batches by group_chat_writer
+    c.execute('''CREATE TABLE IF NOT EXISTS group_chat_messages (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        group_id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (group_id) REFERENCES groups (id),
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_group_chat_messages_group ON group_chat_messages (group_id, id)')
+
+    # Rolling summary of older chatbot turns, one row per user
+    c.execute('''CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id INTEGER PRIMARY KEY,
+        summary TEXT NOT NULL,
+        last_message_id INTEGER NOT NULL,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (user_id) REFERENCES users (id)
+    )''')
+
+    c.execute('CREATE INDEX IF NOT EXISTS idx_exercises_created_by ON exercises (created_by, created_at)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_contests_status ON contests (status, created_at)')
+
+    # Older databases were created before these exercise columns existed
+    ensure_exercise_columns(c)
+    ensure_notification_columns(c)
+    ensure_generation_job_columns(c)
+
     # Insert default scores for existing users
     c.execute('''INSERT OR IGNORE INTO user_scores (user_id, subject, score, exercises_solved)
                  SELECT id, 'overall', 0, 0 FROM users''')
@@ -204,6 +650,40 @@ def init_db():
     conn.commit()
     conn.close()
 
+def ensure_exercise_columns(cursor):
+    """Add exercise columns that are missing from older databases"""
+    cursor.execute("PRAGMA table_info(exercises)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    if 'detailed_solution' not in columns:
+        cursor.execute('ALTER TABLE exercises ADD COLUMN detailed_solution TEXT')
+    if 'hints' not in columns:
+        cursor.execute('ALTER TABLE exercises ADD COLUMN hints TEXT')
+    if 'created_by' not in columns:
+        cursor.execute('ALTER TABLE exercises ADD COLUMN created_by INTEGER')
+        cursor.execute('UPDATE exercises SET created_by = -1 WHERE created_by IS NULL') # Set default for existing rows if necessary
+
+def ensure_notification_columns(cursor):
+    """Add notification columns that are missing from older databases"""
+    cursor.execute("PRAGMA table_info(notifications)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    if 'payload_id' not in columns:
+        cursor.execute('ALTER TABLE notifications ADD COLUMN payload_id INTEGER REFERENCES notification_payloads (id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_notifications_payload ON notifications (payload_id)')
+
+def ensure_generation_job_columns(cursor):
+    """Add generation job columns that are missing from older databases"""
+    cursor.execute("PRAGMA table_info(generation_jobs)")
+    columns = [column[1] for column in cursor.fetchall()]
+
+    if 'owner' not in columns:
+        cursor.execute('ALTER TABLE generation_jobs ADD COLUMN owner TEXT')
+    if 'heartbeat_at' not in columns:
+        cursor.execute('ALTER TABLE generation_jobs ADD COLUMN heartbeat_at TIMESTAMP')
+    if 'cancel_requested' not in columns:
+        cursor.execute('ALTER TABLE generation_jobs ADD COLUMN cancel_requested INTEGER DEFAULT 0')
+
 # Helper functions
 def get_db_connection():
     conn = sqlite3.connect('coachedual.db')
@@ -213,6 +693,268 @@ def get_db_connection():
 def hash_password(password):
     return hashlib.sha256(password.encode()).hexdigest()
 
+# Exercise cache shared by the detail page, the exercise API and submissions.
+# The lock only guards dictionary operations (no I/O while held), so it is
+# safe both under eventlet and with real threads.
+EXERCISE_CACHE_SIZE = int(os.environ.get('EXERCISE_CACHE_SIZE', 512))
+EXERCISE_CACHE_TTL = float(os.environ.get('EXERCISE_CACHE_TTL', 300))
+
+exercise_cache = OrderedDict()
+exercise_cache_lock = threading.Lock()
+exercise_cache_generation = 0
+exercise_cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+def get_exercise(exercise_id):
+    """Get an exercise (with author_name) as a dict, reading through the cache"""
+    try:
+        exercise_id = int(exercise_id)
+    except (TypeError, ValueError):
+        return None
+
+    now = time.monotonic()
+    with exercise_cache_lock:
+        entry = exercise_cache.get(exercise_id)
+        if entry and entry[0] > now:
+            exercise_cache.move_to_end(exercise_id)
+            exercise_cache_stats['hits'] += 1
+            return entry[1]
+        exercise_cache_stats['misses'] += 1
+        generation = exercise_cache_generation
+
+    conn = get_db_connection()
+    row = conn.execute(
+        'SELECT e.*, u.username as author_name FROM exercises e LEFT JOIN users u ON e.created_by = u.id WHERE e.id = ?',
+        (exercise_id,)
+    ).fetchone()
+    conn.close()
+
+    if not row:
+        return None
+
+    exercise = dict(row)
+    with exercise_cache_lock:
+        # Skip the store if the exercise was invalidated while we were reading
+        if generation == exercise_cache_generation:
+            exercise_cache[exercise_id] = (now + EXERCISE_CACHE_TTL, exercise)
+            exercise_cache.move_to_end(exercise_id)
+            while len(exercise_cache) > EXERCISE_CACHE_SIZE:
+                exercise_cache.popitem(last=False)
+                exercise_cache_stats['evictions'] += 1
+    return exercise
+
+def invalidate_exercise(exercise_id):
+    """Drop an exercise from the cache of every worker after it was edited or deleted"""
+    drop_cached_exercise(int(exercise_id))
+    publish_cache_change('exercise', int(exercise_id))
+
+def drop_cached_exercise(exercise_id):
+    global exercise_cache_generation
+    with exercise_cache_lock:
+        exercise_cache_generation += 1
+        exercise_cache.pop(exercise_id, None)
+        exercise_cache_stats['invalidations'] += 1
+
+def get_exercise_cache_stats():
+    """Get hit-rate statistics for the exercise cache"""
+    with exercise_cache_lock:
+        stats = dict(exercise_cache_stats)
+        stats['size'] = len(exercise_cache)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = round(stats['hits'] / lookups, 4) if lookups else 0.0
+    return stats
+
+# Per-user solved-exercise index: one bytearray bitmap per user, indexed by
+# exercise id, backed by the solved_exercises table and loaded on first use
+SOLVED_CACHE_USERS = int(os.environ.get('SOLVED_CACHE_USERS', 10000))
+
+solved_bitmaps = OrderedDict()
+solved_lock = threading.Lock()
+solved_generation = 0
+
+def bitmap_has(bitmap, exercise_id):
+    byte_index = exercise_id >> 3
+    return byte_index < len(bitmap) and bool(bitmap[byte_index] & (1 << (exercise_id & 7)))
+
+def _bitmap_set(bitmap, exercise_id):
+    byte_index = exercise_id >> 3
+    if byte_index >= len(bitmap):
+        bitmap.extend(bytes(byte_index + 1 - len(bitmap)))
+    bitmap[byte_index] |= 1 << (exercise_id & 7)
+
+def get_solved_bitmap(user_id):
+    """Get the solved-exercise bitmap for a user, loading it from the database on a miss"""
+    with solved_lock:
+        bitmap = solved_bitmaps.get(user_id)
+        if bitmap is not None:
+            solved_bitmaps.move_to_end(user_id)
+            return bitmap
+        generation = solved_generation
+
+    conn = get_db_connection()
+    rows = conn.execute('SELECT exercise_id FROM solved_exercises WHERE user_id = ?', (user_id,)).fetchall()
+    conn.close()
+
+    bitmap = bytearray()
+    for row in rows:
+        _bitmap_set(bitmap, row['exercise_id'])
+
+    with solved_lock:
+        # A solve recorded while we were reading would be missing from our copy
+        if generation == solved_generation:
+            solved_bitmaps[user_id] = bitmap
+            while len(solved_bitmaps) > SOLVED_CACHE_USERS:
+                solved_bitmaps.popitem(last=False)
+    return bitmap
+
+def is_exercise_solved(user_id, exercise_id):
+    return bitmap_has(get_solved_bitmap(user_id), int(exercise_id))
+
+def mark_exercise_solved(conn, user_id, exercise_id):
+    """Record a solve; return True only the first time this user solves the exercise"""
+    if is_exercise_solved(user_id, exercise_id):
+        return False
+
+    cursor = conn.execute(
+        'INSERT OR IGNORE INTO solved_exercises (user_id, exercise_id) VALUES (?, ?)',
+        (user_id, exercise_id)
+    )
+    newly_solved = cursor.rowcount == 1
+
+    global solved_generation
+    with solved_lock:
+        solved_generation += 1
+        bitmap = solved_bitmaps.get(user_id)
+        if bitmap is not None:
+            _bitmap_set(bitmap, int(exercise_id))
+    return newly_solved
+
+def forget_solved_exercise(exercise_id):
+    """Clear a deleted exercise from every cached bitmap"""
+    global solved_generation
+    exercise_id = int(exercise_id)
+    with solved_lock:
+        solved_generation += 1
+        for bitmap in solved_bitmaps.values():
+            if bitmap_has(bitmap, exercise_id):
+                bitmap[exercise_id >> 3] &= ~(1 << (exercise_id & 7)) & 0xFF
+
+def mark_solved_exercises(user_id, exercises):
+    """Return exercise rows as dicts with an is_solved flag for listings"""
+    bitmap = get_solved_bitmap(user_id)
+    return [dict(exercise, is_solved=bitmap_has(bitmap, exercise['id'])) for exercise in exercises]
+
+# Per-user progress summary. Streaks count consecutive (UTC) days with at
+# least one submission, matching the CURRENT_TIMESTAMP used by submissions.
+PROFILE_EXERCISE_LIMIT = 20
+
+def _utc_today():
+    return datetime.datetime.now(datetime.timezone.utc).date()
+
+def rebuild_user_progress(conn, user_id):
+    """Recompute a user's progress row from their full history"""
+    counts = conn.execute('''
+        SELECT COUNT(*) as attempts, COALESCE(SUM(is_correct), 0) as correct_attempts
+        FROM exercise_submissions WHERE user_id = ?
+    ''', (user_id,)).fetchone()
+
+    solved_by_subject = {}
+    solved_by_difficulty = {}
+    solved_total = 0
+    for row in conn.execute('''
+        SELECT e.subject, e.difficulty, COUNT(*) as solved
+        FROM solved_exercises s JOIN exercises e ON s.exercise_id = e.id
+        WHERE s.user_id = ?
+        GROUP BY e.subject, e.difficulty
+    ''', (user_id,)):
+        solved_by_subject[row['subject']] = solved_by_subject.get(row['subject'], 0) + row['solved']
+        solved_by_difficulty[row['difficulty']] = solved_by_difficulty.get(row['difficulty'], 0) + row['solved']
+        solved_total += row['solved']
+
+    current_streak = best_streak = 0
+    previous_day = None
+    for row in conn.execute('''
+        SELECT DISTINCT date(submitted_at) as day FROM exercise_submissions
+        WHERE user_id = ? ORDER BY day
+    ''', (user_id,)):
+        day = datetime.date.fromisoformat(row['day'])
+        if previous_day and day - previous_day == datetime.timedelta(days=1):
+            current_streak += 1
+        else:
+            current_streak = 1
+        best_streak = max(best_streak, current_streak)
+        previous_day = day
+
+    conn.execute('''
+        INSERT OR REPLACE INTO user_progress
+        (user_id, attempts, correct_attempts, solved_total, solved_by_subject, solved_by_difficulty,
+         current_streak, best_streak, last_active_date, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ''', (user_id, counts['attempts'], counts['correct_attempts'], solved_total,
+          json.dumps(solved_by_subject), json.dumps(solved_by_difficulty),
+          current_streak, best_streak, previous_day.isoformat() if previous_day else None))
+
+def record_submission_progress(conn, user_id, exercise, is_correct, newly_solved):
+    """Fold one submission into the user's progress row
+
+    Must run on the connection that already inserted the submission, before
+    commit, so concurrent submissions from the same user are serialized by
+    the write lock.
+    """
+    progress = conn.execute('SELECT * FROM user_progress WHERE user_id = ?', (user_id,)).fetchone()
+    if not progress:
+        # First submission since the table was added; history includes this one
+        rebuild_user_progress(conn, user_id)
+        return
+
+    today = _utc_today()
+    if progress['last_active_date'] == today.isoformat():
+        current_streak = progress['current_streak']
+    elif progress['last_active_date'] == (today - datetime.timedelta(days=1)).isoformat():
+        current_streak = progress['current_streak'] + 1
+    else:
+        current_streak = 1
+
+    solved_by_subject = json.loads(progress['solved_by_subject'] or '{}')
+    solved_by_difficulty = json.loads(progress['solved_by_difficulty'] or '{}')
+    if newly_solved:
+        solved_by_subject[exercise['subject']] = solved_by_subject.get(exercise['subject'], 0) + 1
+        solved_by_difficulty[exercise['difficulty']] = solved_by_difficulty.get(exercise['difficulty'], 0) + 1
+
+    conn.execute('''
+        UPDATE user_progress SET
+            attempts = attempts + 1,
+            correct_attempts = correct_attempts + ?,
+            solved_total = solved_total + ?,
+            solved_by_subject = ?,
+            solved_by_difficulty = ?,
+            current_streak = ?,
+            best_streak = MAX(best_streak, ?),
+            last_active_date = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE user_id = ?
+    ''', (int(bool(is_correct)), int(bool(newly_solved)),
+          json.dumps(solved_by_subject), json.dumps(solved_by_difficulty),
+          current_streak, current_streak, today.isoformat(), user_id))
+
+def get_user_progress(conn, user_id):
+    """Read a user's progress summary with one primary-key lookup"""
+    progress = conn.execute('SELECT * FROM user_progress WHERE user_id = ?', (user_id,)).fetchone()
+    if not progress:
+        rebuild_user_progress(conn, user_id)
+        conn.commit()
+        progress = conn.execute('SELECT * FROM user_progress WHERE user_id = ?', (user_id,)).fetchone()
+
+    progress = dict(progress)
+    progress['solved_by_subject'] = json.loads(progress['solved_by_subject'] or '{}')
+    progress['solved_by_difficulty'] = json.loads(progress['solved_by_difficulty'] or '{}')
+    progress['accuracy'] = round(100 * progress['correct_attempts'] / progress['attempts']) if progress['attempts'] else 0
+
+    # A streak is broken once a full day passes without activity
+    yesterday = (_utc_today() - datetime.timedelta(days=1)).isoformat()
+    if not progress['last_active_date'] or progress['last_active_date'] < yesterday:
+        progress['current_streak'] = 0
+    return progress
+
 # Global variables for real-time updates
 ranking_cache = {}
 last_update_time = time.time()
@@ -284,16 +1026,97 @@ def auto_save_data():
 
         time.sleep(1)  # Update every second
 
+# Leader election between worker processes. The worker holding an exclusive
+# lock on LEADER_LOCK_FILE runs the periodic jobs that must exist only once;
+# the OS releases the lock when that process dies and a standby takes over.
+LEADER_LOCK_FILE = os.environ.get('LEADER_LOCK_FILE', 'coachedual.leader.lock')
+LEADER_RETRY_INTERVAL = 5
+
+leader_lock_file = None
+
+def try_become_leader():
+    """Take the leader lock without blocking; True if this process holds it"""
+    global leader_lock_file
+    if leader_lock_file:
+        return True
+
+    handle = open(LEADER_LOCK_FILE, 'a+')
+    try:
+        if fcntl:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            handle.seek(0)
+            msvcrt.locking(handle.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        handle.close()
+        return False
+
+    # Kept open for the life of the process: closing it would release the lock
+    leader_lock_file = handle
+    return True
+
+def is_leader():
+    return leader_lock_file is not None
+
+def leader_election_loop():
+    """Wait until this worker is the leader, then start the once-only jobs"""
+    while not try_become_leader():
+        background_sleep(LEADER_RETRY_INTERVAL)
+    print(f"Worker {os.getpid()} is running the periodic jobs")
+    start_leader_tasks()
+
 def start_background_tasks():
-    """Start background tasks for real-time updates"""
+    """Start background tasks for real-time updates
+
+    Tasks that serve this process's own queues and caches run in every
+    worker; periodic jobs run only in the elected leader.
+    """
+    # Listen to the message queue right away rather than after the first
+    # client connects, so cache changes from other workers always arrive
+    if socketio and SOCKETIO_MESSAGE_QUEUE and not socketio.server.manager_initialized:
+        socketio.server.manager_initialized = True
+        socketio.server.manager.initialize()
+
+    # Start grading workers
+    for _ in range(GRADING_WORKERS):
+        start_background_task(grading_worker)
+
+    # Start contest join writer
+    start_background_task(contest_join_writer)
+
+    # Start group chat writer
+    start_background_task(group_chat_writer)
+
+    # Start contest lifecycle scheduler (transitions are idempotent, so every
+    # worker can run one for the contests it schedules)
+    load_contest_schedule()
+    start_background_task(contest_scheduler_loop)
+
+    # Warm the exercise index used by the offline chatbot
+    start_background_task(load_exercise_index)
+
+    # Start leader election for the periodic jobs
+    start_background_task(leader_election_loop)
+
+def start_leader_tasks():
+    """Start the periodic jobs that must run in one process only"""
     # Start auto-save thread
     save_thread = threading.Thread(target=auto_save_data, daemon=True)
     save_thread.start()
 
-    # Start periodic ranking broadcast
+    # Start periodic ranking broadcast (reaches every worker's clients through the message queue)
     broadcast_thread = threading.Thread(target=periodic_ranking_broadcast, daemon=True)
     broadcast_thread.start()
 
+    # Resume exercise generation jobs whose worker stopped
+    start_background_task(generation_recovery_loop)
+
+    # Start chat history retention
+    start_background_task(chat_retention_loop)
+
+    # Start notification retention and digests
+    start_background_task(notification_compaction_loop)
+
 def periodic_ranking_broadcast():
     """Broadcast ranking updates every second"""
     while True:
@@ -304,48 +1127,384 @@ def periodic_ranking_broadcast():
             print(f"Broadcast error: {e}")
             time.sleep(1)
 
-def update_user_score(user_id, subject, score_change, exercises_change=0):
-    """Update user score and broadcast to all clients"""
+# Contest join admission control. Joins are checked against an in-memory
+# participant set per contest and persisted by a writer task in batches, so
+# a contest-start herd becomes a few large inserts instead of thousands of
+# check-then-insert transactions competing for the SQLite write lock.
+JOIN_QUEUE_SIZE = int(os.environ.get('JOIN_QUEUE_SIZE', 5000))
+JOIN_BATCH_SIZE = 500
+JOIN_RETRY_AFTER = 2
+
+contest_participant_sets = {}
+contest_join_queue = deque()
+contest_join_lock = threading.Lock()
+contest_join_wakeup = create_event()
+contest_join_stats = {'queued': 0, 'rejected': 0, 'persisted': 0, 'batches': 0}
+
+def get_contest_participant_set(contest_id):
+    """Get the participant set of a contest, or None if the contest doesn't exist"""
+    with contest_join_lock:
+        participants = contest_participant_sets.get(contest_id)
+    if participants is not None:
+        return participants
+
     conn = get_db_connection()
+    contest = conn.execute('SELECT status FROM contests WHERE id = ?', (contest_id,)).fetchone()
+    rows = conn.execute(
+        'SELECT user_id FROM contest_participants WHERE contest_id = ?', (contest_id,)
+    ).fetchall() if contest else []
+    conn.close()
+
+    if not contest:
+        return None
+
+    participants = {row['user_id'] for row in rows}
+    if contest['status'] == 'finished':
+        return participants  # Not kept in memory once the contest is over
+
+    with contest_join_lock:
+        return contest_participant_sets.setdefault(contest_id, participants)
+
+def admit_contest_join(user_id, contest_id):
+    """Admit a join; returns 'queued', 'already_joined', 'busy' or 'not_found'"""
+    participants = get_contest_participant_set(contest_id)
+    if participants is None:
+        return 'not_found'
+
+    with contest_join_lock:
+        if user_id in participants:
+            return 'already_joined'
+        if len(contest_join_queue) >= JOIN_QUEUE_SIZE:
+            contest_join_stats['rejected'] += 1
+            return 'busy'
+        participants.add(user_id)
+        contest_join_queue.append((user_id, contest_id, utc_now().strftime('%Y-%m-%d %H:%M:%S')))
+        contest_join_stats['queued'] += 1
+
+    contest_join_wakeup.set()
+    return 'queued'
+
+def contest_join_writer():
+    """Persist queued contest joins in batched transactions"""
+    while True:
+        contest_join_wakeup.wait(1)
+        contest_join_wakeup.clear()
 
-    # Update or insert user score
+        while True:
+            with contest_join_lock:
+                batch = [contest_join_queue.popleft()
+                         for _ in range(min(JOIN_BATCH_SIZE, len(contest_join_queue)))]
+            if not batch:
+                break
+
+            conn = get_db_connection()
+            try:
+                # Joins still queued for a contest deleted in the meantime are skipped
+                cursor = conn.executemany('''
+                    INSERT OR IGNORE INTO contest_participants (user_id, contest_id, joined_at)
+                    SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM contests WHERE id = ?)
+                ''', [(user_id, contest_id, joined_at, contest_id) for user_id, contest_id, joined_at in batch])
+                conn.commit()
+                with contest_join_lock:
+                    contest_join_stats['persisted'] += cursor.rowcount
+                    contest_join_stats['batches'] += 1
+                for user_id in {user_id for user_id, _, _ in batch}:
+                    refresh_audience_rooms(user_id)
+            except sqlite3.Error as e:
+                print(f"Contest join write error: {e}")
+                # Put the batch back in order and retry after a short pause
+                with contest_join_lock:
+                    contest_join_queue.extendleft(reversed(batch))
+                background_sleep(0.5)
+            finally:
+                conn.close()
+
+def get_contest_join_stats():
+    with contest_join_lock:
+        return dict(contest_join_stats, queue_depth=len(contest_join_queue),
+                    active_contests=len(contest_participant_sets))
+
+# Contest lifecycle scheduler. Contest times are compared in UTC, like the
+# datetime('now') checks and CURRENT_TIMESTAMP columns elsewhere.
+CONTEST_SCHEDULER_MAX_WAIT = 60
+
+contest_schedule = []  # heap of (when, sequence, contest_id, status)
+contest_schedule_lock = threading.Lock()
+contest_schedule_sequence = 0
+contest_schedule_wakeup = create_event()
+
+CONTEST_PREVIOUS_STATUSES = {
+    'ongoing': ('upcoming',),
+    'finished': ('upcoming', 'ongoing'),
+}
+
+def utc_now():
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+def parse_contest_time(value):
+    """Parse a stored contest time (datetime-local or SQLite format)"""
+    if not value:
+        return None
+    try:
+        return datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+def contest_status_at(start_time, end_time, now):
+    if start_time and now < start_time:
+        return 'upcoming'
+    if end_time is None or now < end_time:
+        return 'ongoing'
+    return 'finished'
+
+def schedule_contest(contest_id, start_time, end_time):
+    """Queue the future status transitions of a contest"""
+    global contest_schedule_sequence
+    now = utc_now()
+    with contest_schedule_lock:
+        for when, status in ((start_time, 'ongoing'), (end_time, 'finished')):
+            if when and when > now:
+                contest_schedule_sequence += 1
+                heapq.heappush(contest_schedule, (when, contest_schedule_sequence, contest_id, status))
+    contest_schedule_wakeup.set()
+
+def apply_contest_transition(contest_id, status):
+    """Move a contest to a new status; hooks run only for the call that changed it"""
+    previous = CONTEST_PREVIOUS_STATUSES[status]
+    conn = get_db_connection()
+    cursor = conn.execute(
+        f'''UPDATE contests SET status = ? WHERE id = ? AND status IN ({','.join('?' * len(previous))})''',
+        (status, contest_id, *previous)
+    )
+    conn.commit()
+    conn.close()
+
+    if cursor.rowcount != 1:
+        return False
+
+    if status == 'ongoing':
+        on_contest_started(contest_id)
+    else:
+        on_contest_finished(contest_id)
+
+    if socketio:
+        socketio.emit('contest_status', {'contest_id': contest_id, 'status': status})
+    return True
+
+def load_contest_schedule():
+    """Bring stored statuses up to date and schedule the remaining transitions"""
+    conn = get_db_connection()
+    contests = conn.execute(
+        "SELECT id, start_time, end_time, status FROM contests WHERE status != 'finished'"
+    ).fetchall()
+    conn.close()
+
+    now = utc_now()
+    for contest in contests:
+        start_time = parse_contest_time(contest['start_time'])
+        end_time = parse_contest_time(contest['end_time'])
+        status = contest_status_at(start_time, end_time, now)
+
+        if status != contest['status']:
+            try:
+                apply_contest_transition(contest['id'], status)
+            except Exception as e:
+                print(f"Contest transition error: {e}")
+        schedule_contest(contest['id'], start_time, end_time)
+
+def contest_scheduler_loop():
+    """Sleep until the next contest transition is due and apply it"""
+    while True:
+        contest_schedule_wakeup.clear()
+        now = utc_now()
+        due = []
+        with contest_schedule_lock:
+            while contest_schedule and contest_schedule[0][0] <= now:
+                due.append(heapq.heappop(contest_schedule))
+            next_when = contest_schedule[0][0] if contest_schedule else None
+
+        for _, _, contest_id, status in due:
+            try:
+                apply_contest_transition(contest_id, status)
+            except Exception as e:
+                print(f"Contest transition error: {e}")
+
+        timeout = CONTEST_SCHEDULER_MAX_WAIT
+        if next_when:
+            timeout = min(timeout, max((next_when - utc_now()).total_seconds(), 0))
+        contest_schedule_wakeup.wait(timeout)
+
+def on_contest_started(contest_id):
+    """Hook run once when a contest starts"""
+    conn = get_db_connection()
+    contest = conn.execute('SELECT title FROM contests WHERE id = ?', (contest_id,)).fetchone()
+    conn.close()
+
+    notify_audience('contest', contest_id, 'Cuộc thi đã bắt đầu',
+                    f"Cuộc thi \"{contest['title']}\" đã bắt đầu. Chúc bạn thi tốt!",
+                    'contest', {'contest_id': contest_id})
+
+def on_contest_finished(contest_id):
+    """Hook run once when a contest ends: finalize the scoreboard"""
+    with contest_join_lock:
+        contest_participant_sets.pop(contest_id, None)
+
+    conn = get_db_connection()
+    contest = conn.execute('SELECT title, start_time, end_time FROM contests WHERE id = ?', (contest_id,)).fetchone()
+
+    # Score = points of the contest exercises solved during the contest window
+    conn.execute('''
+        UPDATE contest_participants SET completed = TRUE, score = (
+            SELECT COALESCE(SUM(ce.points), 0) FROM contest_exercises ce
+            WHERE ce.contest_id = contest_participants.contest_id AND EXISTS (
+                SELECT 1 FROM exercise_submissions s
+                WHERE s.user_id = contest_participants.user_id AND s.exercise_id = ce.exercise_id
+                  AND s.is_correct AND s.submitted_at >= ? AND s.submitted_at <= ?
+            )
+        )
+        WHERE contest_id = ?
+    ''', (str(parse_contest_time(contest['start_time']) or '0001-01-01'),
+          str(parse_contest_time(contest['end_time']) or '9999-12-31'),
+          contest_id))
+    conn.commit()
+
+    # Each participant gets their own score, so these rows cannot share a payload
+    participants = conn.execute(
+        'SELECT user_id, score FROM contest_participants WHERE contest_id = ?', (contest_id,)
+    ).fetchall()
+    user_ids = insert_notifications(conn, (
+        (participant['user_id'], 'Cuộc thi đã kết thúc',
+         f"Cuộc thi \"{contest['title']}\" đã kết thúc. Điểm của bạn: {participant['score']}",
+         'contest', {'contest_id': contest_id, 'score': participant['score']})
+        for participant in participants))
+    conn.commit()
+    conn.close()
+    adjust_unread_counts(user_ids, 1)
+
+    if socketio and user_ids and room_reachable(f'contest_{contest_id}'):
+        socketio.emit('new_notification', {
+            'title': 'Cuộc thi đã kết thúc',
+            'message': f"Cuộc thi \"{contest['title']}\" đã kết thúc. Xem điểm của bạn trong thông báo.",
+            'type': 'contest'
+        }, room=f'contest_{contest_id}')
+
+def apply_score_change(conn, user_id, subject, score_change, exercises_change=0):
+    """Add to a user's subject and overall scores on an open connection"""
+    # Update or insert user score. An upsert keeps the row's id, which the
+    # keyset-paginated score export relies on (INSERT OR REPLACE would
+    # give the row a new id and export it twice)
     conn.execute('''
-        INSERT OR REPLACE INTO user_scores (user_id, subject, score, exercises_solved, last_updated)
-        VALUES (?, ?, 
-                COALESCE((SELECT score FROM user_scores WHERE user_id = ? AND subject = ?), 0) + ?,
-                COALESCE((SELECT exercises_solved FROM user_scores WHERE user_id = ? AND subject = ?), 0) + ?,
-                CURRENT_TIMESTAMP)
-    ''', (user_id, subject, user_id, subject, score_change, user_id, subject, exercises_change))
+        INSERT INTO user_scores (user_id, subject, score, exercises_solved, last_updated)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT(user_id, subject) DO UPDATE SET
+            score = score + excluded.score,
+            exercises_solved = exercises_solved + excluded.exercises_solved,
+            last_updated = CURRENT_TIMESTAMP
+    ''', (user_id, subject, score_change, exercises_change))
 
     # Also update overall score
     if subject != 'overall':
         conn.execute('''
-            INSERT OR REPLACE INTO user_scores (user_id, subject, score, exercises_solved, last_updated)
-            VALUES (?, 'overall', 
-                    COALESCE((SELECT score FROM user_scores WHERE user_id = ? AND subject = 'overall'), 0) + ?,
-                    COALESCE((SELECT exercises_solved FROM user_scores WHERE user_id = ? AND subject = 'overall'), 0) + ?,
-                    CURRENT_TIMESTAMP)
-        ''', (user_id, user_id, score_change, user_id, exercises_change))
+            INSERT INTO user_scores (user_id, subject, score, exercises_solved, last_updated)
+            VALUES (?, 'overall', ?, ?, CURRENT_TIMESTAMP)
+            ON CONFLICT(user_id, subject) DO UPDATE SET
+                score = score + excluded.score,
+                exercises_solved = exercises_solved + excluded.exercises_solved,
+                last_updated = CURRENT_TIMESTAMP
+        ''', (user_id, score_change, exercises_change))
 
+def update_user_score(user_id, subject, score_change, exercises_change=0):
+    """Update user score and broadcast to all clients"""
+    conn = get_db_connection()
+    apply_score_change(conn, user_id, subject, score_change, exercises_change)
     conn.commit()
     conn.close()
 
     # Broadcast updated rankings to all clients
     broadcast_ranking_update()
 
-def broadcast_ranking_update():
-    """Broadcast ranking updates to all connected clients"""
-    if not socketio:
-        return  # Skip if SocketIO is disabled
-
-    subjects = ['overall', 'math', 'physics', 'chemistry', 'biology', 'literature', 'english']
-
-    for subject in subjects:
-        rankings = get_current_rankings(subject)
-        ranking_data = []
-
-        for ranking in rankings:
-            ranking_data.append({
+# Ranking broadcasts are negotiated per client. 'json' is the original list
+# of row objects; 'columnar' sends parallel id/score/solved arrays with rank
+# implied by position, plus [id, username, full_name, school, city] entries
+# only for users the previous broadcast hadn't described (clients keep the
+# dictionary and ask for unknown ids with 'ranking_users'); 'msgpack' and
+# 'deflate' carry the same columnar frame as binary MessagePack or
+# zlib-compressed JSON. Frames are encoded once per format and only for
+# formats somebody is subscribed to.
+RANKING_SUBJECTS = ['overall', 'math', 'physics', 'chemistry', 'biology', 'literature', 'english']
+RANKING_FORMATS = [fmt for fmt in os.environ.get('RANKING_FORMATS', 'deflate,msgpack,columnar,json').split(',')
+                   if fmt in ('json', 'columnar', 'deflate') or (fmt == 'msgpack' and msgpack)]
+RANKING_EVENTS = {'json': 'ranking_update', 'columnar': 'ranking_columns',
+                  'msgpack': 'ranking_msgpack', 'deflate': 'ranking_deflate'}
+# Only full 'json' frames can stand in for older ones: a compact frame only
+# describes users its predecessors hadn't, so replacing one loses those entries
+CONFLATED_EVENTS = {RANKING_EVENTS['json']}
+RANKING_ROOMS = {'json': 'ranking_room', 'columnar': 'ranking_room_columnar',
+                 'msgpack': 'ranking_room_msgpack', 'deflate': 'ranking_room_deflate'}
+RANKING_DEFLATE_LEVEL = 6
+RANKING_USERS_LIMIT = 5000
+
+ranking_lock = threading.Lock()
+ranking_subscribers = {}
+ranking_dictionary = {}
+
+def choose_ranking_format(offered):
+    """Pick the server's preferred format among those a client can decode"""
+    if not isinstance(offered, list):
+        return 'json'  # clients from before negotiation existed
+    for fmt in RANKING_FORMATS:
+        if fmt in offered:
+            return fmt
+    return 'json'
+
+def subscribe_ranking(sid, fmt):
+    """Record which format a socket receives; returns its previous format"""
+    with ranking_lock:
+        previous = ranking_subscribers.get(sid)
+        ranking_subscribers[sid] = fmt
+        return previous
+
+def unsubscribe_ranking(sid):
+    with ranking_lock:
+        return ranking_subscribers.pop(sid, None)
+
+def active_ranking_formats():
+    """Formats to encode this tick; every worker's subscribers count when a queue is shared"""
+    if SOCKETIO_MESSAGE_QUEUE:
+        return set(RANKING_FORMATS) | {'json'}
+    with ranking_lock:
+        return set(ranking_subscribers.values())
+
+def ranking_user_entry(ranking):
+    return [ranking['id'], ranking['username'], ranking['full_name'], ranking['school'], ranking['city']]
+
+def build_ranking_frame(subject, rankings, known_users=None):
+    """Columnar frame for a subject, describing users missing from `known_users`
+
+    `known_users` maps user id to the entry clients already have and is
+    updated in place; None describes every user (a fresh client's snapshot).
+    """
+    users = []
+    for ranking in rankings:
+        entry = ranking_user_entry(ranking)
+        if known_users is None or known_users.get(entry[0]) != entry:
+            users.append(entry)
+            if known_users is not None:
+                known_users[entry[0]] = entry
+    return {
+        'subject': subject,
+        'users': users,
+        'id': [ranking['id'] for ranking in rankings],
+        'score': [ranking['total_score'] for ranking in rankings],
+        'solved': [ranking['exercises_solved'] for ranking in rankings]
+    }
+
+def encode_ranking_frame(subject, rankings, frame, fmt):
+    """Payload for one format; `frame` is the columnar frame of the same rankings"""
+    if fmt == 'json':
+        return {
+            'subject': subject,
+            'rankings': [{
                 'rank': ranking['rank'],
                 'username': ranking['username'],
                 'full_name': ranking['full_name'],
@@ -353,32 +1512,574 @@ def broadcast_ranking_update():
                 'city': ranking['city'],
                 'score': ranking['total_score'],
                 'exercises_solved': ranking['exercises_solved']
+            } for ranking in rankings]
+        }
+    if fmt == 'msgpack':
+        return {'subject': subject, 'frame': msgpack.packb(frame)}
+    if fmt == 'deflate':
+        return {'subject': subject,
+                'frame': zlib.compress(json.dumps(frame, ensure_ascii=False, separators=(',', ':')).encode(),
+                                       RANKING_DEFLATE_LEVEL)}
+    return frame
+
+def get_ranking_subscriber_stats():
+    with ranking_lock:
+        counts = dict.fromkeys(RANKING_EVENTS, 0)
+        for fmt in ranking_subscribers.values():
+            counts[fmt] += 1
+        return counts
+
+def get_ranking_users(user_ids):
+    """Dictionary entries for ids a client saw in a frame but can't describe"""
+    if not isinstance(user_ids, list):
+        return []
+    # Slice before converting: the list comes straight from the client
+    user_ids = list(dict.fromkeys(int(user_id) for user_id in user_ids[:RANKING_USERS_LIMIT]))
+    conn = get_db_connection()
+    users = []
+    for i in range(0, len(user_ids), 500):
+        chunk = user_ids[i:i + 500]
+        users.extend(ranking_user_entry(row) for row in conn.execute(
+            f"SELECT id, username, full_name, school, city FROM users "
+            f"WHERE id IN ({','.join('?' * len(chunk))})", chunk))
+    conn.close()
+    return users
+
+def send_ranking_snapshot(fmt):
+    """Send the requesting socket every subject with all users described"""
+    for subject in RANKING_SUBJECTS:
+        rankings = get_current_rankings(subject)
+        frame = build_ranking_frame(subject, rankings) if fmt != 'json' else None
+        emit(RANKING_EVENTS[fmt], encode_ranking_frame(subject, rankings, frame, fmt))
+
+def broadcast_ranking_update():
+    """Broadcast ranking updates to all connected clients"""
+    if not socketio:
+        return  # Skip if SocketIO is disabled
+
+    formats = active_ranking_formats()
+    for subject in RANKING_SUBJECTS:
+        rankings = get_current_rankings(subject)
+
+        # Keep rank lookups around so pages like the profile don't re-rank everyone
+        ranking_cache[subject] = {ranking['id']: ranking['rank'] for ranking in rankings}
+
+        frame = None
+        if formats - {'json'}:
+            with ranking_lock:
+                frame = build_ranking_frame(subject, rankings, ranking_dictionary)
+        for fmt in formats:
+            socketio.emit(RANKING_EVENTS[fmt], encode_ranking_frame(subject, rankings, frame, fmt),
+                          room=RANKING_ROOMS[fmt])
+
+# Asynchronous grading pipeline. Submissions are acknowledged right away and
+# graded by worker tasks in batches (one transaction per batch); results are
+# pushed to the user's socket room and kept briefly for polling clients (in
+# every worker, since a poll may land on another one than the grader).
+GRADING_WORKERS = int(os.environ.get('GRADING_WORKERS', 2))
+GRADING_BATCH_SIZE = int(os.environ.get('GRADING_BATCH_SIZE', 100))
+GRADING_QUEUE_SIZE = int(os.environ.get('GRADING_QUEUE_SIZE', 10000))
+GRADING_RESULTS_KEPT = 5000
+
+grading_queue = deque()
+grading_lock = threading.Lock()
+grading_wakeup = create_event()
+grading_results = OrderedDict()
+grading_latencies = deque(maxlen=1000)
+grading_stats = {'enqueued': 0, 'graded': 0, 'rejected': 0, 'batches': 0, 'errors': 0}
+
+def enqueue_submission(user_id, exercise_id, answer):
+    """Queue a submission for grading; returns the job id or None when the queue is full"""
+    job = {
+        'job_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'exercise_id': exercise_id,
+        'answer': answer,
+        'enqueued_at': time.monotonic(),
+    }
+    with grading_lock:
+        if len(grading_queue) >= GRADING_QUEUE_SIZE:
+            grading_stats['rejected'] += 1
+            return None
+        grading_queue.append(job)
+        grading_stats['enqueued'] += 1
+    grading_wakeup.set()
+    return job['job_id']
+
+def grade_submissions(jobs):
+    """Grade and persist a batch of submissions in one transaction; return the results"""
+    results = []
+    conn = get_db_connection()
+    try:
+        for job in jobs:
+            exercise = get_exercise(job['exercise_id'])
+            if not exercise:
+                results.append({'job_id': job['job_id'], 'user_id': job['user_id'],
+                                'success': False, 'message': 'Exercise not found'})
+                continue
+
+            # Simple scoring logic - in real app, this would be more sophisticated
+            # Compare submitted answer with the correct answer from the database
+            is_correct = job['answer'].strip().lower() == (exercise['answer'] or '').strip().lower()
+
+            # Points are only awarded for the first correct submission
+            newly_solved = is_correct and mark_exercise_solved(conn, job['user_id'], exercise['id'])
+            score = exercise['points'] if newly_solved else 0
+
+            # Inserted before the progress update, which may rebuild from the submission history
+            conn.execute('''
+                INSERT INTO exercise_submissions (user_id, exercise_id, answer, score, is_correct)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (job['user_id'], exercise['id'], job['answer'], score, is_correct))
+            record_submission_progress(conn, job['user_id'], exercise, is_correct, newly_solved)
+            if newly_solved:
+                apply_score_change(conn, job['user_id'], exercise['subject'], score, 1)
+                message = 'Chính xác! Bạn được {} điểm!'.format(score)
+            elif is_correct:
+                message = 'Chính xác! Bạn đã giải bài này trước đó nên không được cộng thêm điểm.'
+            else:
+                message = 'Chưa đúng, hãy thử lại!'
+
+            results.append({
+                'job_id': job['job_id'],
+                'user_id': job['user_id'],
+                'success': True,
+                'is_correct': is_correct,
+                'already_solved': is_correct and not newly_solved,
+                'score': score,
+                'message': message,
+                'exercise': exercise # Include exercise details for frontend to display solution
             })
 
-        socketio.emit('ranking_update', {
-            'subject': subject,
-            'rankings': ranking_data
-        }, room='ranking_room')
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        # Solves marked in memory for this batch were never committed
+        with solved_lock:
+            for job in jobs:
+                solved_bitmaps.pop(job['user_id'], None)
+        raise
+    finally:
+        conn.close()
+
+    return results
+
+def store_grading_result(result):
+    with grading_lock:
+        grading_results[result['job_id']] = result
+        while len(grading_results) > GRADING_RESULTS_KEPT:
+            grading_results.popitem(last=False)
+
+def publish_grading_result(result, enqueued_at):
+    store_grading_result(result)
+    publish_cache_change('grading', result)
+    with grading_lock:
+        grading_latencies.append(time.monotonic() - enqueued_at)
+        grading_stats['graded'] += 1
+
+    if socketio:
+        socketio.emit('grading_result', result, room=f"user_{result['user_id']}")
+
+def grading_worker():
+    """Pull batches of submissions off the queue and grade them"""
+    while True:
+        with grading_lock:
+            batch = [grading_queue.popleft() for _ in range(min(GRADING_BATCH_SIZE, len(grading_queue)))]
+            if not batch:
+                grading_wakeup.clear()
+        if not batch:
+            grading_wakeup.wait(1)
+            continue
+
+        try:
+            results = grade_submissions(batch)
+        except Exception as e:
+            print(f"Grading error: {e}")
+            with grading_lock:
+                grading_stats['errors'] += 1
+            results = [{'job_id': job['job_id'], 'user_id': job['user_id'], 'success': False,
+                        'message': 'Có lỗi xảy ra khi chấm bài, vui lòng nộp lại!'} for job in batch]
+
+        with grading_lock:
+            grading_stats['batches'] += 1
+        for job, result in zip(batch, results):
+            publish_grading_result(result, job['enqueued_at'])
+
+def get_grading_stats():
+    with grading_lock:
+        latencies = sorted(grading_latencies)
+        stats = dict(grading_stats, queue_depth=len(grading_queue), workers=GRADING_WORKERS)
+
+    def percentile(fraction):
+        return round(latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] * 1000, 1) if latencies else 0.0
+
+    stats['latency_ms'] = {'p50': percentile(0.5), 'p99': percentile(0.99), 'max': percentile(1.0)}
+    return stats
+
+# Presence registry: live sockets per user and, per audience room, how many
+# of each user's sockets joined it. Only the socket handlers below write it;
+# everything else reads it to count online users or skip emits to offline ones.
+LAST_SEEN_SIZE = 10000
+
+presence_sids = {}  # user_id -> set of sids
+presence_by_sid = {}  # sid -> (user_id, rooms)
+room_presence = {}  # room -> {user_id: socket count}
+last_seen = OrderedDict()  # user_id -> time.time() of the last disconnect
+presence_lock = threading.Lock()
+
+def register_presence(user_id, sid, rooms):
+    with presence_lock:
+        if sid in presence_by_sid:
+            return
+        presence_by_sid[sid] = (user_id, rooms)
+        presence_sids.setdefault(user_id, set()).add(sid)
+        for room in rooms:
+            members = room_presence.setdefault(room, {})
+            members[user_id] = members.get(user_id, 0) + 1
+
+def unregister_presence(sid):
+    with presence_lock:
+        entry = presence_by_sid.pop(sid, None)
+        if not entry:
+            return
+        user_id, rooms = entry
+        sids = presence_sids.get(user_id)
+        sids.discard(sid)
+        if not sids:
+            del presence_sids[user_id]
+        for room in rooms:
+            members = room_presence[room]
+            members[user_id] -= 1
+            if not members[user_id]:
+                del members[user_id]
+                if not members:
+                    del room_presence[room]
+        last_seen[user_id] = time.time()
+        last_seen.move_to_end(user_id)
+        while len(last_seen) > LAST_SEEN_SIZE:
+            last_seen.popitem(last=False)
+
+def is_online(user_id):
+    with presence_lock:
+        return user_id in presence_sids
+
+def user_reachable(user_id):
+    """Whether an emit to the user's room can reach anyone
+
+    Presence is tracked per process, so with a message queue the user may
+    be connected to another worker and we have to emit anyway.
+    """
+    return bool(SOCKETIO_MESSAGE_QUEUE) or is_online(user_id)
+
+def room_reachable(room):
+    return bool(SOCKETIO_MESSAGE_QUEUE) or count_online(room) > 0
+
+def count_online(room):
+    """Distinct online users in an audience room such as 'group_3'"""
+    with presence_lock:
+        return len(room_presence.get(room, ()))
+
+def get_presence(user_id):
+    with presence_lock:
+        return {'online': user_id in presence_sids,
+                'sessions': len(presence_sids.get(user_id, ())),
+                'last_seen': last_seen.get(user_id)}
+
+def get_presence_stats():
+    with presence_lock:
+        return {'online_users': len(presence_sids), 'sockets': len(presence_by_sid),
+                'rooms': len(room_presence)}
+
+# Group chat. Each group has a Socket.IO room ('chat_<id>') and a ring buffer
+# of its latest messages, so joining a chat shows history without a query.
+# Messages are broadcast at once and written by group_chat_writer in batches.
+# Token buckets per socket and per room stop one noisy client or room from
+# flooding the hub, and a full write queue turns new messages away.
+GROUP_CHAT_HISTORY_SIZE = 50
+GROUP_CHAT_CACHED_ROOMS = 1000
+GROUP_CHAT_MAX_LENGTH = 1000
+GROUP_CHAT_QUEUE_SIZE = int(os.environ.get('GROUP_CHAT_QUEUE_SIZE', 5000))
+GROUP_CHAT_BATCH_SIZE = 500
+GROUP_CHAT_FLUSH_INTERVAL = 1.0
+GROUP_CHAT_SOCKET_RATE = 1.0  # messages per second
+GROUP_CHAT_SOCKET_BURST = 5
+GROUP_CHAT_ROOM_RATE = 20.0
+GROUP_CHAT_ROOM_BURST = 40
+GROUP_CHAT_ERRORS = {
+    'invalid': 'Tin nhắn không hợp lệ',
+    'not_joined': 'Bạn chưa tham gia cuộc trò chuyện này',
+    'rate_limited': 'Bạn gửi tin nhắn quá nhanh, vui lòng chờ một chút',
+    'busy': 'Hệ thống đang bận, vui lòng thử lại sau',
+}
+
+chat_buffers = OrderedDict()  # group_id -> deque of recent message payloads
+chat_pending = deque()  # (group_id, user_id, content, created_at) not yet written
+chat_sockets = {}  # sid -> {'user_id', 'group_id', 'tokens', 'updated'}
+chat_room_buckets = {}  # group_id -> {'tokens', 'updated'}
+chat_lock = threading.Lock()
+chat_flush_generation = 0
+chat_wakeup = create_event()
+chat_stats = {'sent': 0, 'rate_limited': 0, 'rejected': 0, 'persisted': 0, 'batches': 0}
+
+def _take_chat_token(bucket, rate, burst, now):
+    """Take one token from a bucket; returns 0 or the seconds until one is available"""
+    bucket['tokens'] = min(burst, bucket['tokens'] + (now - bucket['updated']) * rate)
+    bucket['updated'] = now
+    if bucket['tokens'] < 1:
+        return (1 - bucket['tokens']) / rate
+    bucket['tokens'] -= 1
+    return 0
+
+def format_chat_time(value):
+    """'YYYY-MM-DD HH:MM:SS' (UTC) as an ISO timestamp browsers parse as UTC"""
+    return value.replace(' ', 'T') + 'Z'
+
+def get_chat_history_buffer(group_id):
+    """Recent messages of a group, oldest first, from its ring buffer"""
+    with chat_lock:
+        buffer = chat_buffers.get(group_id)
+        if buffer is not None:
+            chat_buffers.move_to_end(group_id)
+            return list(buffer)
+        generation = chat_flush_generation
+
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT m.user_id, m.content, m.created_at, u.username
+        FROM group_chat_messages m LEFT JOIN users u ON u.id = m.user_id
+        WHERE m.group_id = ? ORDER BY m.id DESC LIMIT ?
+    ''', (group_id, GROUP_CHAT_HISTORY_SIZE)).fetchall()
+    conn.close()
+
+    messages = [{'room': str(group_id), 'sender_id': row['user_id'], 'sender': row['username'],
+                 'content': row['content'], 'timestamp': format_chat_time(row['created_at'])}
+                for row in reversed(rows)]
+
+    with chat_lock:
+        # Messages still waiting for the writer are not in the database yet
+        messages.extend(payload for pending_group, _, _, _, payload in chat_pending if pending_group == group_id)
+        buffer = deque(messages, maxlen=GROUP_CHAT_HISTORY_SIZE)
+        # A batch written while we were reading may be in neither place; don't cache then
+        if generation == chat_flush_generation:
+            chat_buffers[group_id] = buffer
+            while len(chat_buffers) > GROUP_CHAT_CACHED_ROOMS:
+                chat_buffers.popitem(last=False)
+    return list(buffer)
+
+def open_group_chat(sid, user_id, group_id):
+    """Attach a socket to a group chat; returns (history, previous group id) or None for non-members"""
+    conn = get_db_connection()
+    member = conn.execute('SELECT 1 FROM group_members WHERE group_id = ? AND user_id = ?',
+                          (group_id, user_id)).fetchone()
+    conn.close()
+    if not member:
+        return None
+
+    with chat_lock:
+        state = chat_sockets.setdefault(sid, {'user_id': user_id, 'group_id': None,
+                                              'tokens': float(GROUP_CHAT_SOCKET_BURST), 'updated': time.monotonic()})
+        previous = state['group_id']
+        state['group_id'] = group_id
+    return get_chat_history_buffer(group_id), previous
+
+def close_group_chat(sid):
+    with chat_lock:
+        chat_sockets.pop(sid, None)
+
+def leave_group_chats(user_id, group_id):
+    """Detach the user's sockets in every worker from a group's chat after they left the group"""
+    close_member_chats(user_id, group_id)
+    publish_cache_change('group_left', user_id, group_id)
+
+def close_member_chats(user_id, group_id):
+    # group_id comes from request JSON, so compare it as text
+    with chat_lock:
+        sids = [sid for sid, state in chat_sockets.items()
+                if state['user_id'] == user_id and str(state['group_id']) == str(group_id)]
+        for sid in sids:
+            del chat_sockets[sid]
+    for sid in sids:
+        socketio.server.leave_room(sid, f'chat_{group_id}', namespace='/')
+
+def post_group_chat(sid, user_id, username, group_id, content):
+    """Accept a chat message; returns ('sent', payload) or (error status, retry_after)"""
+    content = content.strip() if isinstance(content, str) else ''
+    if not content or len(content) > GROUP_CHAT_MAX_LENGTH:
+        return 'invalid', None
+
+    now = time.monotonic()
+    created_at = utc_now().strftime('%Y-%m-%d %H:%M:%S')
+    with chat_lock:
+        state = chat_sockets.get(sid)
+        if not state or state['group_id'] != group_id:
+            return 'not_joined', None
+        if len(chat_pending) >= GROUP_CHAT_QUEUE_SIZE:
+            chat_stats['rejected'] += 1
+            return 'busy', 1
+        room = chat_room_buckets.setdefault(group_id, {'tokens': float(GROUP_CHAT_ROOM_BURST), 'updated': now})
+        wait = _take_chat_token(state, GROUP_CHAT_SOCKET_RATE, GROUP_CHAT_SOCKET_BURST, now)
+        if not wait:
+            wait = _take_chat_token(room, GROUP_CHAT_ROOM_RATE, GROUP_CHAT_ROOM_BURST, now)
+            if wait:
+                state['tokens'] += 1  # the room was full, so give the socket its token back
+        if wait:
+            chat_stats['rate_limited'] += 1
+            return 'rate_limited', round(wait, 1)
+
+        payload = {'room': str(group_id), 'sender_id': user_id, 'sender': username,
+                   'content': content, 'timestamp': format_chat_time(created_at)}
+        chat_pending.append((group_id, user_id, content, created_at, payload))
+        buffer = chat_buffers.get(group_id)
+        if buffer is not None:
+            buffer.append(payload)
+        chat_stats['sent'] += 1
+
+    chat_wakeup.set()
+    publish_cache_change('chat', group_id, payload)
+    return 'sent', payload
+
+def append_chat_buffer(group_id, payload):
+    """Add a message posted through another worker to this worker's history"""
+    global chat_flush_generation
+    with chat_lock:
+        buffer = chat_buffers.get(group_id)
+        if buffer is not None:
+            buffer.append(payload)
+        else:
+            # A history being read right now may predate this message; don't cache it
+            chat_flush_generation += 1
+
+def group_chat_writer():
+    """Persist queued chat messages in batched transactions"""
+    global chat_flush_generation
+    while True:
+        chat_wakeup.wait(GROUP_CHAT_FLUSH_INTERVAL)
+        chat_wakeup.clear()
+        # Let a burst of messages collect into one batch
+        background_sleep(GROUP_CHAT_FLUSH_INTERVAL)
+
+        while True:
+            with chat_lock:
+                batch = [chat_pending.popleft() for _ in range(min(GROUP_CHAT_BATCH_SIZE, len(chat_pending)))]
+                if batch:
+                    chat_flush_generation += 1
+            if not batch:
+                break
+
+            conn = get_db_connection()
+            try:
+                conn.executemany(
+                    'INSERT INTO group_chat_messages (group_id, user_id, content, created_at) VALUES (?, ?, ?, ?)',
+                    [entry[:4] for entry in batch]
+                )
+                conn.commit()
+                with chat_lock:
+                    chat_flush_generation += 1
+                    chat_stats['persisted'] += len(batch)
+                    chat_stats['batches'] += 1
+            except sqlite3.Error as e:
+                print(f"Group chat write error: {e}")
+                # Put the batch back in order and retry after a short pause
+                with chat_lock:
+                    chat_pending.extendleft(reversed(batch))
+                background_sleep(0.5)
+            finally:
+                conn.close()
+
+def get_group_chat_stats():
+    with chat_lock:
+        return dict(chat_stats, queue_depth=len(chat_pending), open_sockets=len(chat_sockets),
+                    cached_rooms=len(chat_buffers))
 
 # SocketIO Events
 if socketio:
+    def join_user_rooms():
+        """Join the user's own room and audience rooms once per socket"""
+        user_id = session['user_id']
+        join_room(f"user_{user_id}")
+        with presence_lock:
+            if request.sid in presence_by_sid:
+                return
+        register_presence(user_id, request.sid, join_audience_rooms(user_id))
+
     @socketio.on('connect')
     def handle_connect():
         if 'user_id' in session:
-            join_room('ranking_room')
+            join_user_rooms()
             emit('connected', {'data': 'Connected to ranking updates'})
 
     @socketio.on('disconnect')
     def handle_disconnect():
+        unregister_presence(request.sid)
+        close_group_chat(request.sid)
+        unsubscribe_ranking(request.sid)
+
+    @socketio.on('join_notifications')
+    def handle_join_notifications():
         if 'user_id' in session:
-            leave_room('ranking_room')
+            join_user_rooms()
 
-    @socketio.on('join_ranking')
-    def handle_join_ranking():
+    @socketio.on('sync_audiences')
+    def handle_sync_audiences():
         if 'user_id' in session:
-            join_room('ranking_room')
-            # Send current rankings
-            broadcast_ranking_update()
+            sync_audience_rooms(request.sid, session['user_id'])
+
+    @socketio.on('join_chat')
+    def handle_join_chat(data):
+        if 'user_id' not in session:
+            return {'success': False, 'message': 'Not logged in'}
+        try:
+            group_id = int((data or {}).get('room'))
+        except (TypeError, ValueError):
+            return {'success': False, 'message': GROUP_CHAT_ERRORS['invalid']}
+
+        opened = open_group_chat(request.sid, session['user_id'], group_id)
+        if opened is None:
+            return {'success': False, 'message': 'Bạn không phải thành viên của nhóm này'}
+        history, previous = opened
+        if previous is not None and previous != group_id:
+            leave_room(f'chat_{previous}')
+        join_room(f'chat_{group_id}')
+        return {'success': True, 'messages': history, 'online': count_online(f'group_{group_id}')}
+
+    @socketio.on('send_message')
+    def handle_send_message(data):
+        if 'user_id' not in session:
+            return {'success': False, 'message': 'Not logged in'}
+        data = data or {}
+        try:
+            group_id = int(data.get('room'))
+        except (TypeError, ValueError):
+            return {'success': False, 'message': GROUP_CHAT_ERRORS['invalid']}
+
+        status, result = post_group_chat(request.sid, session['user_id'], session.get('username'),
+                                         group_id, data.get('content'))
+        if status != 'sent':
+            return {'success': False, 'message': GROUP_CHAT_ERRORS[status], 'retry_after': result}
+        socketio.emit('new_message', result, room=f'chat_{group_id}')
+        return {'success': True}
+
+    @socketio.on('join_ranking')
+    def handle_join_ranking(data=None):
+        if 'user_id' not in session:
+            return None
+        fmt = choose_ranking_format((data or {}).get('formats') if isinstance(data, dict) else None)
+        previous = subscribe_ranking(request.sid, fmt)
+        if previous and previous != fmt:
+            leave_room(RANKING_ROOMS[previous])
+        join_room(RANKING_ROOMS[fmt])
+        # Send current rankings to this client only
+        send_ranking_snapshot(fmt)
+        return {'format': fmt}
+
+    @socketio.on('ranking_users')
+    def handle_ranking_users(data):
+        if 'user_id' not in session:
+            return {'users': []}
+        try:
+            return {'users': get_ranking_users((data or {}).get('ids') or [])}
+        except (TypeError, ValueError, AttributeError):
+            return {'users': []}
 
 # Routes
 @app.route('/')
@@ -461,6 +2162,744 @@ def home():
         return redirect(url_for('login'))
     return render_template('home.html')
 
+# LLM client for the chatbot (openai>=1.0 client API)
+OPENAI_MODEL = os.environ.get('OPENAI_MODEL', 'gpt-3.5-turbo')
+LLM_TIMEOUT = float(os.environ.get('LLM_TIMEOUT', 60))
+CHATBOT_MAX_TOKENS = 1000
+CHATBOT_SYSTEM_PROMPT = "Bạn là CoachAI, một trợ lý giáo dục thông minh. Hãy trả lời các câu hỏi về giáo dục, học tập và tạo bài tập bằng tiếng Việt một cách chi tiết và hữu ích."
+
+openai_client = None
+openai_client_lock = threading.Lock()
+
+chatbot_stats = {'requests': 0, 'completed': 0, 'fallbacks': 0, 'errors': 0}
+chatbot_ttft = deque(maxlen=1000)
+chatbot_latency = deque(maxlen=1000)
+chatbot_stats_lock = threading.Lock()
+
+def get_openai_client():
+    """Get the shared OpenAI client, or None when no API key is configured"""
+    global openai_client
+    api_key = os.getenv('OPENAI_API_KEY')
+    if not api_key:
+        return None
+
+    with openai_client_lock:
+        if openai_client is None:
+            openai_client = openai.OpenAI(api_key=api_key, base_url=os.getenv('OPENAI_BASE_URL') or None,
+                                          timeout=LLM_TIMEOUT, max_retries=0)
+        return openai_client
+
+def run_blocking(func, *args, **kwargs):
+    """Run a blocking call without stalling the eventlet hub
+
+    Under eventlet the call is handed to a native thread pool so other green
+    threads keep running; in threading mode it is simply called.
+    """
+    if socketio and socketio.async_mode == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(func, *args, **kwargs)
+    return func(*args, **kwargs)
+
+def build_chat_messages(message, user_id=None, matches=()):
+    """Build the prompt: system prompt, related exercises, conversation context of user_id, then the message"""
+    messages = [{"role": "system", "content": CHATBOT_SYSTEM_PROMPT}]
+    if matches:
+        # Ground the answer in our own exercise bank, without giving away the answers
+        excerpts = []
+        for exercise_id, title, *_ in matches:
+            exercise = get_exercise(exercise_id)
+            if exercise:
+                excerpts.append(f"- [{exercise_id}] {title}: {exercise['content'][:300]}")
+        if excerpts:
+            messages.append({"role": "system", "content": "Bài tập liên quan trong ngân hàng CoachEduAI "
+                                                          "(có thể nhắc đến, không tiết lộ đáp án):\n"
+                                                          + '\n'.join(excerpts)})
+    if user_id is not None:
+        messages.extend(get_context_messages(user_id))
+    messages.append({"role": "user", "content": message})
+    return messages
+
+def complete_chat(messages, timeout=LLM_TIMEOUT, max_tokens=CHATBOT_MAX_TOKENS, json_mode=False):
+    """Get a full (non-streamed) completion"""
+    options = {'response_format': {'type': 'json_object'}} if json_mode else {}
+    response = run_blocking(get_openai_client().chat.completions.create,
+                            model=OPENAI_MODEL, messages=messages,
+                            max_tokens=max_tokens, temperature=0.7, timeout=timeout, **options)
+    return response.choices[0].message.content
+
+def stream_chat_completion(messages, timeout=LLM_TIMEOUT):
+    """Yield response text as it arrives from the LLM"""
+    stream = run_blocking(get_openai_client().chat.completions.create,
+                          model=OPENAI_MODEL, messages=messages,
+                          max_tokens=CHATBOT_MAX_TOKENS, temperature=0.7, stream=True, timeout=timeout)
+    chunks = iter(stream)
+    try:
+        while True:
+            chunk = run_blocking(next, chunks, None)
+            if chunk is None:
+                break
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+
+def save_chat_message(user_id, message, response):
+    conn = get_db_connection()
+    cursor = conn.execute(
+        'INSERT INTO chat_messages (user_id, message, response) VALUES (?, ?, ?)',
+        (user_id, message, response)
+    )
+    conn.commit()
+    conn.close()
+    record_chat_turn(user_id, cursor.lastrowid, message, response)
+
+def record_chatbot_stat(name, ttft=None, latency=None):
+    with chatbot_stats_lock:
+        chatbot_stats[name] += 1
+        if ttft is not None:
+            chatbot_ttft.append(ttft)
+        if latency is not None:
+            chatbot_latency.append(latency)
+
+def get_chatbot_stats():
+    def percentiles(values):
+        values = sorted(values)
+        if not values:
+            return {'p50': 0.0, 'p99': 0.0}
+        return {'p50': round(values[len(values) // 2] * 1000, 1),
+                'p99': round(values[min(int(len(values) * 0.99), len(values) - 1)] * 1000, 1)}
+
+    with chatbot_stats_lock:
+        stats = dict(chatbot_stats)
+        ttft, latency = list(chatbot_ttft), list(chatbot_latency)
+    stats['ttft_ms'] = percentiles(ttft)
+    stats['latency_ms'] = percentiles(latency)
+    return stats
+
+# LLM dispatcher: at most LLM_MAX_CONCURRENCY calls in flight, started at no
+# more than LLM_RATE_PER_MINUTE (token bucket). Waiting requests are queued per
+# user and served round-robin so one busy student cannot starve a class.
+LLM_MAX_CONCURRENCY = int(os.environ.get('LLM_MAX_CONCURRENCY', 4))
+LLM_RATE_PER_MINUTE = float(os.environ.get('LLM_RATE_PER_MINUTE', 60))
+LLM_BURST = int(os.environ.get('LLM_BURST', 10))
+LLM_QUEUE_LIMIT = int(os.environ.get('LLM_QUEUE_LIMIT', 100))
+LLM_USER_LIMIT = 2  # queued + running requests per user
+LLM_DEADLINE = float(os.environ.get('LLM_DEADLINE', 45))
+LLM_POLL_INTERVAL = 1.0
+
+llm_lock = threading.Lock()
+llm_user_queues = OrderedDict()  # user_id -> deque of waiting tickets, in round-robin order
+llm_user_pending = {}
+llm_active = 0
+llm_tokens = float(LLM_BURST)
+llm_tokens_updated = time.monotonic()
+llm_waits = deque(maxlen=1000)
+llm_stats = {'granted': 0, 'rejected_user': 0, 'rejected_busy': 0, 'expired': 0}
+
+def _dispatch_llm_slots_locked():
+    """Grant free slots to waiting tickets; returns the events to set outside the lock"""
+    global llm_active, llm_tokens, llm_tokens_updated
+    now = time.monotonic()
+    llm_tokens = min(LLM_BURST, llm_tokens + (now - llm_tokens_updated) * LLM_RATE_PER_MINUTE / 60)
+    llm_tokens_updated = now
+
+    ready = []
+    while llm_user_queues and llm_active < LLM_MAX_CONCURRENCY and llm_tokens >= 1:
+        user_id, queue = next(iter(llm_user_queues.items()))
+        ticket = queue.popleft()
+        if queue:
+            llm_user_queues.move_to_end(user_id)
+        else:
+            del llm_user_queues[user_id]
+        if now >= ticket['deadline']:
+            ticket['status'] = 'expired'
+            llm_user_pending[user_id] -= 1
+            llm_stats['expired'] += 1
+            continue
+        ticket['status'] = 'granted'
+        llm_active += 1
+        llm_tokens -= 1
+        llm_stats['granted'] += 1
+        llm_waits.append(now - ticket['queued_at'])
+        ready.append(ticket['event'])
+    return ready
+
+def estimate_llm_retry_after():
+    with chatbot_stats_lock:
+        average_latency = sum(chatbot_latency) / len(chatbot_latency) if chatbot_latency else 5.0
+    with llm_lock:
+        waiting = sum(len(queue) for queue in llm_user_queues.values())
+    return max(1, int(average_latency * (waiting + 1) / LLM_MAX_CONCURRENCY))
+
+def request_llm_slot(user_id):
+    """Queue for an LLM slot; returns (status, ticket) with status
+    'granted', 'queued', 'too_many' (per-user limit) or 'busy' (queue full)"""
+    with llm_lock:
+        if llm_user_pending.get(user_id, 0) >= LLM_USER_LIMIT:
+            llm_stats['rejected_user'] += 1
+            return 'too_many', None
+        if sum(len(queue) for queue in llm_user_queues.values()) >= LLM_QUEUE_LIMIT:
+            llm_stats['rejected_busy'] += 1
+            return 'busy', None
+
+        now = time.monotonic()
+        ticket = {'user_id': user_id, 'status': 'queued', 'event': create_event(),
+                  'queued_at': now, 'deadline': now + LLM_DEADLINE}
+        llm_user_pending[user_id] = llm_user_pending.get(user_id, 0) + 1
+        llm_user_queues.setdefault(user_id, deque()).append(ticket)
+        ready = _dispatch_llm_slots_locked()
+
+    for event in ready:
+        event.set()
+    return ticket['status'], ticket
+
+def wait_for_llm_slot(ticket, timeout):
+    """Wait up to timeout seconds (and never past the ticket deadline); True once granted"""
+    end = min(time.monotonic() + timeout, ticket['deadline'])
+    while True:
+        with llm_lock:
+            # Also re-run dispatch here: the token bucket refills without anyone releasing
+            ready = _dispatch_llm_slots_locked() if ticket['status'] == 'queued' else []
+            status = ticket['status']
+        for event in ready:
+            event.set()
+        if status != 'queued':
+            return status == 'granted'
+
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return False
+        ticket['event'].wait(min(remaining, LLM_POLL_INTERVAL))
+
+def get_llm_queue_position(ticket):
+    """Approximate number of requests served before this ticket under round-robin"""
+    with llm_lock:
+        queue = llm_user_queues.get(ticket['user_id'])
+        if ticket['status'] != 'queued' or not queue or ticket not in queue:
+            return 0
+        rounds = queue.index(ticket) + 1
+        return sum(min(len(other), rounds) for other in llm_user_queues.values())
+
+def release_llm_slot(ticket):
+    """Give back a granted slot, or drop a ticket that is still waiting"""
+    global llm_active
+    with llm_lock:
+        user_id = ticket['user_id']
+        if ticket['status'] == 'granted':
+            llm_active -= 1
+            llm_user_pending[user_id] -= 1
+        elif ticket['status'] == 'queued':
+            queue = llm_user_queues.get(user_id)
+            if queue and ticket in queue:
+                queue.remove(ticket)
+                if not queue:
+                    del llm_user_queues[user_id]
+            llm_user_pending[user_id] -= 1
+        ticket['status'] = 'released'
+        if not llm_user_pending.get(user_id):
+            llm_user_pending.pop(user_id, None)
+        ready = _dispatch_llm_slots_locked()
+
+    for event in ready:
+        event.set()
+
+def llm_time_left(ticket):
+    return max(1.0, ticket['deadline'] - time.monotonic())
+
+def get_llm_stats():
+    with llm_lock:
+        waits = sorted(llm_waits)
+        return dict(llm_stats, active=llm_active, tokens=round(llm_tokens, 2),
+                    waiting=sum(len(queue) for queue in llm_user_queues.values()),
+                    waiting_users=len(llm_user_queues),
+                    wait_p50_ms=round(waits[len(waits) // 2] * 1000, 1) if waits else None,
+                    wait_p99_ms=round(waits[int(len(waits) * 0.99)] * 1000, 1) if waits else None)
+
+def llm_busy_response(status):
+    """429 when the user already has requests in flight, 503 when the queue is full"""
+    retry_after = estimate_llm_retry_after()
+    if status == 'too_many':
+        message = 'Bạn đang có câu hỏi chờ trả lời, vui lòng đợi trong giây lát!'
+    else:
+        message = 'Trợ lý AI đang quá tải, vui lòng thử lại sau!'
+    response = jsonify({'success': False, 'status': status, 'retry_after': retry_after, 'message': message})
+    response.headers['Retry-After'] = str(retry_after)
+    return response, 429 if status == 'too_many' else 503
+
+# Chatbot answer cache: an in-memory LRU in front of the chatbot_cache table,
+# keyed on the normalized prompt. Near-duplicate questions can also be matched
+# on hashed character-trigram vectors of the prompts held in memory; that is
+# off by default because questions differing in one number or operator are
+# different problems.
+CHATBOT_CACHE_SIZE = int(os.environ.get('CHATBOT_CACHE_SIZE', 1000))
+CHATBOT_CACHE_DB_ROWS = int(os.environ.get('CHATBOT_CACHE_DB_ROWS', 20000))
+CHATBOT_CACHE_TTL = float(os.environ.get('CHATBOT_CACHE_TTL', 7 * 24 * 3600))
+CHATBOT_CACHE_SIMILARITY = float(os.environ.get('CHATBOT_CACHE_SIMILARITY', 0))  # 0 = exact matches only
+TEXT_VECTOR_DIMENSIONS = 4096
+
+chatbot_cache = OrderedDict()
+chatbot_cache_lock = threading.Lock()
+chatbot_cache_stats = {'memory_hits': 0, 'db_hits': 0, 'similar_hits': 0, 'misses': 0,
+                       'stores': 0, 'saved_latency_s': 0.0}
+
+def normalize_prompt(text):
+    """Fold case, Vietnamese diacritics, punctuation and whitespace
+
+    Math operators and decimal separators are kept, so "2+3" and "2*3" or
+    "1.5" and "15" never share a key.
+    """
+    text = unicodedata.normalize('NFD', text.casefold()).replace('đ', 'd')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    text = re.sub(r'[^\w\s+\-*/=^<>%().,]', ' ', text)
+    text = re.sub(r'(?<!\d)[.,]|[.,](?!\d)', ' ', text)  # sentence punctuation, not 1.5
+    return ' '.join(re.sub(r'([+\-*/=^<>%()])', r' \1 ', text).split())
+
+def text_vector(text, dimensions=TEXT_VECTOR_DIMENSIONS):
+    """Hash the character trigrams of normalized text into a unit-length sparse vector"""
+    padded = f' {text} '
+    counts = {}
+    for i in range(len(padded) - 2):
+        bucket = zlib.crc32(padded[i:i + 3].encode()) % dimensions
+        counts[bucket] = counts.get(bucket, 0) + 1
+    norm = sum(value * value for value in counts.values()) ** 0.5 or 1.0
+    return {bucket: value / norm for bucket, value in counts.items()}
+
+def vector_similarity(a, b):
+    if len(a) > len(b):
+        a, b = b, a
+    return sum(value * b.get(bucket, 0.0) for bucket, value in a.items())
+
+def _remember_chatbot_answer(key, normalized, response, created_at):
+    with chatbot_cache_lock:
+        chatbot_cache[key] = {'prompt': normalized, 'response': response, 'created_at': created_at,
+                              'vector': text_vector(normalized) if CHATBOT_CACHE_SIMILARITY else None}
+        chatbot_cache.move_to_end(key)
+        while len(chatbot_cache) > CHATBOT_CACHE_SIZE:
+            chatbot_cache.popitem(last=False)
+
+def _count_chatbot_cache_hit(kind):
+    # A hit saves roughly one average LLM round trip
+    with chatbot_stats_lock:
+        average_latency = sum(chatbot_latency) / len(chatbot_latency) if chatbot_latency else 0.0
+    with chatbot_cache_lock:
+        chatbot_cache_stats[kind] += 1
+        chatbot_cache_stats['saved_latency_s'] += average_latency
+
+def get_cached_answer(message):
+    """Look a question up in memory, then SQLite, then by similarity; None on a miss"""
+    normalized = normalize_prompt(message)
+    if not normalized:
+        return None
+    key = hashlib.sha256(normalized.encode()).hexdigest()
+    now = time.time()
+
+    with chatbot_cache_lock:
+        entry = chatbot_cache.get(key)
+        if entry and now - entry['created_at'] < CHATBOT_CACHE_TTL:
+            chatbot_cache.move_to_end(key)
+            response = entry['response']
+        else:
+            response = None
+    if response is not None:
+        _count_chatbot_cache_hit('memory_hits')
+        return response
+
+    conn = get_db_connection()
+    row = conn.execute('SELECT response, created_at FROM chatbot_cache WHERE prompt_key = ? AND created_at > ?',
+                       (key, now - CHATBOT_CACHE_TTL)).fetchone()
+    if row:
+        conn.execute('UPDATE chatbot_cache SET hits = hits + 1, last_hit_at = ? WHERE prompt_key = ?', (now, key))
+        conn.commit()
+    conn.close()
+    if row:
+        _remember_chatbot_answer(key, normalized, row['response'], row['created_at'])
+        _count_chatbot_cache_hit('db_hits')
+        return row['response']
+
+    if CHATBOT_CACHE_SIMILARITY:
+        vector = text_vector(normalized)
+        best_score, best_response = 0.0, None
+        with chatbot_cache_lock:
+            for entry in chatbot_cache.values():
+                if entry['vector'] and now - entry['created_at'] < CHATBOT_CACHE_TTL:
+                    score = vector_similarity(vector, entry['vector'])
+                    if score > best_score:
+                        best_score, best_response = score, entry['response']
+        if best_score >= CHATBOT_CACHE_SIMILARITY:
+            _count_chatbot_cache_hit('similar_hits')
+            return best_response
+
+    with chatbot_cache_lock:
+        chatbot_cache_stats['misses'] += 1
+    return None
+
+def cache_answer(message, response):
+    """Store an LLM answer in both cache tiers, trimming the table when it grows too big"""
+    normalized = normalize_prompt(message)
+    if not normalized or not response:
+        return
+    key = hashlib.sha256(normalized.encode()).hexdigest()
+    now = time.time()
+
+    _remember_chatbot_answer(key, normalized, response, now)
+    with chatbot_cache_lock:
+        chatbot_cache_stats['stores'] += 1
+        trim = chatbot_cache_stats['stores'] % 100 == 0
+
+    conn = get_db_connection()
+    conn.execute('''
+        INSERT OR REPLACE INTO chatbot_cache (prompt_key, prompt, response, hits, created_at, last_hit_at)
+        VALUES (?, ?, ?, 0, ?, ?)
+    ''', (key, normalized, response, now, now))
+    if trim:
+        conn.execute('DELETE FROM chatbot_cache WHERE created_at < ?', (now - CHATBOT_CACHE_TTL,))
+        conn.execute('''
+            DELETE FROM chatbot_cache WHERE prompt_key IN (
+                SELECT prompt_key FROM chatbot_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?
+            )
+        ''', (CHATBOT_CACHE_DB_ROWS,))
+    conn.commit()
+    conn.close()
+
+def get_chatbot_cache_stats():
+    with chatbot_cache_lock:
+        stats = dict(chatbot_cache_stats, size=len(chatbot_cache))
+    hits = stats['memory_hits'] + stats['db_hits'] + stats['similar_hits']
+    lookups = hits + stats['misses']
+    stats['hit_rate'] = round(hits / lookups, 4) if lookups else 0.0
+    stats['saved_latency_s'] = round(stats['saved_latency_s'], 2)
+    return stats
+
+# Chatbot conversation context: the newest turns of each user are kept in
+# memory within CHATBOT_CONTEXT_TOKENS; older turns are folded into a summary
+# by a background task and saved to chat_summaries. Prompts are assembled
+# from memory, so SQLite is only read when a user's context is first loaded.
+CHATBOT_CONTEXT_TOKENS = int(os.environ.get('CHATBOT_CONTEXT_TOKENS', 1500))
+CHATBOT_SUMMARY_TOKENS = 300
+CHAT_CONTEXT_USERS = 500
+CHAT_CONTEXT_LOAD_TURNS = 20
+CHAT_SUMMARY_QUEUE_KEY = 'chat_summaries'  # dispatcher queue shared by all summary jobs
+FOLLOW_UP_PATTERN = re.compile(r'\b(nó|đó|này|trên|tiếp|tiếp tục|thêm|vậy|còn|câu \d+|bài \d+|it|that|this|more)\b',
+                               re.IGNORECASE)
+
+chat_contexts = OrderedDict()  # user_id -> {'summary', 'summary_id', 'turns', 'tokens', 'summarizing'}
+chat_context_lock = threading.Lock()
+chat_context_generation = 0
+
+def estimate_tokens(text):
+    """Rough token count; Vietnamese text averages about 3 characters per token"""
+    return len(text or '') // 3 + 1
+
+def _new_chat_turn(message_id, message, response):
+    return (message_id, message, response, estimate_tokens(message) + estimate_tokens(response))
+
+def get_chat_context(user_id):
+    """Get a user's context from memory, loading the summary and recent turns on a miss"""
+    with chat_context_lock:
+        context = chat_contexts.get(user_id)
+        if context:
+            chat_contexts.move_to_end(user_id)
+            return context
+        generation = chat_context_generation
+
+    conn = get_db_connection()
+    summary = conn.execute('SELECT summary, last_message_id FROM chat_summaries WHERE user_id = ?',
+                           (user_id,)).fetchone()
+    summary_id = summary['last_message_id'] if summary else 0
+    rows = conn.execute('''
+        SELECT id, message, response FROM chat_messages
+        WHERE user_id = ? AND id > ? ORDER BY id DESC LIMIT ?
+    ''', (user_id, summary_id, CHAT_CONTEXT_LOAD_TURNS)).fetchall()
+    conn.close()
+
+    turns = deque(_new_chat_turn(row['id'], row['message'], row['response']) for row in reversed(rows))
+    context = {'summary': summary['summary'] if summary else '', 'summary_id': summary_id, 'turns': turns,
+               'tokens': sum(turn[3] for turn in turns), 'summarizing': False}
+    with chat_context_lock:
+        # Keep the loaded copy only if no message was saved meanwhile
+        if user_id not in chat_contexts and generation == chat_context_generation:
+            chat_contexts[user_id] = context
+            while len(chat_contexts) > CHAT_CONTEXT_USERS:
+                chat_contexts.popitem(last=False)
+        return chat_contexts.get(user_id, context)
+
+def get_context_messages(user_id):
+    """Chat messages for the summary plus the newest turns that fit the token budget"""
+    context = get_chat_context(user_id)
+    with chat_context_lock:
+        summary = context['summary']
+        budget = CHATBOT_CONTEXT_TOKENS - estimate_tokens(summary)
+        selected = []
+        for _, message, response, tokens in reversed(context['turns']):
+            if tokens > budget:
+                break
+            budget -= tokens
+            selected.append((message, response))
+
+    messages = []
+    if summary:
+        messages.append({"role": "system", "content": f"Tóm tắt cuộc trò chuyện trước đó: {summary}"})
+    for message, response in reversed(selected):
+        messages.append({"role": "user", "content": message})
+        messages.append({"role": "assistant", "content": response})
+    return messages
+
+def is_standalone_message(user_id, message):
+    """Whether an answer can be shared through the answer cache (no reliance on earlier turns)"""
+    context = get_chat_context(user_id)
+    with chat_context_lock:
+        has_context = bool(context['turns'] or context['summary'])
+    if not has_context:
+        return True
+    return len(message.split()) >= 4 and not FOLLOW_UP_PATTERN.search(message)
+
+def record_chat_turn(user_id, message_id, message, response):
+    """Append a saved turn to the in-memory context and summarize once over budget"""
+    global chat_context_generation
+    with chat_context_lock:
+        chat_context_generation += 1
+        context = chat_contexts.get(user_id)
+        if not context:
+            return
+        turn = _new_chat_turn(message_id, message, response)
+        context['turns'].append(turn)
+        context['tokens'] += turn[3]
+        summarize = context['tokens'] > CHATBOT_CONTEXT_TOKENS and not context['summarizing']
+        if summarize:
+            context['summarizing'] = True
+
+    if summarize:
+        start_background_task(summarize_chat_context, user_id, context)
+
+def write_chat_summary(previous, turns):
+    """Fold turns into the running summary with the LLM, or extractively when it is unavailable"""
+    conversation = '\n'.join(f"Học sinh: {message}\nCoachAI: {response}" for _, message, response, _ in turns)
+    if get_openai_client():
+        status, ticket = request_llm_slot(CHAT_SUMMARY_QUEUE_KEY)
+        if ticket:
+            try:
+                if wait_for_llm_slot(ticket, LLM_DEADLINE):
+                    return complete_chat([
+                        {"role": "system", "content": "Tóm tắt ngắn gọn cuộc trò chuyện giữa học sinh và CoachAI "
+                                                      f"bằng tiếng Việt, tối đa {CHATBOT_SUMMARY_TOKENS} từ. "
+                                                      "Giữ lại môn học, chủ đề và những gì học sinh cần."},
+                        {"role": "user", "content": f"Tóm tắt trước đó: {previous or '(chưa có)'}\n\n{conversation}"}
+                    ], timeout=llm_time_left(ticket), max_tokens=CHATBOT_SUMMARY_TOKENS)
+            except Exception as e:
+                print(f"Chat summary error: {e}")
+            finally:
+                release_llm_slot(ticket)
+
+    # Offline: keep the questions, newest last, within the summary budget
+    topics = [previous] if previous else []
+    topics.extend(message for _, message, _, _ in turns)
+    summary = '; '.join(topics)
+    limit = CHATBOT_SUMMARY_TOKENS * 3
+    return summary if len(summary) <= limit else '...' + summary[-limit:]
+
+def summarize_chat_context(user_id, context):
+    """Background task: fold the oldest turns until the window is back to half the budget"""
+    try:
+        with chat_context_lock:
+            previous = context['summary']
+            turns, tokens = [], context['tokens']
+            for turn in context['turns']:
+                if tokens <= CHATBOT_CONTEXT_TOKENS // 2:
+                    break
+                turns.append(turn)
+                tokens -= turn[3]
+        if not turns:
+            return
+
+        summary = write_chat_summary(previous, turns)
+        last_id = turns[-1][0]
+
+        with chat_context_lock:
+            # Turns are only appended meanwhile, so the folded ones are still in front
+            while context['turns'] and context['turns'][0][0] <= last_id:
+                context['tokens'] -= context['turns'].popleft()[3]
+            context['summary'] = summary
+            context['summary_id'] = last_id
+
+        conn = get_db_connection()
+        conn.execute('''
+            INSERT OR REPLACE INTO chat_summaries (user_id, summary, last_message_id, updated_at)
+            VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+        ''', (user_id, summary, last_id))
+        conn.commit()
+        conn.close()
+    except Exception as e:
+        print(f"Chat summary error: {e}")
+    finally:
+        with chat_context_lock:
+            context['summarizing'] = False
+
+# Chat history pages (newest first, keyed on message id) and retention: rows
+# older than CHAT_RETENTION_DAYS are moved, per user, into zlib-compressed
+# JSON chunks in chat_archives. Paging continues into the archives.
+CHAT_HISTORY_PAGE_SIZE = 20
+CHAT_HISTORY_MAX_PAGE_SIZE = 50
+CHAT_RETENTION_DAYS = int(os.environ.get('CHAT_RETENTION_DAYS', 90))
+CHAT_RETENTION_INTERVAL = 3600
+CHAT_ARCHIVE_BATCH_SIZE = 500
+CHAT_ARCHIVE_TIME_BUDGET = 5.0  # seconds of archiving per run
+
+def get_chat_history(user_id, before=None, limit=CHAT_HISTORY_PAGE_SIZE):
+    """Return (messages oldest-first, has_more) for the page of messages older than `before`"""
+    conn = get_db_connection()
+    rows = [dict(row) for row in conn.execute('''
+        SELECT id, message, response, created_at FROM chat_messages
+        WHERE user_id = ? AND id < ? ORDER BY id DESC LIMIT ?
+    ''', (user_id, before or 2 ** 63 - 1, limit + 1)).fetchall()]
+
+    if len(rows) <= limit:
+        # Live rows are exhausted: continue with the archived chunks
+        cursor = rows[-1]['id'] if rows else (before or 2 ** 63 - 1)
+        for archive in conn.execute('''
+            SELECT payload FROM chat_archives
+            WHERE user_id = ? AND first_message_id < ? ORDER BY last_message_id DESC
+        ''', (user_id, cursor)):
+            archived = json.loads(zlib.decompress(archive['payload']))
+            rows.extend(row for row in reversed(archived) if row['id'] < cursor)
+            if len(rows) > limit:
+                break
+    conn.close()
+
+    has_more = len(rows) > limit
+    return list(reversed(rows[:limit])), has_more
+
+def archive_chat_messages(retention_days=CHAT_RETENTION_DAYS, batch_size=CHAT_ARCHIVE_BATCH_SIZE,
+                          time_budget=CHAT_ARCHIVE_TIME_BUDGET):
+    """Move chat messages older than the retention period into chat_archives
+
+    Works in id order, one short transaction per batch, and stops after
+    time_budget seconds so the SQLite write lock is never held for long.
+    Returns the number of archived messages.
+    """
+    conn = get_db_connection()
+    archived = 0
+    try:
+        # Ids grow with time, so everything up to the newest expired id is expired
+        newest = conn.execute('''
+            SELECT id FROM chat_messages WHERE created_at < datetime('now', ?) ORDER BY id DESC LIMIT 1
+        ''', (f'-{retention_days} days',)).fetchone()
+        if not newest:
+            return 0
+
+        deadline = time.monotonic() + time_budget
+        while time.monotonic() < deadline:
+            rows = conn.execute('''
+                SELECT id, user_id, message, response, created_at FROM chat_messages
+                WHERE id <= ? ORDER BY id LIMIT ?
+            ''', (newest['id'], batch_size)).fetchall()
+            if not rows:
+                break
+
+            by_user = {}
+            for row in rows:
+                by_user.setdefault(row['user_id'], []).append(
+                    {'id': row['id'], 'message': row['message'], 'response': row['response'],
+                     'created_at': row['created_at']})
+            conn.executemany('''
+                INSERT INTO chat_archives (user_id, first_message_id, last_message_id, message_count, payload)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(user_id, messages[0]['id'], messages[-1]['id'], len(messages),
+                   zlib.compress(json.dumps(messages, ensure_ascii=False).encode(), 9))
+                  for user_id, messages in by_user.items()])
+            conn.execute('DELETE FROM chat_messages WHERE id BETWEEN ? AND ?', (rows[0]['id'], rows[-1]['id']))
+            conn.commit()
+            archived += len(rows)
+            background_sleep(0)
+    finally:
+        conn.close()
+    return archived
+
+def chat_retention_loop():
+    """Periodically archive expired chat messages"""
+    while True:
+        try:
+            archived = archive_chat_messages()
+            if archived:
+                print(f"Archived {archived} chat messages")
+        except Exception as e:
+            print(f"Chat retention error: {e}")
+        background_sleep(CHAT_RETENTION_INTERVAL)
+
+@app.cli.command('archive-chats')
+@click.option('--days', type=int, default=CHAT_RETENTION_DAYS, show_default=True,
+              help='Archive messages older than this many days')
+def archive_chats_command(days):
+    """Move old chatbot messages into compressed archives."""
+    total = 0
+    while True:
+        archived = archive_chat_messages(days)
+        total += archived
+        if not archived:
+            break
+    click.echo(f"Archived {total} chat messages")
+
+def server_sent_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def chatbot_event_stream(user_id, message, cached=None, ticket=None, cacheable=True):
+    """Stream a chatbot answer as server-sent events and save it once complete
+
+    With a dispatcher ticket, 'queued' events report the queue position until
+    an LLM slot is granted; past the deadline the fallback answer is sent.
+    """
+    started = time.monotonic()
+
+    if cached is not None:
+        yield server_sent_event('token', {'text': cached})
+        save_chat_message(user_id, message, cached)
+        yield server_sent_event('done', {'length': len(cached), 'cached': True})
+        return
+
+    parts = []
+    matches = []
+    failed = False
+    try:
+        if ticket:
+            matches = search_exercises(message)
+            while ticket['status'] == 'queued' and time.monotonic() < ticket['deadline']:
+                yield server_sent_event('queued', {'position': get_llm_queue_position(ticket)})
+                wait_for_llm_slot(ticket, LLM_POLL_INTERVAL)
+            if ticket['status'] == 'granted':
+                for text in stream_chat_completion(build_chat_messages(message, user_id, matches),
+                                                   timeout=llm_time_left(ticket)):
+                    if not parts:
+                        ttft = time.monotonic() - started
+                    parts.append(text)
+                    yield server_sent_event('token', {'text': text})
+    except Exception as e:
+        print(f"OpenAI API Error: {e}")
+        record_chatbot_stat('errors')
+        failed = True
+    finally:
+        # Also runs when the client disconnects and the generator is closed
+        if ticket:
+            release_llm_slot(ticket)
+
+    if parts:
+        # An answer cut off by an error is shown but neither counted as completed nor cached
+        if not failed:
+            record_chatbot_stat('completed', ttft=ttft, latency=time.monotonic() - started)
+        if matches:
+            links = "\n\n" + format_exercise_links(matches, "Bài tập liên quan")
+            parts.append(links)
+            yield server_sent_event('token', {'text': links})
+        ai_response = ''.join(parts)
+        if cacheable and not failed:
+            cache_answer(message, ai_response)
+    else:
+        # Fallback response nếu không có API key, API lỗi hoặc hết thời gian chờ
+        record_chatbot_stat('fallbacks')
+        ai_response = generate_fallback_response(message)
+        yield server_sent_event('token', {'text': ai_response})
+
+    save_chat_message(user_id, message, ai_response)
+    yield server_sent_event('done', {'length': len(ai_response), 'fallback': not parts})
+
 @app.route('/chatbot', methods=['GET', 'POST'])
 def chatbot():
     if 'user_id' not in session:
@@ -468,57 +2907,100 @@ def chatbot():
 
     if request.method == 'POST':
         message = request.form['message']
-
+        record_chatbot_stat('requests')
+
+        started = time.monotonic()
+        # Follow-up questions depend on the conversation, so they bypass the answer cache
+        standalone = is_standalone_message(session['user_id'], message)
+        cached = get_cached_answer(message) if standalone else None
+        ticket = None
+        if cached is None and get_openai_client():
+            status, ticket = request_llm_slot(session['user_id'])
+            if not ticket:
+                return llm_busy_response(status)
+
+        # Stream tokens as they arrive when the client asks for it
+        if request.accept_mimetypes.best == 'text/event-stream':
+            response = Response(stream_with_context(chatbot_event_stream(session['user_id'], message,
+                                                                         cached, ticket, standalone)),
+                                mimetype='text/event-stream')
+            response.headers['Cache-Control'] = 'no-cache'
+            response.headers['X-Accel-Buffering'] = 'no'
+            if ticket:
+                # The generator's cleanup never runs if the client goes away before the first chunk
+                response.call_on_close(lambda: release_llm_slot(ticket))
+            return response
+
+        ai_response = cached
         try:
-            # Configure OpenAI
-            openai.api_key = os.getenv('OPENAI_API_KEY')
-
-            if openai.api_key:
-                # Call OpenAI API
-                response = openai.ChatCompletion.create(
-                    model="gpt-3.5-turbo",
-                    messages=[
-                        {"role": "system", "content": "Bạn là CoachAI, một trợ lý giáo dục thông minh. Hãy trả lời các câu hỏi về giáo dục, học tập và tạo bài tập bằng tiếng Việt một cách chi tiết và hữu ích."},
-                        {"role": "user", "content": message}
-                    ],
-                    max_tokens=1000,
-                    temperature=0.7
-                )
-                ai_response = response.choices[0].message.content
-            else:
-                # Fallback response nếu không có API key
-                ai_response = generate_fallback_response(message)
+            if ticket and wait_for_llm_slot(ticket, LLM_DEADLINE):
+                matches = search_exercises(message)
+                ai_response = complete_chat(build_chat_messages(message, session['user_id'], matches),
+                                            timeout=llm_time_left(ticket))
+                if matches:
+                    ai_response += "\n\n" + format_exercise_links(matches, "Bài tập liên quan")
+                record_chatbot_stat('completed', latency=time.monotonic() - started)
+                if standalone:
+                    cache_answer(message, ai_response)
         except Exception as e:
             print(f"OpenAI API Error: {e}")
+            record_chatbot_stat('errors')
+        finally:
+            if ticket:
+                release_llm_slot(ticket)
+
+        fallback = ai_response is None
+        if fallback:
+            # Fallback response nếu không có API key, API lỗi hoặc hết thời gian chờ
+            record_chatbot_stat('fallbacks')
             ai_response = generate_fallback_response(message)
 
         # Save to database
-        conn = get_db_connection()
-        conn.execute(
-            'INSERT INTO chat_messages (user_id, message, response) VALUES (?, ?, ?)',
-            (session['user_id'], message, ai_response)
-        )
-        conn.commit()
-        conn.close()
+        save_chat_message(session['user_id'], message, ai_response)
 
-        return jsonify({'response': ai_response})
+        return jsonify({'response': ai_response, 'fallback': fallback})
 
-    # Get chat history
-    conn = get_db_connection()
-    messages = conn.execute(
-        'SELECT * FROM chat_messages WHERE user_id = ? ORDER BY created_at DESC LIMIT 10',
-        (session['user_id'],)
-    ).fetchall()
-    conn.close()
+    # Get chat history (older pages are loaded by /api/chat_history on scroll)
+    messages, has_more = get_chat_history(session['user_id'])
 
-    return render_template('chatbot.html', messages=messages)
+    return render_template('chatbot.html', messages=messages, has_more=has_more)
 
-def generate_fallback_response(message):
-    """Generate fallback response when OpenAI is not available"""
-    message_lower = message.lower()
+@app.route('/api/chat_history')
+def api_chat_history():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', CHAT_HISTORY_PAGE_SIZE, type=int), CHAT_HISTORY_MAX_PAGE_SIZE)
+    messages, has_more = get_chat_history(session['user_id'], before, max(limit, 1))
+
+    return jsonify({'success': True, 'messages': messages, 'has_more': has_more,
+                    'next_before': messages[0]['id'] if messages and has_more else None})
 
-    if 'toán' in message_lower or 'math' in message_lower:
-        return """Tôi có thể giúp bạn với các bài toán:
+@app.route('/api/chatbot_stats')
+def api_chatbot_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'message': 'Permission denied'})
+
+    return jsonify({'success': True, 'chatbot': get_chatbot_stats()})
+
+# Offline fallback responder. Keywords of the intent table are compiled into
+# one Aho-Corasick automaton, so a message is classified in a single pass, and
+# answers link to exercises from an in-memory index: no DB or network access.
+SUBJECT_LABELS = {'math': 'Toán', 'physics': 'Vật lý', 'chemistry': 'Hóa học',
+                  'biology': 'Sinh học', 'literature': 'Ngữ văn', 'english': 'Tiếng Anh'}
+DIFFICULTY_LABELS = {'easy': 'Dễ', 'medium': 'Trung bình', 'hard': 'Khó'}
+FALLBACK_EXERCISE_LINKS = 3
+
+FALLBACK_INTENTS = {
+    'math': {
+        'keywords': {'toán': 3, 'toan': 2, 'math': 3, 'phương trình': 2, 'bất phương trình': 2, 'đạo hàm': 2,
+                     'tích phân': 2, 'nguyên hàm': 2, 'hình học': 2, 'đại số': 2, 'lượng giác': 2,
+                     'xác suất': 2, 'hàm số': 2, 'tam giác': 1, 'logarit': 2, 'giới hạn': 1, 'ma trận': 2},
+        'answer': """Tôi có thể giúp bạn với các bài toán:
 
 **Ví dụ bài tập Toán:**
 - Giải phương trình bậc hai: x² - 5x + 6 = 0
@@ -526,9 +3008,57 @@ def generate_fallback_response(message):
 - Bài toán hình học: Tính diện tích tam giác có ba cạnh 3, 4, 5
 
 Bạn muốn tôi giải thích chi tiết bài nào không?"""
-
-    elif 'văn' in message_lower or 'literature' in message_lower:
-        return """Tôi có thể hỗ trợ bạn về Văn học:
+    },
+    'physics': {
+        'keywords': {'vật lý': 3, 'vật lí': 3, 'vat ly': 2, 'physics': 3, 'vận tốc': 2, 'gia tốc': 2,
+                     'lực': 1, 'động lượng': 2, 'dao động': 2, 'điện trường': 2, 'dòng điện': 2,
+                     'quang học': 2, 'nhiệt động': 2, 'chuyển động': 2, 'công suất': 1, 'định luật newton': 3},
+        'answer': """Tôi có thể hỗ trợ bạn về Vật lý:
+
+**Ví dụ bài tập Vật lý:**
+- Một vật chuyển động thẳng đều với vận tốc 36 km/h. Tính quãng đường đi được sau 15 phút
+- Tính lực hấp dẫn giữa hai vật có khối lượng 50 kg cách nhau 1 m
+- Con lắc lò xo có k = 100 N/m, m = 0,25 kg: tính chu kỳ dao động
+
+**Kỹ năng:** đổi đơn vị, vẽ hình biểu diễn lực, chọn hệ quy chiếu phù hợp.
+
+Bạn đang học chương nào?"""
+    },
+    'chemistry': {
+        'keywords': {'hóa': 3, 'hoá': 3, 'hóa học': 3, 'hoá học': 3, 'hoa hoc': 2, 'chemistry': 3,
+                     'phản ứng': 2, 'nguyên tử': 2, 'phân tử': 2, 'mol': 2, 'axit': 2, 'bazơ': 2,
+                     'electron': 1, 'oxi hóa': 2, 'cân bằng phương trình': 3, 'hữu cơ': 2, 'ion': 1},
+        'answer': """Tôi có thể hỗ trợ bạn về Hóa học:
+
+**Ví dụ bài tập Hóa học:**
+- Cân bằng phương trình: Fe + O₂ → Fe₃O₄
+- Tính số mol của 11,2 lít khí CO₂ ở điều kiện tiêu chuẩn
+- Viết cấu hình electron của nguyên tử Na (Z = 11)
+
+**Kỹ năng:** bảo toàn khối lượng, bảo toàn electron, lập tỉ lệ mol.
+
+Bạn muốn luyện dạng bài nào?"""
+    },
+    'biology': {
+        'keywords': {'sinh học': 3, 'sinh hoc': 2, 'biology': 3, 'tế bào': 2, 'quang hợp': 2, 'hô hấp': 2,
+                     'di truyền': 2, 'adn': 2, 'dna': 2, 'gen': 1, 'nhiễm sắc thể': 2, 'đột biến': 2,
+                     'tiến hóa': 2, 'sinh thái': 2, 'enzyme': 1, 'protein': 1},
+        'answer': """Tôi có thể hỗ trợ bạn về Sinh học:
+
+**Ví dụ bài tập Sinh học:**
+- Một gen có 3000 nuclêôtit, trong đó A = 20%. Tính số nuclêôtit mỗi loại
+- So sánh quá trình quang hợp và hô hấp tế bào
+- Phép lai Aa × Aa cho tỉ lệ kiểu hình như thế nào?
+
+**Kỹ năng:** vẽ sơ đồ lai, ghi nhớ bằng sơ đồ tư duy, liên hệ thực tế.
+
+Bạn cần ôn phần nào?"""
+    },
+    'literature': {
+        'keywords': {'văn': 3, 'ngữ văn': 3, 'van hoc': 2, 'literature': 3, 'thơ': 2, 'tác phẩm': 2,
+                     'nghị luận': 2, 'phân tích': 1, 'nhân vật': 2, 'chí phèo': 3, 'tắt đèn': 3,
+                     'vợ nhặt': 3, 'truyện kiều': 3, 'tác giả': 1, 'biện pháp tu từ': 2},
+        'answer': """Tôi có thể hỗ trợ bạn về Văn học:
 
 **Phân tích tác phẩm:**
 - Chí Phèo (Nam Cao): Phản ánh hiện thực xã hội
@@ -541,9 +3071,45 @@ Bạn muốn tôi giải thích chi tiết bài nào không?"""
 - Cách làm bài thi văn
 
 Bạn cần hỗ trợ gì cụ thể?"""
-
-    else:
-        return f"""Tôi hiểu bạn muốn hỏi về: "{message}"
+    },
+    'english': {
+        'keywords': {'tiếng anh': 3, 'tieng anh': 2, 'english': 3, 'ngữ pháp': 2, 'grammar': 2,
+                     'từ vựng': 2, 'vocabulary': 2, 'thì hiện tại': 2, 'thì quá khứ': 2, 'câu bị động': 2,
+                     'phát âm': 2, 'ielts': 2, 'toeic': 2, 'reading': 1, 'listening': 1},
+        'answer': """Tôi có thể hỗ trợ bạn học Tiếng Anh:
+
+**Ví dụ bài tập Tiếng Anh:**
+- Chia động từ: She (go) ____ to school every day.
+- Chuyển sang câu bị động: They built this bridge in 1990.
+- Tìm từ đồng nghĩa với "important"
+
+**Kỹ năng:** học từ vựng theo chủ đề, luyện nghe hằng ngày, ôn ngữ pháp qua ví dụ.
+
+Bạn muốn luyện kỹ năng nào?"""
+    },
+    'study_method': {
+        'keywords': {'phương pháp học': 3, 'cách học': 3, 'ôn thi': 2, 'ôn tập': 2, 'lịch học': 2,
+                     'tập trung': 1, 'ghi nhớ': 1, 'study': 2},
+        'answer': """Một số phương pháp học hiệu quả:
+
+- **Lặp lại ngắt quãng:** ôn lại kiến thức sau 1 ngày, 3 ngày, 1 tuần
+- **Tự kiểm tra:** làm bài tập trước khi xem lời giải
+- **Pomodoro:** học 25 phút, nghỉ 5 phút
+- **Dạy lại người khác:** giải thích lại bằng lời của bạn
+
+Bạn muốn xây dựng kế hoạch ôn tập cho môn nào?"""
+    },
+    'greeting': {
+        'keywords': {'xin chào': 2, 'chào': 1, 'hello': 2, 'hi': 1, 'hey': 1},
+        'answer': """Xin chào! Tôi là CoachAI 👋
+
+Tôi có thể giúp bạn tạo bài tập, giải thích khái niệm và gợi ý phương pháp học cho các môn Toán, Vật lý, Hóa học, Sinh học, Ngữ văn và Tiếng Anh.
+
+Hôm nay bạn muốn học gì?"""
+    },
+}
+
+FALLBACK_DEFAULT_ANSWER = """Tôi hiểu bạn muốn hỏi về: "{message}"
 
 Tôi có thể giúp bạn:
 • **Tạo bài tập** cho các môn Toán, Văn, Hóa, Lý, Sinh, Anh
@@ -553,6 +3119,284 @@ Tôi có thể giúp bạn:
 
 Hãy cho tôi biết cụ thể hơn về môn học và nội dung bạn quan tâm!"""
 
+def normalize_keyword_text(text):
+    """Casefold and strip punctuation, keeping diacritics (folding them makes 'vận' match 'văn')"""
+    return ' '.join(re.sub(r'[^\w\s]', ' ', unicodedata.normalize('NFC', text.casefold())).split())
+
+def build_keyword_automaton(keywords):
+    """Compile keywords into an Aho-Corasick automaton (goto, fail, output tables)"""
+    goto, fail, output = [{}], [0], [()]
+    for keyword in keywords:
+        node = 0
+        for char in keyword:
+            if char not in goto[node]:
+                goto.append({})
+                fail.append(0)
+                output.append(())
+                goto[node][char] = len(goto) - 1
+            node = goto[node][char]
+        output[node] += (keyword,)
+
+    # Breadth-first, so fail links always point to already finished nodes
+    queue = deque(goto[0].values())
+    while queue:
+        node = queue.popleft()
+        for char, child in goto[node].items():
+            queue.append(child)
+            state = fail[node]
+            while state and char not in goto[state]:
+                state = fail[state]
+            fail[child] = goto[state].get(char, 0)
+            output[child] += output[fail[child]]
+    return goto, fail, output
+
+def find_keywords(automaton, text):
+    """Return every whole-word keyword occurring in normalized text, in one pass"""
+    goto, fail, output = automaton
+    found = []
+    node = 0
+    for end, char in enumerate(text):
+        while node and char not in goto[node]:
+            node = fail[node]
+        node = goto[node].get(char, 0)
+        for keyword in output[node]:
+            start = end - len(keyword) + 1
+            if (start == 0 or not text[start - 1].isalnum()) and \
+                    (end + 1 == len(text) or not text[end + 1].isalnum()):
+                found.append(keyword)
+    return found
+
+FALLBACK_KEYWORDS = {}  # normalized keyword -> [(intent, weight)]
+for intent, spec in FALLBACK_INTENTS.items():
+    for keyword, weight in spec['keywords'].items():
+        FALLBACK_KEYWORDS.setdefault(normalize_keyword_text(keyword), []).append((intent, weight))
+FALLBACK_AUTOMATON = build_keyword_automaton(FALLBACK_KEYWORDS)
+
+# In-memory exercise index: per-subject and per-keyword ids in insertion order,
+# so the newest matches are found by walking the OrderedDicts backwards.
+exercise_index = {}  # exercise_id -> (title, subject, difficulty, keywords)
+exercise_index_by_subject = {}
+exercise_index_by_keyword = {}
+exercise_index_lock = threading.Lock()
+exercise_index_loaded = False
+exercise_index_generation = 0
+
+# Retrieval over exercise text (title, content, solution) with hashed trigram
+# vectors. With numpy they are rows of a float32 matrix scored in one product;
+# without it an inverted index of the vector buckets is used.
+RETRIEVAL_DIMENSIONS = 1024
+RETRIEVAL_TEXT_LIMIT = 1500
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_MIN_SCORE = float(os.environ.get('RETRIEVAL_MIN_SCORE', 0.25))
+
+retrieval_matrix = None
+retrieval_rows = {}  # exercise_id -> matrix row (numpy) or sparse vector (pure Python)
+retrieval_row_ids = []  # matrix row -> exercise_id, None for free rows
+retrieval_free_rows = []
+retrieval_postings = {}  # bucket -> {exercise_id: weight}, pure-Python only
+
+def exercise_text_vector(title, content='', solution=''):
+    text = normalize_prompt(f"{title} {content} {solution or ''}"[:RETRIEVAL_TEXT_LIMIT])
+    return text_vector(text, RETRIEVAL_DIMENSIONS)
+
+def _retrieval_add_locked(exercise_id, vector):
+    global retrieval_matrix
+    if numpy is None:
+        retrieval_rows[exercise_id] = vector
+        for bucket, weight in vector.items():
+            retrieval_postings.setdefault(bucket, {})[exercise_id] = weight
+        return
+
+    if retrieval_free_rows:
+        row = retrieval_free_rows.pop()
+    else:
+        row = len(retrieval_row_ids)
+        retrieval_row_ids.append(None)
+        if retrieval_matrix is None or row >= len(retrieval_matrix):
+            grown = numpy.zeros((max(64, row * 2), RETRIEVAL_DIMENSIONS), dtype=numpy.float32)
+            if retrieval_matrix is not None:
+                grown[:len(retrieval_matrix)] = retrieval_matrix
+            retrieval_matrix = grown
+    retrieval_matrix[row] = 0
+    for bucket, weight in vector.items():
+        retrieval_matrix[row, bucket] = weight
+    retrieval_row_ids[row] = exercise_id
+    retrieval_rows[exercise_id] = row
+
+def _retrieval_remove_locked(exercise_id):
+    entry = retrieval_rows.pop(exercise_id, None)
+    if entry is None:
+        return
+    if numpy is None:
+        for bucket in entry:
+            retrieval_postings[bucket].pop(exercise_id, None)
+    else:
+        retrieval_matrix[entry] = 0
+        retrieval_row_ids[entry] = None
+        retrieval_free_rows.append(entry)
+
+def _index_exercise_locked(exercise_id, title, subject, difficulty, content='', vector=None):
+    _unindex_exercise_locked(exercise_id)
+    keywords = tuple(set(find_keywords(FALLBACK_AUTOMATON, normalize_keyword_text(f"{title} {content[:2000]}"))))
+    exercise_index[exercise_id] = (title, subject, difficulty, keywords)
+    exercise_index_by_subject.setdefault(subject, OrderedDict())[exercise_id] = None
+    for keyword in keywords:
+        exercise_index_by_keyword.setdefault(keyword, OrderedDict())[exercise_id] = None
+    if vector:
+        _retrieval_add_locked(exercise_id, vector)
+
+def _unindex_exercise_locked(exercise_id):
+    entry = exercise_index.pop(exercise_id, None)
+    if entry:
+        exercise_index_by_subject[entry[1]].pop(exercise_id, None)
+        for keyword in entry[3]:
+            exercise_index_by_keyword[keyword].pop(exercise_id, None)
+    _retrieval_remove_locked(exercise_id)
+
+def index_exercise(exercise_id, title, subject, difficulty, content='', solution=''):
+    """Add or refresh one exercise in the in-memory index"""
+    global exercise_index_generation
+    vector = exercise_text_vector(title, content, solution)
+    with exercise_index_lock:
+        exercise_index_generation += 1
+        if exercise_index_loaded:
+            _index_exercise_locked(exercise_id, title, subject, difficulty, content, vector)
+
+def unindex_exercise(exercise_id):
+    global exercise_index_generation
+    with exercise_index_lock:
+        exercise_index_generation += 1
+        _unindex_exercise_locked(exercise_id)
+
+def index_exercises_since(last_id):
+    """Index exercises with an id above last_id (used after bulk imports)"""
+    conn = get_db_connection()
+    rows = conn.execute('''
+        SELECT id, title, subject, difficulty, content, detailed_solution FROM exercises WHERE id > ? ORDER BY id
+    ''', (last_id,)).fetchall()
+    conn.close()
+    for row in rows:
+        index_exercise(row['id'], row['title'], row['subject'], row['difficulty'], row['content'],
+                       row['detailed_solution'])
+
+def load_exercise_index():
+    """Build the index from the database, retrying if exercises change meanwhile"""
+    global exercise_index_loaded, retrieval_matrix
+    while True:
+        with exercise_index_lock:
+            generation = exercise_index_generation
+        conn = get_db_connection()
+        rows = conn.execute(
+            'SELECT id, title, subject, difficulty, content, detailed_solution FROM exercises ORDER BY id'
+        ).fetchall()
+        conn.close()
+        vectors = [exercise_text_vector(row['title'], row['content'], row['detailed_solution']) for row in rows]
+
+        with exercise_index_lock:
+            if generation != exercise_index_generation:
+                continue
+            exercise_index.clear()
+            exercise_index_by_subject.clear()
+            exercise_index_by_keyword.clear()
+            retrieval_rows.clear()
+            retrieval_row_ids.clear()
+            retrieval_free_rows.clear()
+            retrieval_postings.clear()
+            retrieval_matrix = None
+            for row, vector in zip(rows, vectors):
+                _index_exercise_locked(row['id'], row['title'], row['subject'], row['difficulty'], row['content'],
+                                       vector)
+            exercise_index_loaded = True
+            return
+
+def find_indexed_exercises(subject, keywords, limit=FALLBACK_EXERCISE_LINKS):
+    """Newest exercises of a subject, preferring ones that share the message keywords"""
+    if not exercise_index_loaded:
+        load_exercise_index()
+
+    chosen = []
+    with exercise_index_lock:
+        candidates = [reversed(exercise_index_by_keyword.get(keyword, {})) for keyword in keywords]
+        candidates.append(reversed(exercise_index_by_subject.get(subject, {})))
+        for ids in candidates:
+            for exercise_id in ids:
+                entry = exercise_index[exercise_id]
+                if entry[1] == subject and exercise_id not in chosen:
+                    chosen.append(exercise_id)
+                    if len(chosen) >= limit:
+                        break
+            if len(chosen) >= limit:
+                break
+        return [(exercise_id,) + exercise_index[exercise_id][:3] for exercise_id in chosen]
+
+def search_exercises(query, limit=RETRIEVAL_TOP_K, subject=None, min_score=RETRIEVAL_MIN_SCORE):
+    """Top exercises by similarity to the query: [(id, title, subject, difficulty, score)]"""
+    if not exercise_index_loaded:
+        load_exercise_index()
+    vector = text_vector(normalize_prompt(query), RETRIEVAL_DIMENSIONS)
+
+    results = []
+    with exercise_index_lock:
+        if numpy is not None:
+            if retrieval_matrix is None:
+                return []
+            query_row = numpy.zeros(RETRIEVAL_DIMENSIONS, dtype=numpy.float32)
+            query_row[list(vector)] = list(vector.values())
+            scores = retrieval_matrix[:len(retrieval_row_ids)] @ query_row
+            ranked = ((retrieval_row_ids[row], float(scores[row])) for row in numpy.argsort(-scores))
+        else:
+            totals = {}
+            for bucket, weight in vector.items():
+                for exercise_id, value in retrieval_postings.get(bucket, {}).items():
+                    totals[exercise_id] = totals.get(exercise_id, 0.0) + weight * value
+            ranked = iter(sorted(totals.items(), key=lambda item: -item[1]))
+
+        for exercise_id, score in ranked:
+            if score < min_score or exercise_id is None:
+                break
+            title, exercise_subject, difficulty, _ = exercise_index[exercise_id]
+            if subject and exercise_subject != subject:
+                continue
+            results.append((exercise_id, title, exercise_subject, difficulty, round(score, 3)))
+            if len(results) >= limit:
+                break
+    return results
+
+def format_exercise_links(exercises, heading):
+    """Markdown-style list of links to exercises, as shown in chatbot answers"""
+    links = '\n'.join(
+        f'- <a href="/exercise/{exercise[0]}">{escape(exercise[1])}</a> '
+        f'({DIFFICULTY_LABELS.get(exercise[3], exercise[3])})'
+        for exercise in exercises
+    )
+    return f"**{heading}:**\n{links}"
+
+def generate_fallback_response(message):
+    """Generate fallback response when OpenAI is not available"""
+    keywords = find_keywords(FALLBACK_AUTOMATON, normalize_keyword_text(message))
+    scores = {}
+    for keyword in keywords:
+        for intent, weight in FALLBACK_KEYWORDS[keyword]:
+            scores[intent] = scores.get(intent, 0) + weight
+
+    if not scores:
+        return FALLBACK_DEFAULT_ANSWER.format(message=message)
+
+    # A subject wins over generic intents such as greetings
+    subjects = [intent for intent in scores if intent in SUBJECT_LABELS]
+    intent = max(subjects or scores, key=scores.get)
+    answer = FALLBACK_INTENTS[intent]['answer']
+    if intent not in SUBJECT_LABELS:
+        return answer
+
+    # Closest exercises by content first, then the newest ones sharing keywords
+    exercises = search_exercises(message, FALLBACK_EXERCISE_LINKS, subject=intent)
+    if not exercises:
+        exercises = find_indexed_exercises(intent, keywords)
+    if exercises:
+        answer += "\n\n" + format_exercise_links(exercises, f"Bài tập {SUBJECT_LABELS[intent]} để luyện tập")
+    return answer
+
 @app.route('/contests')
 def contests():
     if 'user_id' not in session:
@@ -563,14 +3407,10 @@ def contests():
 
     conn = get_db_connection()
 
-    # Base query
+    # Base query; status is kept current by the contest lifecycle scheduler
     query = '''
         SELECT c.*, u.username as creator_name,
-               CASE 
-                   WHEN datetime('now') < c.start_time THEN 'upcoming'
-                   WHEN datetime('now') BETWEEN c.start_time AND c.end_time THEN 'ongoing'
-                   ELSE 'finished'
-               END as current_status,
+               c.status as current_status,
                COUNT(cp.user_id) as participant_count
         FROM contests c 
         JOIN users u ON c.created_by = u.id
@@ -580,13 +3420,9 @@ def contests():
     conditions = []
     params = []
 
-    if status_filter != 'all':
-        if status_filter == 'upcoming':
-            conditions.append("datetime('now') < c.start_time")
-        elif status_filter == 'ongoing':
-            conditions.append("datetime('now') BETWEEN c.start_time AND c.end_time")
-        elif status_filter == 'finished':
-            conditions.append("datetime('now') > c.end_time")
+    if status_filter in ('upcoming', 'ongoing', 'finished'):
+        conditions.append("c.status = ?")
+        params.append(status_filter)
 
     if subject_filter:
         conditions.append("c.subject = ?")
@@ -622,17 +3458,20 @@ def create_contest():
     if request.method == 'POST':
         is_unlimited = 'is_unlimited_time' in request.form
         duration = None if is_unlimited else request.form.get('duration')
+        start_time = parse_contest_time(request.form['start_time'])
+        end_time = parse_contest_time(request.form['end_time'])
 
         conn = get_db_connection()
         cursor = conn.cursor() # Use cursor for lastrowid
         cursor.execute(
             '''INSERT INTO contests 
                (title, description, subject, created_by, start_time, end_time, 
-                duration, is_unlimited_time, is_public, is_official) 
-               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                duration, is_unlimited_time, is_public, is_official, status) 
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
             (request.form['title'], request.form['description'], request.form['subject'],
              session['user_id'], request.form['start_time'], request.form['end_time'],
-             duration, is_unlimited, 'is_public' in request.form, 'is_official' in request.form)
+             duration, is_unlimited, 'is_public' in request.form, 'is_official' in request.form,
+             contest_status_at(start_time, end_time, utc_now()))
         )
         contest_id = cursor.lastrowid
 
@@ -647,91 +3486,691 @@ def create_contest():
         conn.commit()
         conn.close()
 
-        flash('Tạo cuộc thi thành công!', 'success')
-        return redirect(url_for('contests'))
+        schedule_contest(contest_id, start_time, end_time)
+
+        flash('Tạo cuộc thi thành công!', 'success')
+        return redirect(url_for('contests'))
+
+    # Get exercises for selection
+    conn = get_db_connection()
+    exercises = conn.execute(
+        'SELECT e.*, u.username as author_name FROM exercises e JOIN users u ON e.created_by = u.id ORDER BY e.created_at DESC'
+    ).fetchall()
+    conn.close()
+
+    subjects = [
+        {'id': 'math', 'name': 'Toán học'},
+        {'id': 'physics', 'name': 'Vật lý'},
+        {'id': 'chemistry', 'name': 'Hóa học'},
+        {'id': 'biology', 'name': 'Sinh học'},
+        {'id': 'literature', 'name': 'Văn học'},
+        {'id': 'english', 'name': 'Tiếng Anh'}
+    ]
+
+    return render_template('create_contest.html', exercises=exercises, subjects=subjects)
+
+@app.route('/exercises')
+def exercises():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    conn = get_db_connection()
+    exercises = conn.execute(
+        'SELECT e.*, u.username FROM exercises e JOIN users u ON e.created_by = u.id ORDER BY e.created_at DESC'
+    ).fetchall()
+    conn.close()
+
+    exercises = mark_solved_exercises(session['user_id'], exercises)
+
+    return render_template('exercises.html', exercises=exercises)
+
+@app.route('/create_exercise', methods=['GET', 'POST'])
+def create_exercise():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    if request.method == 'POST':
+        conn = get_db_connection()
+        cursor = conn.cursor() # Use cursor for lastrowid and other operations
+
+        title = request.form['title']
+        content = request.form['content']
+        answer = request.form['answer']
+        detailed_solution = request.form.get('detailed_solution', '')
+        hints = request.form.get('hints', '')
+        subject = request.form['subject']
+        difficulty = request.form['difficulty']
+        points = int(request.form['points'])
+
+        try:
+            # Missing columns are added once by init_db, not on every POST
+            cursor.execute(EXERCISE_INSERT_SQL,
+                           (title, content, answer, detailed_solution, hints, subject, difficulty, points, session['user_id'], datetime.datetime.now()))
+
+            conn.commit()
+            index_exercise(cursor.lastrowid, title, subject, difficulty, content, detailed_solution)
+            flash('Bài tập đã được tạo thành công!', 'success')
+            return redirect(url_for('exercises'))
+        except Exception as e:
+            conn.rollback() # Rollback on error
+            flash(f'Có lỗi xảy ra khi tạo bài tập: {str(e)}', 'error')
+            # Re-render the form to show the error
+            return render_template('create_exercise.html')
+
+    # If GET request, render the form
+    return render_template('create_exercise.html')
+
+# Bulk exercise import
+EXERCISE_SUBJECTS = ('math', 'physics', 'chemistry', 'biology', 'literature', 'english')
+EXERCISE_DIFFICULTIES = ('easy', 'medium', 'hard')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+EXERCISE_INSERT_SQL = '''
+    INSERT INTO exercises (title, content, answer, detailed_solution, hints, subject, difficulty, points, created_by, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def validate_exercise_row(row, created_by):
+    """Validate one imported exercise; return (values, None) or (None, error)"""
+    if not isinstance(row, dict):
+        return None, 'Row must be an object'
+
+    def text(field):
+        value = row.get(field)
+        return str(value).strip() if value is not None else ''
+
+    title, content, answer = text('title'), text('content'), text('answer')
+    subject = text('subject').lower()
+    difficulty = text('difficulty').lower() or 'medium'
+
+    for field, value in (('title', title), ('content', content), ('answer', answer)):
+        if not value:
+            return None, f'Missing required field: {field}'
+    if subject not in EXERCISE_SUBJECTS:
+        return None, f'Invalid subject: {subject or "(empty)"}'
+    if difficulty not in EXERCISE_DIFFICULTIES:
+        return None, f'Invalid difficulty: {difficulty}'
+
+    try:
+        points = int(row.get('points') or 10)
+    except (TypeError, ValueError):
+        return None, f'Invalid points: {row.get("points")}'
+    if points <= 0:
+        return None, f'Invalid points: {points}'
+
+    return (title, content, answer, text('detailed_solution'), text('hints'),
+            subject, difficulty, points, created_by, datetime.datetime.now()), None
+
+def iter_import_rows(stream, fmt):
+    """Yield (line_number, row, error) from a JSONL or CSV byte stream, one row at a time"""
+    text_stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+
+    # An undecodable or malformed file ends the import with one error row;
+    # batches already committed stay in place
+    line_number = 0
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text_stream)
+            for row in reader:
+                line_number = reader.line_num
+                yield line_number, row, None
+        else:
+            for line_number, line in enumerate(text_stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, None, f'Invalid JSON: {e}'
+                    continue
+                yield line_number, row, None
+    except UnicodeDecodeError:
+        yield line_number + 1, None, 'File is not valid UTF-8; import stopped'
+    except csv.Error as e:
+        yield line_number + 1, None, f'Invalid CSV: {e}; import stopped'
+
+def detect_import_format(filename, fmt=None):
+    """Pick the import format from an explicit value or the file extension"""
+    fmt = (fmt or '').lower()
+    if fmt in ('csv', 'jsonl'):
+        return fmt
+    if filename and filename.lower().endswith('.csv'):
+        return 'csv'
+    return 'jsonl'
+
+def _record_import_error(report, line_number, message):
+    report['failed'] += 1
+    if len(report['errors']) < IMPORT_MAX_REPORTED_ERRORS:
+        report['errors'].append({'line': line_number, 'message': message})
+
+def _flush_import_batch(conn, batch, report):
+    """Insert a batch in one transaction, falling back to row-by-row on error"""
+    try:
+        conn.executemany(EXERCISE_INSERT_SQL, [values for _, values in batch])
+        conn.commit()
+        report['inserted'] += len(batch)
+    except sqlite3.Error:
+        conn.rollback()
+        for line_number, values in batch:
+            try:
+                conn.execute(EXERCISE_INSERT_SQL, values)
+                report['inserted'] += 1
+            except sqlite3.Error as e:
+                _record_import_error(report, line_number, str(e))
+        conn.commit()
+
+def import_exercises(stream, fmt, created_by, batch_size=IMPORT_BATCH_SIZE):
+    """Stream exercises from a JSONL/CSV file into the database in batched transactions
+
+    Only one batch is held in memory at a time and at most
+    IMPORT_MAX_REPORTED_ERRORS error details are kept, so memory use does not
+    depend on the file size.
+    """
+    report = {'inserted': 0, 'failed': 0, 'errors': []}
+    batch = []
+
+    conn = get_db_connection()
+    last_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM exercises').fetchone()[0]
+    try:
+        for line_number, row, error in iter_import_rows(stream, fmt):
+            if error is None:
+                values, error = validate_exercise_row(row, created_by)
+            if error:
+                _record_import_error(report, line_number, error)
+                continue
+
+            batch.append((line_number, values))
+            if len(batch) >= batch_size:
+                _flush_import_batch(conn, batch, report)
+                batch = []
+
+        if batch:
+            _flush_import_batch(conn, batch, report)
+    finally:
+        conn.close()
+
+    if report['inserted']:
+        index_exercises_since(last_id)
+    return report
+
+@app.cli.command('import-exercises')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--user-id', type=int, required=True, help='Author id for the imported exercises')
+@click.option('--format', 'fmt', type=click.Choice(['jsonl', 'csv']), default=None,
+              help='File format (detected from the extension by default)')
+@click.option('--batch-size', type=int, default=IMPORT_BATCH_SIZE, show_default=True)
+def import_exercises_command(path, user_id, fmt, batch_size):
+    """Import exercises from a JSONL or CSV file"""
+    with open(path, 'rb') as f:
+        report = import_exercises(f, detect_import_format(path, fmt), user_id, batch_size)
+
+    click.echo(f"Inserted: {report['inserted']}, failed: {report['failed']}")
+    for error in report['errors']:
+        click.echo(f"  line {error['line']}: {error['message']}")
+
+@app.route('/api/import_exercises', methods=['POST'])
+def api_import_exercises():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    file = request.files.get('file')
+    if not file or file.filename == '':
+        return jsonify({'success': False, 'message': 'No file selected'})
+
+    fmt = detect_import_format(file.filename, request.form.get('format'))
+    report = import_exercises(file.stream, fmt, session['user_id'])
+
+    return jsonify({'success': True, **report})
+
+# Batch exercise generation. A job asks the LLM for GENERATION_ITEMS_PER_PROMPT
+# exercises per prompt from GENERATION_PARALLELISM workers that share one
+# dispatcher queue per job, so interactive chat keeps its fair share. Only site
+# admins and teachers (users.is_teacher, granted with `flask set-teacher`) may
+# start jobs, at most GENERATION_MAX_ACTIVE_JOBS at a time. Every parsed chunk
+# is inserted together with the job's counters in one transaction, so a job
+# interrupted by a restart resumes exactly where it stopped.
+#
+# With several workers a job is claimed in the database: the worker running
+# it stores its WORKER_ID as owner and refreshes heartbeat_at, and another
+# worker may only take the job over once that heartbeat is older than
+# GENERATION_CLAIM_TIMEOUT. Cancellation is a flag on the row, so any worker
+# can cancel a job running elsewhere.
+GENERATION_PARALLELISM = int(os.environ.get('GENERATION_PARALLELISM', 4))
+GENERATION_ITEMS_PER_PROMPT = 5
+GENERATION_MAX_ATTEMPTS = 3
+GENERATION_MAX_TOKENS = 3000
+GENERATION_MAX_COUNT = 2000
+GENERATION_MAX_ACTIVE_JOBS = int(os.environ.get('GENERATION_MAX_ACTIVE_JOBS', 2))
+GENERATION_HEARTBEAT_INTERVAL = 15
+GENERATION_CLAIM_TIMEOUT = 60  # seconds without a heartbeat before a job counts as abandoned
+DIFFICULTY_POINTS = {'easy': 10, 'medium': 15, 'hard': 20}
+
+generation_jobs_running = {}  # job_id -> in-memory state of a running job
+generation_lock = threading.Lock()
+
+def build_generation_prompt(job, count, batch_number):
+    topic = f", chủ đề: {job['topic']}" if job['topic'] else ''
+    return [
+        {"role": "system", "content": "Bạn là giáo viên giàu kinh nghiệm, soạn bài tập luyện tập cho học sinh "
+                                      "Việt Nam. Chỉ trả lời bằng JSON hợp lệ."},
+        {"role": "user", "content": f"""Soạn {count} bài tập môn {SUBJECT_LABELS[job['subject']]}, độ khó {DIFFICULTY_LABELS[job['difficulty']]}{topic}.
+Số lượng: {count}
+Đợt: {batch_number} (các bài phải khác nhau và khác các đợt trước)
+Trả về JSON dạng {{"exercises": [{{"title": "...", "content": "...", "answer": "...", "detailed_solution": "...", "hints": "..."}}]}}.
+"answer" là đáp án ngắn gọn để chấm tự động."""}
+    ]
+
+def parse_generated_exercises(text):
+    """Extract the list of exercise objects from an LLM answer, tolerating code fences and chatter"""
+    text = (text or '').strip()
+    fenced = re.search(r'```(?:json)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    starts = [i for i in (text.find('{'), text.find('[')) if i >= 0]
+    if not starts:
+        return []
+    try:
+        data = json.loads(text[min(starts):max(text.rfind('}'), text.rfind(']')) + 1])
+    except ValueError:
+        return []
+    if isinstance(data, dict):
+        data = data.get('exercises', [data])
+    return [item for item in data if isinstance(item, dict)] if isinstance(data, list) else []
+
+def generate_exercise_chunk(job, count):
+    """Generate and store up to `count` exercises; returns (inserted, failed, error)"""
+    error = None
+    for attempt in range(GENERATION_MAX_ATTEMPTS):
+        if attempt:
+            background_sleep(2 ** attempt)
+        with generation_lock:
+            job['batches'] += 1
+            batch_number = job['batches']
+
+        status, ticket = request_llm_slot(('generation', job['id']))
+        if not ticket:
+            error = 'LLM queue is full'
+            continue
+        try:
+            if not wait_for_llm_slot(ticket, LLM_DEADLINE):
+                error = 'Timed out waiting for the LLM'
+                continue
+            text = complete_chat(build_generation_prompt(job, count, batch_number), timeout=llm_time_left(ticket),
+                                 max_tokens=GENERATION_MAX_TOKENS, json_mode=True)
+        except Exception as e:
+            error = str(e)
+            continue
+        finally:
+            release_llm_slot(ticket)
+
+        rows = []
+        for item in parse_generated_exercises(text)[:count]:
+            item.update(subject=job['subject'], difficulty=job['difficulty'],
+                        points=DIFFICULTY_POINTS[job['difficulty']])
+            values, row_error = validate_exercise_row(item, job['created_by'])
+            if values:
+                rows.append(values)
+            else:
+                error = row_error
+        if not rows:
+            error = error or 'LLM answer contained no exercises'
+            continue
+
+        conn = get_db_connection()
+        inserted = [(conn.execute(EXERCISE_INSERT_SQL, values).lastrowid, values) for values in rows]
+        cursor = conn.execute('''
+            UPDATE generation_jobs SET generated = generated + ?, failed = failed + ?, updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND owner = ?
+        ''', (len(rows), count - len(rows), job['id'], WORKER_ID))
+        if not cursor.rowcount:
+            # Another worker took the job over; its run generates these items
+            conn.rollback()
+            conn.close()
+            with generation_lock:
+                job['cancelled'] = True
+            return 0, 0, None
+        conn.commit()
+        conn.close()
+        for exercise_id, values in inserted:
+            index_exercise(exercise_id, values[0], values[5], values[6], values[1], values[3])
+        return len(rows), count - len(rows), None
+
+    conn = get_db_connection()
+    conn.execute('''
+        UPDATE generation_jobs SET failed = failed + ?, error = ?, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND owner = ?
+    ''', (count, error, job['id'], WORKER_ID))
+    conn.commit()
+    conn.close()
+    return 0, count, error
+
+def generation_worker(job):
+    """Claim chunks of the job until nothing is left, then finish the job if last out"""
+    try:
+        while True:
+            if generation_cancel_requested(job['id']):
+                with generation_lock:
+                    job['cancelled'] = True
+            with generation_lock:
+                count = 0 if job['cancelled'] else min(GENERATION_ITEMS_PER_PROMPT, job['remaining'])
+                job['remaining'] -= count
+            if not count:
+                break
+            inserted, failed, error = generate_exercise_chunk(job, count)
+            with generation_lock:
+                job['generated'] += inserted
+                job['failed'] += failed
+    except Exception as e:
+        print(f"Generation worker error: {e}")
+    finally:
+        with generation_lock:
+            job['workers'] -= 1
+            last = job['workers'] == 0
+            if last:
+                generation_jobs_running.pop(job['id'], None)
+        if last:
+            finish_generation_job(job)
+
+def generation_cancel_requested(job_id):
+    conn = get_db_connection()
+    row = conn.execute('SELECT cancel_requested FROM generation_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    return bool(row and row['cancel_requested'])
+
+def finish_generation_job(job):
+    conn = get_db_connection()
+    row = conn.execute('SELECT requested, generated, cancel_requested FROM generation_jobs WHERE id = ?',
+                       (job['id'],)).fetchone()
+    if row and row['generated'] >= row['requested']:
+        status = 'completed'
+    else:
+        status = 'cancelled' if row and row['cancel_requested'] else 'failed'
+    # Only while we still own it: a job taken over by another worker is that worker's to finish
+    conn.execute('UPDATE generation_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ? AND owner = ?',
+                 (status, job['id'], WORKER_ID))
+    conn.commit()
+    conn.close()
+
+def generation_heartbeat(job):
+    """Keep this worker's claim on a running job fresh"""
+    while True:
+        background_sleep(GENERATION_HEARTBEAT_INTERVAL)
+        with generation_lock:
+            if generation_jobs_running.get(job['id']) is not job:
+                return
+        conn = get_db_connection()
+        try:
+            cursor = conn.execute('UPDATE generation_jobs SET heartbeat_at = CURRENT_TIMESTAMP WHERE id = ? AND owner = ?',
+                                  (job['id'], WORKER_ID))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Generation heartbeat error: {e}")
+            continue
+        finally:
+            conn.close()
+        if not cursor.rowcount:
+            with generation_lock:
+                job['cancelled'] = True
+            return
+
+def start_generation_job(job_id):
+    """Claim a job for this worker and run (or resume) it in the background
+
+    Returns False if it cannot run: unknown or completed, no API key, or
+    still running (or winding down) here or in a live worker.
+    """
+    with generation_lock:
+        if job_id in generation_jobs_running:
+            # Still running, or still winding down after a cancel
+            return False
+
+    if not get_openai_client():
+        conn = get_db_connection()
+        # Leave a job that a live worker is running alone
+        conn.execute('''
+            UPDATE generation_jobs SET status = 'failed', error = ?
+            WHERE id = ? AND (status != 'running' OR heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))
+        ''', ('OPENAI_API_KEY is not configured', job_id, f'-{GENERATION_CLAIM_TIMEOUT} seconds'))
+        conn.commit()
+        conn.close()
+        return False
+
+    conn = get_db_connection()
+    # Items that failed in an earlier run are retried
+    cursor = conn.execute('''
+        UPDATE generation_jobs
+        SET status = 'running', owner = ?, heartbeat_at = CURRENT_TIMESTAMP, cancel_requested = 0,
+            failed = 0, error = NULL, updated_at = CURRENT_TIMESTAMP
+        WHERE id = ? AND generated < requested
+          AND (status != 'running' OR heartbeat_at IS NULL OR heartbeat_at < datetime('now', ?))
+    ''', (WORKER_ID, job_id, f'-{GENERATION_CLAIM_TIMEOUT} seconds'))
+    conn.commit()
+    row = conn.execute('SELECT * FROM generation_jobs WHERE id = ?', (job_id,)).fetchone() if cursor.rowcount else None
+    conn.close()
+    if not row:
+        return False
+
+    remaining = row['requested'] - row['generated']
+    # The job's workers share one dispatcher key, which never holds more than LLM_USER_LIMIT tickets
+    workers = max(1, min(GENERATION_PARALLELISM, LLM_USER_LIMIT, -(-remaining // GENERATION_ITEMS_PER_PROMPT)))
+    job = {'id': job_id, 'created_by': row['created_by'], 'subject': row['subject'],
+           'difficulty': row['difficulty'], 'topic': row['topic'], 'remaining': remaining,
+           'generated': 0, 'failed': 0, 'batches': 0, 'cancelled': False, 'workers': workers,
+           'started_at': time.monotonic()}
+    with generation_lock:
+        if job_id in generation_jobs_running:
+            return False
+        generation_jobs_running[job_id] = job
+    for _ in range(workers):
+        start_background_task(generation_worker, job)
+    start_background_task(generation_heartbeat, job)
+    return True
+
+def can_generate_exercises(user_id):
+    """Site admins and teachers may start generation jobs"""
+    conn = get_db_connection()
+    allowed = conn.execute('SELECT 1 FROM users WHERE id = ? AND (is_admin OR is_teacher)', (user_id,)).fetchone()
+    conn.close()
+    return allowed is not None
+
+def create_generation_job(created_by, subject, difficulty, count, topic='', max_active=None):
+    """Validate a generation spec and store it as a pending job; returns (job_id, error)
+
+    With max_active, the job is refused while the user already has that many
+    pending or running jobs.
+    """
+    subject, difficulty = (subject or '').lower(), (difficulty or 'medium').lower()
+    if subject not in EXERCISE_SUBJECTS:
+        return None, f'Invalid subject: {subject or "(empty)"}'
+    if difficulty not in EXERCISE_DIFFICULTIES:
+        return None, f'Invalid difficulty: {difficulty}'
+    if not isinstance(count, int) or not 0 < count <= GENERATION_MAX_COUNT:
+        return None, f'Count must be between 1 and {GENERATION_MAX_COUNT}'
 
-    # Get exercises for selection
     conn = get_db_connection()
-    exercises = conn.execute(
-        'SELECT e.*, u.username as author_name FROM exercises e JOIN users u ON e.created_by = u.id ORDER BY e.created_at DESC'
-    ).fetchall()
+    # Count and insert in one statement so concurrent requests cannot both slip under the cap
+    cursor = conn.execute('''
+        INSERT INTO generation_jobs (created_by, subject, difficulty, topic, requested)
+        SELECT ?, ?, ?, ?, ?
+        WHERE ? IS NULL OR (SELECT COUNT(*) FROM generation_jobs
+                            WHERE created_by = ? AND status IN ('pending', 'running')) < ?
+    ''', (created_by, subject, difficulty, (topic or '').strip(), count, max_active, created_by, max_active))
+    conn.commit()
     conn.close()
+    if not cursor.rowcount:
+        return None, f'You already have {max_active} generation jobs running'
+    return cursor.lastrowid, None
 
-    subjects = [
-        {'id': 'math', 'name': 'Toán học'},
-        {'id': 'physics', 'name': 'Vật lý'},
-        {'id': 'chemistry', 'name': 'Hóa học'},
-        {'id': 'biology', 'name': 'Sinh học'},
-        {'id': 'literature', 'name': 'Văn học'},
-        {'id': 'english', 'name': 'Tiếng Anh'}
-    ]
+def get_generation_job(job_id):
+    """Job row as a dict with live progress, rate and ETA"""
+    conn = get_db_connection()
+    row = conn.execute('SELECT * FROM generation_jobs WHERE id = ?', (job_id,)).fetchone()
+    conn.close()
+    if not row:
+        return None
+
+    job = dict(row)
+    job['progress'] = round(100 * job['generated'] / job['requested'], 1)
+    with generation_lock:
+        running = generation_jobs_running.get(job_id)
+        if running:
+            elapsed = time.monotonic() - running['started_at']
+            rate = running['generated'] / elapsed if elapsed else 0
+            job['rate_per_minute'] = round(rate * 60, 1)
+            job['eta_seconds'] = round((job['requested'] - job['generated']) / rate) if rate else None
+    return job
+
+def resume_generation_jobs():
+    """Restart jobs whose worker stopped (or that never started), claiming each one first"""
+    stale = f'-{GENERATION_CLAIM_TIMEOUT} seconds'
+    conn = get_db_connection()
+    # Jobs cancelled after their worker stopped are finished here, not resumed
+    conn.execute('''
+        UPDATE generation_jobs SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+        WHERE status IN ('pending', 'running') AND cancel_requested AND COALESCE(heartbeat_at, updated_at) < datetime('now', ?)
+    ''', (stale,))
+    conn.commit()
+    rows = conn.execute('''
+        SELECT id FROM generation_jobs
+        WHERE status IN ('pending', 'running') AND COALESCE(heartbeat_at, updated_at) < datetime('now', ?)
+    ''', (stale,)).fetchall()
+    conn.close()
+    for row in rows:
+        start_generation_job(row['id'])
 
-    return render_template('create_contest.html', exercises=exercises, subjects=subjects)
+def generation_recovery_loop():
+    """Pick up abandoned jobs once their owner's heartbeat has gone stale"""
+    while True:
+        try:
+            resume_generation_jobs()
+        except Exception as e:
+            print(f"Generation recovery error: {e}")
+        background_sleep(GENERATION_CLAIM_TIMEOUT)
 
-@app.route('/exercises')
-def exercises():
+@app.route('/api/generation_jobs', methods=['GET', 'POST'])
+def api_generation_jobs():
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return jsonify({'success': False, 'message': 'Not logged in'})
 
-    conn = get_db_connection()
-    exercises = conn.execute(
-        'SELECT e.*, u.username FROM exercises e JOIN users u ON e.created_by = u.id ORDER BY e.created_at DESC'
-    ).fetchall()
-    conn.close()
+    if request.method == 'GET':
+        conn = get_db_connection()
+        jobs = conn.execute(
+            'SELECT * FROM generation_jobs WHERE created_by = ? ORDER BY id DESC LIMIT 20', (session['user_id'],)
+        ).fetchall()
+        conn.close()
+        return jsonify({'success': True, 'jobs': [dict(job) for job in jobs]})
 
-    return render_template('exercises.html', exercises=exercises)
+    if not can_generate_exercises(session['user_id']):
+        return jsonify({'success': False, 'message': 'Permission denied'})
 
-@app.route('/create_exercise', methods=['GET', 'POST'])
-def create_exercise():
+    data = request.get_json(silent=True) or request.form
+    try:
+        count = int(data.get('count', 0))
+    except (TypeError, ValueError):
+        count = 0
+    job_id, error = create_generation_job(session['user_id'], data.get('subject'), data.get('difficulty'),
+                                          count, data.get('topic', ''), max_active=GENERATION_MAX_ACTIVE_JOBS)
+    if error:
+        return jsonify({'success': False, 'message': error})
+
+    if not start_generation_job(job_id):
+        return jsonify({'success': False, 'job_id': job_id, 'message': 'Chưa cấu hình AI, không thể tạo bài tập'})
+    return jsonify({'success': True, 'job_id': job_id, 'message': 'Đang tạo bài tập...'})
+
+@app.route('/api/generation_jobs/<int:job_id>')
+def api_generation_job(job_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return jsonify({'success': False, 'message': 'Not logged in'})
 
-    if request.method == 'POST':
-        conn = get_db_connection()
-        cursor = conn.cursor() # Use cursor for lastrowid and other operations
+    job = get_generation_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'})
+    if job['created_by'] != session['user_id'] and not session.get('is_admin'):
+        return jsonify({'success': False, 'message': 'Permission denied'})
 
-        title = request.form['title']
-        content = request.form['content']
-        answer = request.form['answer']
-        detailed_solution = request.form.get('detailed_solution', '')
-        hints = request.form.get('hints', '')
-        subject = request.form['subject']
-        difficulty = request.form['difficulty']
-        points = int(request.form['points'])
+    return jsonify({'success': True, 'job': job})
 
-        try:
-            # Check if columns exist and add them if they don't
-            cursor.execute("PRAGMA table_info(exercises)")
-            columns = [column[1] for column in cursor.fetchall()]
-
-            if 'detailed_solution' not in columns:
-                cursor.execute('ALTER TABLE exercises ADD COLUMN detailed_solution TEXT')
-            if 'hints' not in columns:
-                cursor.execute('ALTER TABLE exercises ADD COLUMN hints TEXT')
-            
-            # Ensure created_by is also present
-            if 'created_by' not in columns:
-                 cursor.execute('ALTER TABLE exercises ADD COLUMN created_by INTEGER')
-                 cursor.execute('UPDATE exercises SET created_by = -1 WHERE created_by IS NULL') # Set default for existing rows if necessary
-
-            # Ensure user_id is not used in the INSERT statement, use created_by instead.
-            # Correcting the column name in the INSERT statement to match the schema.
-            cursor.execute('''
-                INSERT INTO exercises (title, content, answer, detailed_solution, hints, subject, difficulty, points, created_by, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (title, content, answer, detailed_solution, hints, subject, difficulty, points, session['user_id'], datetime.datetime.now()))
+@app.route('/api/generation_jobs/<int:job_id>/<action>', methods=['POST'])
+def api_generation_job_action(job_id, action):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
 
-            conn.commit()
-            flash('Bài tập đã được tạo thành công!', 'success')
-            return redirect(url_for('exercises'))
-        except Exception as e:
-            conn.rollback() # Rollback on error
-            flash(f'Có lỗi xảy ra khi tạo bài tập: {str(e)}', 'error')
-            # Re-render the form to show the error
-            return render_template('create_exercise.html')
+    job = get_generation_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': 'Job not found'})
+    if job['created_by'] != session['user_id'] and not session.get('is_admin'):
+        return jsonify({'success': False, 'message': 'Permission denied'})
 
-    # If GET request, render the form
-    return render_template('create_exercise.html')
+    if action == 'cancel':
+        # The worker running the job sees the flag before its next chunk
+        conn = get_db_connection()
+        cursor = conn.execute('''
+            UPDATE generation_jobs
+            SET cancel_requested = 1, status = CASE status WHEN 'pending' THEN 'cancelled' ELSE status END,
+                updated_at = CURRENT_TIMESTAMP
+            WHERE id = ? AND status IN ('pending', 'running')
+        ''', (job_id,))
+        conn.commit()
+        conn.close()
+        if not cursor.rowcount:
+            return jsonify({'success': False, 'message': 'Job is not running'})
+        with generation_lock:
+            running = generation_jobs_running.get(job_id)
+            if running:
+                running['cancelled'] = True
+        return jsonify({'success': True, 'message': 'Job cancelled'})
+
+    if action == 'resume':
+        if not start_generation_job(job_id):
+            return jsonify({'success': False, 'message': 'Job cannot be resumed now'})
+        return jsonify({'success': True, 'message': 'Job resumed'})
+
+    return jsonify({'success': False, 'message': 'Unknown action'})
+
+@app.cli.command('set-teacher')
+@click.argument('username')
+@click.option('--revoke', is_flag=True, help='Take the teacher role away instead')
+def set_teacher_command(username, revoke):
+    """Grant (or revoke) the teacher role, which allows generating exercises."""
+    conn = get_db_connection()
+    cursor = conn.execute('UPDATE users SET is_teacher = ? WHERE username = ?', (not revoke, username))
+    conn.commit()
+    conn.close()
+    if not cursor.rowcount:
+        raise click.ClickException(f"User {username} not found")
+    click.echo(f"{username} is {'no longer' if revoke else 'now'} a teacher")
+
+@app.cli.command('generate-exercises')
+@click.option('--subject', type=click.Choice(EXERCISE_SUBJECTS))
+@click.option('--difficulty', type=click.Choice(EXERCISE_DIFFICULTIES), default='medium', show_default=True)
+@click.option('--count', type=int, default=100, show_default=True)
+@click.option('--topic', default='', help='Optional topic, e.g. "phương trình bậc hai"')
+@click.option('--user-id', type=int, help='Author id for the generated exercises')
+@click.option('--resume', 'resume_id', type=int, default=None, help='Resume an existing job instead')
+def generate_exercises_command(subject, difficulty, count, topic, user_id, resume_id):
+    """Generate practice exercises with the LLM, showing progress until done."""
+    job_id = resume_id
+    if job_id is None:
+        if not subject or user_id is None:
+            raise click.UsageError('--subject and --user-id are required for a new job')
+        job_id, error = create_generation_job(user_id, subject, difficulty, count, topic)
+        if error:
+            raise click.ClickException(error)
+
+    if not start_generation_job(job_id):
+        raise click.ClickException(f"Job {job_id} cannot run (missing API key, unknown, already completed "
+                                   f"or running in a server worker)")
+
+    click.echo(f"Job {job_id} started with up to {GENERATION_PARALLELISM} parallel prompts")
+    while True:
+        time.sleep(2)
+        job = get_generation_job(job_id)
+        click.echo(f"  {job['generated']}/{job['requested']} generated, {job['failed']} failed "
+                   f"({job.get('rate_per_minute', 0)}/min)")
+        if job['status'] != 'running':
+            break
+    click.echo(f"Job {job_id} {job['status']}" + (f": {job['error']}" if job['error'] else ''))
 
 @app.route('/groups')
 def groups():
@@ -775,6 +4214,7 @@ def create_group():
         )
         conn.commit()
         conn.close()
+        refresh_audience_rooms(session['user_id'])
 
         flash('Tạo nhóm thành công!', 'success')
         return redirect(url_for('groups'))
@@ -811,30 +4251,50 @@ def profile():
     conn = get_db_connection()
     user = conn.execute('SELECT * FROM users WHERE id = ?', (session['user_id'],)).fetchone()
 
-    # Get user scores by subject
-    user_scores = conn.execute('''
-        SELECT subject, score, exercises_solved FROM user_scores 
-        WHERE user_id = ? AND subject != 'overall'
-    ''', (session['user_id'],)).fetchall()
+    # Get user scores by subject (the overall row gives the totals)
+    user_scores = []
+    overall_score = None
+    for row in conn.execute('''
+        SELECT subject, score, exercises_solved FROM user_scores WHERE user_id = ?
+    ''', (session['user_id'],)):
+        if row['subject'] == 'overall':
+            overall_score = row
+        else:
+            user_scores.append(row)
 
-    # Get user's exercises
-    user_exercises = conn.execute('''
-        SELECT * FROM exercises WHERE created_by = ? ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+    progress = get_user_progress(conn, session['user_id'])
 
-    # Get user ranking
-    user_ranking = conn.execute('''
-        SELECT rank FROM (
-            SELECT u.id, ROW_NUMBER() OVER (ORDER BY COALESCE(us.score, 0) DESC, u.created_at ASC) as rank
-            FROM users u
-            LEFT JOIN user_scores us ON u.id = us.user_id AND us.subject = 'overall'
-        ) WHERE id = ?
-    ''', (session['user_id'],)).fetchone()
+    # Get user's most recent exercises
+    user_exercises = conn.execute('''
+        SELECT id, title, content, subject, difficulty, points, created_at FROM exercises
+        WHERE created_by = ? ORDER BY created_at DESC LIMIT ?
+    ''', (session['user_id'], PROFILE_EXERCISE_LIMIT)).fetchall()
+    authored_count = conn.execute(
+        'SELECT COUNT(*) FROM exercises WHERE created_by = ?', (session['user_id'],)
+    ).fetchone()[0]
+
+    # Get user ranking from the broadcaster's cache, computing it only when cold
+    rank = ranking_cache.get('overall', {}).get(session['user_id'])
+    if rank is None:
+        row = conn.execute('''
+            SELECT rank FROM (
+                SELECT u.id, ROW_NUMBER() OVER (ORDER BY COALESCE(us.score, 0) DESC, u.created_at ASC) as rank
+                FROM users u
+                LEFT JOIN user_scores us ON u.id = us.user_id AND us.subject = 'overall'
+            ) WHERE id = ?
+        ''', (session['user_id'],)).fetchone()
+        rank = row['rank'] if row else None
+    user_ranking = {'rank': rank} if rank else None
 
     conn.close()
 
+    user = dict(user,
+                total_score=overall_score['score'] if overall_score else 0,
+                total_exercises_solved=progress['solved_total'])
+
     return render_template('profile.html', user=user, user_scores=user_scores, 
-                         user_exercises=user_exercises, user_ranking=user_ranking)
+                         user_exercises=user_exercises, user_ranking=user_ranking,
+                         authored_count=authored_count, progress=progress)
 
 @app.route('/edit_profile', methods=['GET', 'POST'])
 def edit_profile():
@@ -914,49 +4374,168 @@ def upload_avatar():
 def chat():
     if 'user_id' not in session:
         return redirect(url_for('login'))
-    return render_template('chat.html')
 
-@app.route('/notifications')
-def notifications():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
+    conn = get_db_connection()
+    groups = conn.execute('''
+        SELECT g.id, g.name, g.description FROM groups g
+        JOIN group_members gm ON gm.group_id = g.id
+        WHERE gm.user_id = ? ORDER BY g.name
+    ''', (session['user_id'],)).fetchall()
+    conn.close()
 
+    return render_template('chat.html', groups=groups)
+
+# Notifications service. Each tab is one keyset-paginated query on the
+# (user_id, ..., id) indexes, and unread counts are cached per user and kept
+# current by every write below, so the navbar badge needs no query.
+NOTIFICATION_PAGE_SIZE = 20
+NOTIFICATION_MAX_PAGE_SIZE = 100
+NOTIFICATION_TABS = {
+    'all': '',
+    'unread': 'AND n.is_read = FALSE',
+    'contest': "AND n.type = 'contest'",
+    'group': "AND n.type = 'group'",
+}
+# Fan-out rows of a shared payload keep only the per-user read state
+NOTIFICATION_SELECT = '''
+    SELECT n.id, n.user_id, n.type, n.is_read, n.created_at,
+           COALESCE(p.title, n.title) AS title,
+           COALESCE(p.message, n.message) AS message,
+           COALESCE(p.data, n.data) AS data
+    FROM notifications n
+    LEFT JOIN notification_payloads p ON p.id = n.payload_id
+'''
+# Audience -> query for its user ids; the matching socket room is '<audience>_<id>'.
+# There are no subject followers, so a subject audience is everyone who has
+# solved an exercise in it.
+NOTIFICATION_AUDIENCES = {
+    'group': 'SELECT user_id FROM group_members WHERE group_id = ?',
+    'contest': 'SELECT user_id FROM contest_participants WHERE contest_id = ?',
+    'subject': 'SELECT user_id FROM user_scores WHERE subject = ? AND exercises_solved > 0',
+}
+MARK_ALL_BATCH_SIZE = 500
+MARK_ALL_MAX_BATCHES = 4  # per request; the client repeats while 'remaining' > 0
+UNREAD_COUNT_CACHE_SIZE = 10000
+
+unread_counts = OrderedDict()  # user_id -> unread notification count
+notification_lock = threading.Lock()
+notification_generation = 0
+
+def get_notifications_page(user_id, tab='all', before=None, limit=NOTIFICATION_PAGE_SIZE):
+    """Return (notifications newest-first, has_more) for one tab"""
     conn = get_db_connection()
+    rows = conn.execute(f'''
+        {NOTIFICATION_SELECT}
+        WHERE n.user_id = ? AND n.id < ? {NOTIFICATION_TABS[tab]}
+        ORDER BY n.id DESC LIMIT ?
+    ''', (user_id, before or 2 ** 63 - 1, limit + 1)).fetchall()
+    conn.close()
+    return rows[:limit], len(rows) > limit
 
-    # Get all notifications for user
-    all_notifications = conn.execute('''
-        SELECT * FROM notifications 
-        WHERE user_id = ? 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+def get_unread_count(user_id):
+    """Unread notifications of a user, counted once and then maintained in memory"""
+    with notification_lock:
+        if user_id in unread_counts:
+            unread_counts.move_to_end(user_id)
+            return unread_counts[user_id]
+        generation = notification_generation
 
-    # Get unread notifications
-    unread_notifications = conn.execute('''
-        SELECT * FROM notifications 
-        WHERE user_id = ? AND is_read = FALSE 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+    conn = get_db_connection()
+    count = conn.execute('SELECT COUNT(*) FROM notifications WHERE user_id = ? AND is_read = FALSE',
+                         (user_id,)).fetchone()[0]
+    conn.close()
 
-    # Get notifications by type
-    contest_notifications = conn.execute('''
-        SELECT * FROM notifications 
-        WHERE user_id = ? AND type = 'contest' 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+    with notification_lock:
+        # Skip caching if a notification changed while we were counting
+        if generation == notification_generation:
+            unread_counts[user_id] = count
+            while len(unread_counts) > UNREAD_COUNT_CACHE_SIZE:
+                unread_counts.popitem(last=False)
+    return count
+
+def adjust_unread_count(user_id, delta):
+    adjust_unread_counts((user_id,), delta)
+
+def adjust_unread_counts(user_ids, delta):
+    global notification_generation
+    user_ids = list(user_ids)
+    with notification_lock:
+        notification_generation += 1
+        for user_id in user_ids:
+            if user_id in unread_counts:
+                unread_counts[user_id] = max(0, unread_counts[user_id] + delta)
+    # Other workers recount instead, so a lost message cannot leave a count off for good
+    publish_unread_change(user_ids)
+
+def forget_unread_counts(user_ids=None):
+    """Drop cached counts (all of them by default) in every worker so they are recounted on next use"""
+    user_ids = None if user_ids is None else list(user_ids)
+    drop_unread_counts(user_ids)
+    publish_unread_change(user_ids)
+
+def publish_unread_change(user_ids):
+    if user_ids == []:
+        return
+    if user_ids is not None and len(user_ids) > CACHE_CHANGE_MAX_IDS:
+        user_ids = None
+    publish_cache_change('unread', user_ids)
+
+def drop_unread_counts(user_ids=None):
+    global notification_generation
+    with notification_lock:
+        notification_generation += 1
+        if user_ids is None:
+            unread_counts.clear()
+        else:
+            for user_id in user_ids:
+                unread_counts.pop(user_id, None)
 
-    group_notifications = conn.execute('''
-        SELECT * FROM notifications 
-        WHERE user_id = ? AND type = 'group' 
-        ORDER BY created_at DESC
-    ''', (session['user_id'],)).fetchall()
+@app.context_processor
+def inject_socket_options():
+    return {'socket_options': SOCKETIO_CLIENT_OPTIONS}
 
-    conn.close()
+@app.context_processor
+def inject_unread_notifications():
+    if 'user_id' not in session:
+        return {}
+    return {'unread_notification_count': get_unread_count(session['user_id'])}
+
+@app.route('/notifications')
+def notifications():
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
+
+    # Only the first page of the "all" tab; other tabs and pages come from /api/notifications
+    all_notifications, has_more = get_notifications_page(session['user_id'])
 
-    return render_template('notifications.html', 
+    return render_template('notifications.html',
                          all_notifications=all_notifications,
-                         unread_notifications=unread_notifications,
-                         contest_notifications=contest_notifications,
-                         group_notifications=group_notifications)
+                         has_more=has_more)
+
+@app.route('/api/notifications')
+def api_notifications():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    tab = request.args.get('tab', 'all')
+    if tab not in NOTIFICATION_TABS:
+        return jsonify({'success': False, 'message': 'Invalid tab'})
+    before = request.args.get('before', type=int)
+    limit = min(max(request.args.get('limit', NOTIFICATION_PAGE_SIZE, type=int), 1), NOTIFICATION_MAX_PAGE_SIZE)
+
+    rows, has_more = get_notifications_page(session['user_id'], tab, before, limit)
+    notifications = [{
+        'id': row['id'],
+        'title': row['title'],
+        'message': row['message'],
+        'type': row['type'],
+        'is_read': bool(row['is_read']),
+        'created_at': row['created_at']
+    } for row in rows]
+
+    return jsonify({'success': True, 'notifications': notifications, 'has_more': has_more,
+                    'next_before': notifications[-1]['id'] if has_more else None,
+                    'unread_count': get_unread_count(session['user_id'])})
 
 @app.route('/api/notification/<int:notification_id>')
 def get_notification(notification_id):
@@ -964,9 +4543,9 @@ def get_notification(notification_id):
         return jsonify({'success': False, 'message': 'Not logged in'})
 
     conn = get_db_connection()
-    notification = conn.execute('''
-        SELECT * FROM notifications 
-        WHERE id = ? AND user_id = ?
+    notification = conn.execute(f'''
+        {NOTIFICATION_SELECT}
+        WHERE n.id = ? AND n.user_id = ?
     ''', (notification_id, session['user_id'])).fetchone()
     conn.close()
 
@@ -995,31 +4574,43 @@ def mark_notification_read():
     notification_id = data.get('notification_id')
 
     conn = get_db_connection()
-    conn.execute('''
+    cursor = conn.execute('''
         UPDATE notifications 
         SET is_read = TRUE 
-        WHERE id = ? AND user_id = ?
+        WHERE id = ? AND user_id = ? AND is_read = FALSE
     ''', (notification_id, session['user_id']))
     conn.commit()
     conn.close()
+    if cursor.rowcount:
+        adjust_unread_count(session['user_id'], -cursor.rowcount)
 
-    return jsonify({'success': True, 'message': 'Notification marked as read'})
+    return jsonify({'success': True, 'message': 'Notification marked as read',
+                    'unread_count': get_unread_count(session['user_id'])})
 
 @app.route('/api/mark_all_notifications_read', methods=['POST'])
 def mark_all_notifications_read():
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
+    # Short batches, newest first, so a huge backlog never holds the write lock for long
     conn = get_db_connection()
-    conn.execute('''
-        UPDATE notifications 
-        SET is_read = TRUE 
-        WHERE user_id = ?
-    ''', (session['user_id'],))
-    conn.commit()
+    marked = 0
+    for _ in range(MARK_ALL_MAX_BATCHES):
+        cursor = conn.execute('''
+            UPDATE notifications SET is_read = TRUE
+            WHERE id IN (SELECT id FROM notifications WHERE user_id = ? AND is_read = FALSE
+                         ORDER BY id DESC LIMIT ?)
+        ''', (session['user_id'], MARK_ALL_BATCH_SIZE))
+        conn.commit()
+        marked += cursor.rowcount
+        if cursor.rowcount < MARK_ALL_BATCH_SIZE:
+            break
     conn.close()
+    adjust_unread_count(session['user_id'], -marked)
+    remaining = get_unread_count(session['user_id'])
 
-    return jsonify({'success': True, 'message': 'All notifications marked as read'})
+    return jsonify({'success': True, 'message': 'All notifications marked as read',
+                    'marked': marked, 'remaining': remaining})
 
 def create_notification(user_id, title, message, notification_type='info', data=None):
     """Create a new notification for a user"""
@@ -1030,15 +4621,348 @@ def create_notification(user_id, title, message, notification_type='info', data=
     ''', (user_id, title, message, notification_type, json.dumps(data) if data else None))
     conn.commit()
     conn.close()
+    adjust_unread_count(user_id, 1)
 
-    # Emit to user via SocketIO if available
-    if socketio:
+    # Emit to user via SocketIO if available; offline users see the unread counter on their next visit
+    if socketio and user_reachable(user_id):
         socketio.emit('new_notification', {
             'title': title,
             'message': message,
             'type': notification_type
         }, room=f'user_{user_id}')
 
+def insert_notifications(conn, entries):
+    """Insert (user_id, title, message, type, data) notifications in one statement on an open connection"""
+    entries = list(entries)
+    conn.executemany('''
+        INSERT INTO notifications (user_id, title, message, type, data)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(user_id, title, message, notification_type, json.dumps(data) if data else None)
+          for user_id, title, message, notification_type, data in entries])
+    return [entry[0] for entry in entries]
+
+def notify_audience(audience, audience_id, title, message, notification_type='info', data=None, shared=True):
+    """Notify every member of a group, contest or subject audience at once
+
+    Rows are written with a single INSERT ... SELECT in one transaction and
+    announced with one broadcast to the audience room. With `shared`, the
+    text is stored once in notification_payloads and each user's row only
+    carries the read state. Returns the number of users notified.
+    """
+    members_sql = NOTIFICATION_AUDIENCES[audience]
+    conn = get_db_connection()
+    payload_id = None
+    if shared:
+        payload_id = conn.execute(
+            'INSERT INTO notification_payloads (title, message, data) VALUES (?, ?, ?)',
+            (title, message, json.dumps(data) if data else None)
+        ).lastrowid
+        row_title, row_message, row_data = '', '', None
+    else:
+        row_title, row_message, row_data = title, message, json.dumps(data) if data else None
+
+    cursor = conn.execute(f'''
+        INSERT INTO notifications (user_id, title, message, type, data, payload_id)
+        SELECT user_id, ?, ?, ?, ?, ? FROM ({members_sql})
+    ''', (row_title, row_message, notification_type, row_data, payload_id, audience_id))
+    recipients = cursor.rowcount
+    if shared and not recipients:
+        conn.execute('DELETE FROM notification_payloads WHERE id = ?', (payload_id,))
+    user_ids = [row['user_id'] for row in conn.execute(members_sql, (audience_id,))]
+    conn.commit()
+    conn.close()
+    adjust_unread_counts(user_ids, 1)
+
+    room = f'{audience}_{audience_id}'
+    if socketio and recipients and room_reachable(room):
+        socketio.emit('new_notification', {
+            'title': title,
+            'message': message,
+            'type': notification_type
+        }, room=room)
+    return recipients
+
+def get_audience_rooms(user_id):
+    """Socket rooms of the user's groups, contests and subjects"""
+    conn = get_db_connection()
+    rooms = [f"group_{row['group_id']}" for row in conn.execute(
+        'SELECT group_id FROM group_members WHERE user_id = ?', (user_id,))]
+    rooms += [f"contest_{row['contest_id']}" for row in conn.execute(
+        'SELECT contest_id FROM contest_participants WHERE user_id = ?', (user_id,))]
+    rooms += [f"subject_{row['subject']}" for row in conn.execute(
+        'SELECT subject FROM user_scores WHERE user_id = ? AND exercises_solved > 0', (user_id,))]
+    conn.close()
+    return rooms
+
+def join_audience_rooms(user_id):
+    """Join (and return) the audience rooms for the socket of the current request"""
+    rooms = get_audience_rooms(user_id)
+    for room in rooms:
+        join_room(room)
+    return rooms
+
+def sync_audience_rooms(sid, user_id):
+    """Bring an open socket's audience rooms in line with the database"""
+    rooms = get_audience_rooms(user_id)
+    with presence_lock:
+        entry = presence_by_sid.get(sid)
+        if not entry:
+            return
+        joined, left = set(rooms) - set(entry[1]), set(entry[1]) - set(rooms)
+        presence_by_sid[sid] = (user_id, rooms)
+        for room in joined:
+            members = room_presence.setdefault(room, {})
+            members[user_id] = members.get(user_id, 0) + 1
+        for room in left:
+            members = room_presence[room]
+            members[user_id] -= 1
+            if not members[user_id]:
+                del members[user_id]
+                if not members:
+                    del room_presence[room]
+    for room in joined:
+        socketio.server.enter_room(sid, room, namespace='/')
+    for room in left:
+        socketio.server.leave_room(sid, room, namespace='/')
+
+def refresh_audience_rooms(user_id):
+    """Re-sync the rooms of every open socket of the user after a group or contest join/leave"""
+    if not socketio:
+        return
+    with presence_lock:
+        sids = list(presence_sids.get(user_id, ()))
+    for sid in sids:
+        sync_audience_rooms(sid, user_id)
+    if SOCKETIO_MESSAGE_QUEUE:
+        # Sockets held by other workers are not in our registry; ask them to re-sync themselves
+        socketio.emit('audience_changed', {}, room=f"user_{user_id}")
+
+# Notification retention: read notifications expire after NOTIFICATION_READ_TTL_DAYS
+# and, past NOTIFICATION_DIGEST_AFTER_DAYS, runs of the same type for a user
+# collapse into one digest row that keeps the id (and so the position) of
+# the newest notification it replaces.
+NOTIFICATION_READ_TTL_DAYS = int(os.environ.get('NOTIFICATION_READ_TTL_DAYS', 30))
+NOTIFICATION_DIGEST_AFTER_DAYS = int(os.environ.get('NOTIFICATION_DIGEST_AFTER_DAYS', 7))
+NOTIFICATION_DIGEST_MIN = 5  # same-type notifications needed for a digest
+NOTIFICATION_DIGEST_TITLES = 5
+NOTIFICATION_DIGEST_USERS = 50  # users examined per digest transaction
+NOTIFICATION_COMPACTION_INTERVAL = 3600
+NOTIFICATION_COMPACTION_BATCH_SIZE = 500
+NOTIFICATION_COMPACTION_TIME_BUDGET = 5.0  # seconds of compaction per run
+NOTIFICATION_TYPE_NAMES = {
+    'contest': 'kỳ thi',
+    'group': 'nhóm',
+    'exercise': 'bài tập',
+    'system': 'hệ thống',
+    'achievement': 'thành tích',
+}
+
+notification_digest_cursor = 0  # user id where the next digest pass resumes
+
+def notification_digest(row):
+    """The digest data of a row ({'digest_count', 'titles'}), or None for a plain notification"""
+    if row['data']:
+        try:
+            data = json.loads(row['data'])
+        except ValueError:
+            return None
+        if isinstance(data, dict) and 'digest_count' in data:
+            return data
+    return None
+
+def notification_weight(row):
+    """How many original notifications a row stands for (digests count their members)"""
+    digest = notification_digest(row)
+    return digest['digest_count'] if digest else 1
+
+def digest_notifications(conn, user_id, notification_type, newest_id, digest_after_days, limit):
+    """Fold up to `limit` of a user's old notifications of one type (ids up to newest_id)
+    into the newest of them, which becomes (or already is) the digest
+
+    Returns (rows folded, finished); an unfinished run continues from the
+    digest row on the next call.
+    """
+    rows = conn.execute(f'''
+        {NOTIFICATION_SELECT}
+        WHERE n.user_id = ? AND n.type = ? AND n.id <= ? AND n.created_at < datetime('now', ?)
+        ORDER BY n.id DESC LIMIT ?
+    ''', (user_id, notification_type, newest_id, f'-{digest_after_days} days', limit + 1)).fetchall()
+    head, older = (rows[0], rows[1:]) if rows else (None, [])
+    digest = notification_digest(head) if head else None
+    if not older or (not digest and len(rows) < NOTIFICATION_DIGEST_MIN):
+        return 0, True
+
+    count = sum(notification_weight(row) for row in rows)
+    # Rows are folded newest first, so the digest's own titles come before older ones
+    titles = digest.get('titles', []) if digest else [head['title']]
+    titles = (titles + [row['title'] for row in older if notification_weight(row) == 1])[:NOTIFICATION_DIGEST_TITLES]
+    message = 'Gồm: ' + '; '.join(titles) if titles else ''
+    if count > len(titles):
+        message += f"{' và ' if titles else ''}{count - len(titles)} thông báo khác"
+
+    conn.execute('''
+        UPDATE notifications SET title = ?, message = ?, data = ?, payload_id = NULL, is_read = ?
+        WHERE id = ?
+    ''', (f"{count} thông báo {NOTIFICATION_TYPE_NAMES.get(notification_type, 'khác')}", message,
+          json.dumps({'digest_count': count, 'titles': titles}), all(row['is_read'] for row in rows), head['id']))
+    conn.executemany('DELETE FROM notifications WHERE id = ?', [(row['id'],) for row in older])
+    return len(older), len(older) < limit
+
+def compact_notifications(read_ttl_days=NOTIFICATION_READ_TTL_DAYS, digest_after_days=NOTIFICATION_DIGEST_AFTER_DAYS,
+                          batch_size=NOTIFICATION_COMPACTION_BATCH_SIZE, time_budget=NOTIFICATION_COMPACTION_TIME_BUDGET):
+    """Expire old read notifications, build digests and drop unused shared payloads
+
+    Every step is a short transaction of at most batch_size rows (or
+    NOTIFICATION_DIGEST_USERS users), and the run stops after time_budget
+    seconds, so requests never wait long on the SQLite write lock.
+    Returns counts of expired rows, rows folded into digests and payloads removed.
+    """
+    global notification_digest_cursor
+    stats = {'expired': 0, 'digested': 0, 'payloads': 0}
+    touched_users = set()
+    deadline = time.monotonic() + time_budget
+    conn = get_db_connection()
+    try:
+        # Ids grow with time, so the newest old-enough id bounds each step
+        # (created_at is still checked in case older rows were imported late)
+        def newest_before(days):
+            row = conn.execute('''
+                SELECT id FROM notifications WHERE created_at < datetime('now', ?) ORDER BY id DESC LIMIT 1
+            ''', (f'-{days} days',)).fetchone()
+            return row['id'] if row else None
+
+        newest = newest_before(read_ttl_days)
+        cursor = 0
+        while newest and time.monotonic() < deadline:
+            ids = [row['id'] for row in conn.execute('''
+                SELECT id FROM notifications
+                WHERE id > ? AND id <= ? AND is_read AND created_at < datetime('now', ?)
+                ORDER BY id LIMIT ?
+            ''', (cursor, newest, f'-{read_ttl_days} days', batch_size))]
+            if not ids:
+                break
+            conn.execute(f"DELETE FROM notifications WHERE id IN ({','.join('?' * len(ids))})", ids)
+            conn.commit()
+            stats['expired'] += len(ids)
+            cursor = ids[-1]
+            background_sleep(0)
+
+        newest = newest_before(digest_after_days)
+        pending = []  # (user_id, type) runs of the current users chunk still to fold
+        while newest and time.monotonic() < deadline:
+            if not pending:
+                users = [row['user_id'] for row in conn.execute('''
+                    SELECT DISTINCT user_id FROM notifications WHERE user_id > ? ORDER BY user_id LIMIT ?
+                ''', (notification_digest_cursor, NOTIFICATION_DIGEST_USERS))]
+                if not users:
+                    notification_digest_cursor = 0
+                    break
+                # Runs already holding a digest are picked up again (a run cut short by the time budget)
+                pending = [(row['user_id'], row['type']) for row in conn.execute('''
+                    SELECT user_id, type FROM notifications
+                    WHERE user_id BETWEEN ? AND ? AND id <= ? AND created_at < datetime('now', ?)
+                    GROUP BY user_id, type
+                    HAVING COUNT(*) >= ? OR (COUNT(*) > 1 AND MAX(data LIKE '{"digest_count"%'))
+                ''', (users[0], users[-1], newest, f'-{digest_after_days} days', NOTIFICATION_DIGEST_MIN))]
+                chunk_end = users[-1]
+
+            # Fold at most batch_size rows per transaction; a long run carries over to the next one
+            budget = batch_size
+            while pending and budget > 0:
+                user_id, notification_type = pending[0]
+                folded, finished = digest_notifications(conn, user_id, notification_type, newest, digest_after_days,
+                                                        max(budget, NOTIFICATION_DIGEST_MIN))
+                budget -= max(folded, 1)
+                stats['digested'] += folded
+                if folded:
+                    touched_users.add(user_id)
+                if finished:
+                    pending.pop(0)
+            conn.commit()
+            if not pending:
+                notification_digest_cursor = chunk_end
+            background_sleep(0)
+
+        while time.monotonic() < deadline:
+            cursor = conn.execute('''
+                DELETE FROM notification_payloads WHERE id IN (
+                    SELECT p.id FROM notification_payloads p
+                    WHERE NOT EXISTS (SELECT 1 FROM notifications n WHERE n.payload_id = p.id)
+                    LIMIT ?
+                )
+            ''', (batch_size,))
+            conn.commit()
+            stats['payloads'] += cursor.rowcount
+            if cursor.rowcount < batch_size:
+                break
+            background_sleep(0)
+    finally:
+        conn.close()
+        # Digests change how many unread rows a user has
+        if touched_users:
+            forget_unread_counts(touched_users)
+    return stats
+
+def notification_compaction_loop():
+    """Periodically expire and digest old notifications"""
+    while True:
+        try:
+            stats = compact_notifications()
+            if any(stats.values()):
+                print(f"Compacted notifications: {stats}")
+        except Exception as e:
+            print(f"Notification compaction error: {e}")
+        background_sleep(NOTIFICATION_COMPACTION_INTERVAL)
+
+@app.cli.command('compact-notifications')
+@click.option('--read-days', type=int, default=NOTIFICATION_READ_TTL_DAYS, show_default=True,
+              help='Delete read notifications older than this many days')
+@click.option('--digest-days', type=int, default=NOTIFICATION_DIGEST_AFTER_DAYS, show_default=True,
+              help='Collapse same-type notifications older than this many days')
+def compact_notifications_command(read_days, digest_days):
+    """Expire read notifications and collapse old ones into digests."""
+    totals = {'expired': 0, 'digested': 0, 'payloads': 0}
+    while True:
+        stats = compact_notifications(read_days, digest_days)
+        for key, value in stats.items():
+            totals[key] += value
+        # A run can end on its time budget mid-way through the digest pass
+        if not any(stats.values()) and not notification_digest_cursor:
+            break
+    click.echo(f"Expired {totals['expired']}, digested {totals['digested']}, "
+               f"removed {totals['payloads']} shared payloads")
+
+@app.route('/api/notify_audience', methods=['POST'])
+def api_notify_audience():
+    """Send one notification to a whole group, contest or (admins only) subject"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    data = request.json or {}
+    title = (data.get('title') or '').strip()
+    message = (data.get('message') or '').strip()
+    if not title or not message:
+        return jsonify({'success': False, 'message': 'Vui lòng nhập tiêu đề và nội dung'})
+
+    if data.get('subject'):
+        if not session.get('is_admin'):
+            return jsonify({'success': False, 'message': 'Permission denied'})
+        audience, audience_id = 'subject', data['subject']
+    else:
+        # Same rule as exports: group owners/admins, contest creators and site admins
+        conn = get_db_connection()
+        allowed = get_export_audience(conn, session['user_id'], data.get('group_id'), data.get('contest_id'))
+        conn.close()
+        if not allowed:
+            return jsonify({'success': False, 'message': 'Permission denied'})
+        audience = 'group' if data.get('group_id') else 'contest'
+        audience_id = data.get('group_id') or data.get('contest_id')
+
+    notification_type = audience if audience in ('group', 'contest') else 'info'
+    recipients = notify_audience(audience, audience_id, title, message, notification_type,
+                                 {f'{audience}_id': audience_id})
+    return jsonify({'success': True, 'message': f'Đã gửi thông báo tới {recipients} người', 'recipients': recipients})
+
 @app.route('/search')
 def search():
     if 'user_id' not in session:
@@ -1092,12 +5016,7 @@ def exercise_detail(exercise_id):
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    conn = get_db_connection()
-    exercise = conn.execute(
-        'SELECT e.*, u.username as author_name FROM exercises e JOIN users u ON e.created_by = u.id WHERE e.id = ?',
-        (exercise_id,)
-    ).fetchone()
-    conn.close()
+    exercise = get_exercise(exercise_id)
 
     if not exercise:
         return render_template('404.html'), 404
@@ -1149,6 +5068,7 @@ def group_detail(group_id):
         WHERE ge.group_id = ?
         ORDER BY e.created_at DESC
     ''', (group_id,)).fetchall()
+    group_exercises = mark_solved_exercises(session['user_id'], group_exercises)
 
     # Check if current user is member
     is_member = conn.execute('''
@@ -1173,11 +5093,7 @@ def api_exercise_detail(exercise_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Not logged in'})
 
-    conn = get_db_connection()
-    exercise = conn.execute(
-        'SELECT * FROM exercises WHERE id = ?', (exercise_id,)
-    ).fetchone()
-    conn.close()
+    exercise = get_exercise(exercise_id)
 
     if not exercise:
         return jsonify({'success': False, 'message': 'Exercise not found'})
@@ -1207,37 +5123,40 @@ def submit_exercise():
     if not exercise_id:
         return jsonify({'success': False, 'message': 'Exercise ID required'})
 
-    conn = get_db_connection()
-    exercise = conn.execute('SELECT * FROM exercises WHERE id = ?', (exercise_id,)).fetchone()
+    exercise = get_exercise(exercise_id)
 
     if not exercise:
-        conn.close()
         return jsonify({'success': False, 'message': 'Exercise not found'})
 
-    # Simple scoring logic - in real app, this would be more sophisticated
-    # Compare submitted answer with the correct answer from the database
-    is_correct = answer.strip().lower() == exercise['answer'].strip().lower()
-    score = exercise['points'] if is_correct else 0
+    if not socketio:
+        # No socket to push results over; grade inline
+        result = grade_submissions([{'job_id': None, 'user_id': session['user_id'],
+                                     'exercise_id': exercise['id'], 'answer': answer}])[0]
+        result.pop('user_id')
+        return jsonify(result)
+
+    job_id = enqueue_submission(session['user_id'], exercise['id'], answer)
+    if not job_id:
+        response = jsonify({'success': False, 'status': 'busy', 'retry_after': 1,
+                            'message': 'Hệ thống đang bận, vui lòng nộp lại sau giây lát!'})
+        response.headers['Retry-After'] = '1'
+        return response, 503
+
+    # The result is pushed as a 'grading_result' event (or polled below)
+    return jsonify({'success': True, 'queued': True, 'job_id': job_id, 'message': 'Đang chấm bài...'})
+
+@app.route('/api/submission_result/<job_id>')
+def submission_result(job_id):
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
 
-    # Update user's score
-    if is_correct:
-        update_user_score(session['user_id'], exercise['subject'], score, 1)
+    with grading_lock:
+        result = grading_results.get(job_id)
 
-    # Save submission
-    conn.execute('''
-        INSERT INTO exercise_submissions (user_id, exercise_id, answer, score, is_correct)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (session['user_id'], exercise_id, answer, score, is_correct))
-    conn.commit()
-    conn.close()
+    if not result or result['user_id'] != session['user_id']:
+        return jsonify({'success': True, 'ready': False})
 
-    return jsonify({
-        'success': True,
-        'is_correct': is_correct,
-        'score': score,
-        'message': 'Chính xác! Bạn được {} điểm!'.format(score) if is_correct else 'Chưa đúng, hãy thử lại!',
-        'exercise': dict(exercise) # Include exercise details for frontend to display solution
-    })
+    return jsonify({'success': True, 'ready': True, 'result': result})
 
 @app.route('/api/join_contest', methods=['POST'])
 def join_contest():
@@ -1250,27 +5169,27 @@ def join_contest():
     if not contest_id:
         return jsonify({'success': False, 'message': 'Contest ID required'})
 
-    conn = get_db_connection()
+    try:
+        contest_id = int(contest_id)
+    except (TypeError, ValueError):
+        return jsonify({'success': False, 'message': 'Contest ID required'})
 
-    # Check if user already joined
-    existing = conn.execute(
-        'SELECT * FROM contest_participants WHERE user_id = ? AND contest_id = ?',
-        (session['user_id'], contest_id)
-    ).fetchone()
+    status = admit_contest_join(session['user_id'], contest_id)
 
-    if existing:
-        conn.close()
+    if status == 'not_found':
+        return jsonify({'success': False, 'message': 'Contest not found'})
+
+    if status == 'already_joined':
         return jsonify({'success': False, 'message': 'Bạn đã tham gia cuộc thi này rồi'})
 
-    # Add user to contest
-    conn.execute(
-        'INSERT INTO contest_participants (user_id, contest_id, joined_at) VALUES (?, ?, CURRENT_TIMESTAMP)',
-        (session['user_id'], contest_id)
-    )
-    conn.commit()
-    conn.close()
+    if status == 'busy':
+        # Tell the client to retry instead of piling up on the SQLite write lock
+        response = jsonify({'success': False, 'status': 'busy', 'retry_after': JOIN_RETRY_AFTER,
+                            'message': 'Hệ thống đang bận, đang thử lại...'})
+        response.headers['Retry-After'] = str(JOIN_RETRY_AFTER)
+        return response, 503
 
-    return jsonify({'success': True, 'message': 'Tham gia cuộc thi thành công!'})
+    return jsonify({'success': True, 'status': 'queued', 'message': 'Tham gia cuộc thi thành công!'})
 
 @app.route('/api/add_score', methods=['POST'])
 def add_score():
@@ -1322,6 +5241,7 @@ def join_group():
         )
         conn.commit()
         conn.close()
+        refresh_audience_rooms(session['user_id'])
         return jsonify({'success': True, 'message': 'Tham gia nhóm thành công!'})
     except Exception as e:
         conn.close()
@@ -1356,6 +5276,9 @@ def leave_group():
     )
     conn.commit()
     conn.close()
+    refresh_audience_rooms(session['user_id'])
+    if socketio:
+        leave_group_chats(session['user_id'], group_id)
 
     return jsonify({'success': True, 'message': 'Đã rời nhóm thành công'})
 
@@ -1379,6 +5302,45 @@ def auto_save():
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/cache_stats')
+def cache_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'message': 'Permission denied'})
+
+    return jsonify({'success': True, 'exercises': get_exercise_cache_stats(),
+                    'chatbot': get_chatbot_cache_stats()})
+
+@app.route('/api/queue_stats')
+def queue_stats():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    if not session.get('is_admin'):
+        return jsonify({'success': False, 'message': 'Permission denied'})
+
+    return jsonify({'success': True, 'grading': get_grading_stats(),
+                    'contest_joins': get_contest_join_stats(), 'llm': get_llm_stats(),
+                    'presence': get_presence_stats(), 'group_chat': get_group_chat_stats(),
+                    'ranking_subscribers': get_ranking_subscriber_stats(),
+                    'slow_consumers': get_slow_consumer_stats()})
+
+@app.route('/api/online_counts')
+def online_counts():
+    """Online members per group/contest, e.g. ?groups=1,2&contests=5"""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    def parse_ids(name):
+        return [int(value) for value in request.args.get(name, '').split(',') if value.strip().isdigit()][:100]
+
+    return jsonify({'success': True,
+                    'groups': {group_id: count_online(f'group_{group_id}') for group_id in parse_ids('groups')},
+                    'contests': {contest_id: count_online(f'contest_{contest_id}')
+                                 for contest_id in parse_ids('contests')}})
+
 @app.route('/api/delete_exercise/<int:exercise_id>', methods=['DELETE'])
 def delete_exercise(exercise_id):
     if 'user_id' not in session:
@@ -1398,13 +5360,22 @@ def delete_exercise(exercise_id):
         return jsonify({'success': False, 'message': 'Permission denied'})
 
     # Delete exercise and related data
+    # Progress of users who attempted it is rebuilt lazily on their next read
+    conn.execute('''
+        DELETE FROM user_progress WHERE user_id IN
+            (SELECT user_id FROM exercise_submissions WHERE exercise_id = ?)
+    ''', (exercise_id,))
     conn.execute('DELETE FROM exercise_submissions WHERE exercise_id = ?', (exercise_id,))
+    conn.execute('DELETE FROM solved_exercises WHERE exercise_id = ?', (exercise_id,))
     conn.execute('DELETE FROM contest_exercises WHERE exercise_id = ?', (exercise_id,))
     conn.execute('DELETE FROM group_exercises WHERE exercise_id = ?', (exercise_id,))
     conn.execute('DELETE FROM exercises WHERE id = ?', (exercise_id,))
 
     conn.commit()
     conn.close()
+    invalidate_exercise(exercise_id)
+    forget_solved_exercise(exercise_id)
+    unindex_exercise(exercise_id)
 
     return jsonify({'success': True, 'message': 'Exercise deleted successfully'})
 
@@ -1437,6 +5408,9 @@ def edit_exercise(exercise_id):
 
     conn.commit()
     conn.close()
+    invalidate_exercise(exercise_id)
+    index_exercise(exercise_id, data['title'], data['subject'], data['difficulty'], data['content'],
+                   data['detailed_solution'])
 
     return jsonify({'success': True, 'message': 'Exercise updated successfully'})
 
@@ -1466,14 +5440,179 @@ def delete_contest(contest_id):
     conn.commit()
     conn.close()
 
+    # Dropped after the commit so a join racing the delete can't reload the set
+    with contest_join_lock:
+        contest_participant_sets.pop(contest_id, None)
+
     return jsonify({'success': True, 'message': 'Contest deleted successfully'})
 
+# Streaming exports for teachers
+EXPORT_CHUNK_SIZE = int(os.environ.get('EXPORT_CHUNK_SIZE', 1000))
+
+SUBMISSION_EXPORT_COLUMNS = ['id', 'user_id', 'username', 'full_name', 'exercise_id', 'exercise_title',
+                             'subject', 'answer', 'score', 'is_correct', 'submitted_at']
+SCORE_EXPORT_COLUMNS = ['id', 'user_id', 'username', 'full_name', 'subject', 'score',
+                        'exercises_solved', 'last_updated']
+
+def get_export_audience(conn, user_id, group_id=None, contest_id=None):
+    """Get (members_sql, exercises_sql, params, name) for an export, or None if not allowed
+
+    Group owners/admins can export their group, contest creators their
+    contest and site admins everything.
+    """
+    user = conn.execute('SELECT is_admin FROM users WHERE id = ?', (user_id,)).fetchone()
+    is_admin = bool(user and user['is_admin'])
+
+    if group_id:
+        role = conn.execute('SELECT role FROM group_members WHERE group_id = ? AND user_id = ?',
+                            (group_id, user_id)).fetchone()
+        if not is_admin and not (role and role['role'] in ('owner', 'admin')):
+            return None
+        return ('SELECT user_id FROM group_members WHERE group_id = ?',
+                'SELECT exercise_id FROM group_exercises WHERE group_id = ?',
+                group_id, f'group_{group_id}')
+
+    if contest_id:
+        contest = conn.execute('SELECT created_by FROM contests WHERE id = ?', (contest_id,)).fetchone()
+        if not contest or (not is_admin and contest['created_by'] != user_id):
+            return None
+        return ('SELECT user_id FROM contest_participants WHERE contest_id = ?',
+                'SELECT exercise_id FROM contest_exercises WHERE contest_id = ?',
+                contest_id, f'contest_{contest_id}')
+
+    return None
+
+def iter_export_rows(query, params, chunk_size=EXPORT_CHUNK_SIZE):
+    """Yield row chunks using keyset pagination on id
+
+    Every chunk is a separate short SELECT, so the database is never held
+    for the whole export and only one chunk is in memory at a time.
+    The query must take the last seen id as its first parameter and a LIMIT
+    as its last one.
+    """
+    conn = get_db_connection()
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(query, (last_id, *params, chunk_size)).fetchall()
+            if not rows:
+                break
+            yield rows
+            last_id = rows[-1]['id']
+            if len(rows) < chunk_size:
+                break
+    finally:
+        conn.close()
+
+def format_export_chunks(chunks, columns, fmt):
+    """Serialize row chunks as CSV (with header) or JSONL text"""
+    if fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for rows in chunks:
+            for row in rows:
+                writer.writerow([row[column] for column in columns])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.tell():
+            yield buffer.getvalue()
+    else:
+        for rows in chunks:
+            yield ''.join(json.dumps({column: row[column] for column in columns}, ensure_ascii=False, default=str) + '\n'
+                          for row in rows)
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks incrementally"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
+
+def stream_export(kind, chunks, columns, name):
+    """Build a streaming (optionally gzipped) CSV/JSONL download response"""
+    fmt = 'jsonl' if request.args.get('format') == 'jsonl' else 'csv'
+    body = format_export_chunks(chunks, columns, fmt)
+    headers = {'Content-Disposition': f'attachment; filename={kind}_{name}.{fmt}'}
+
+    if 'gzip' in request.accept_encodings:
+        body = gzip_chunks(body)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    return Response(stream_with_context(body), mimetype=mimetype, headers=headers)
+
+@app.route('/api/export/submissions')
+def export_submissions():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    conn = get_db_connection()
+    audience = get_export_audience(conn, session['user_id'],
+                                   request.args.get('group_id', type=int),
+                                   request.args.get('contest_id', type=int))
+    conn.close()
+
+    if not audience:
+        return jsonify({'success': False, 'message': 'Permission denied'})
+
+    members_sql, exercises_sql, audience_id, name = audience
+    query = f'''
+        SELECT s.id, s.user_id, u.username, u.full_name, s.exercise_id, e.title as exercise_title,
+               e.subject, s.answer, s.score, s.is_correct, s.submitted_at
+        FROM exercise_submissions s
+        JOIN users u ON s.user_id = u.id
+        LEFT JOIN exercises e ON s.exercise_id = e.id
+        WHERE s.id > ? AND s.user_id IN ({members_sql}) AND s.exercise_id IN ({exercises_sql})
+        ORDER BY s.id
+        LIMIT ?
+    '''
+    chunks = iter_export_rows(query, (audience_id, audience_id))
+    return stream_export('submissions', chunks, SUBMISSION_EXPORT_COLUMNS, name)
+
+@app.route('/api/export/scores')
+def export_scores():
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Not logged in'})
+
+    conn = get_db_connection()
+    audience = get_export_audience(conn, session['user_id'],
+                                   request.args.get('group_id', type=int),
+                                   request.args.get('contest_id', type=int))
+    conn.close()
+
+    if not audience:
+        return jsonify({'success': False, 'message': 'Permission denied'})
+
+    members_sql, _, audience_id, name = audience
+    query = f'''
+        SELECT us.id, us.user_id, u.username, u.full_name, us.subject, us.score,
+               us.exercises_solved, us.last_updated
+        FROM user_scores us
+        JOIN users u ON us.user_id = u.id
+        WHERE us.id > ? AND us.user_id IN ({members_sql})
+        ORDER BY us.id
+        LIMIT ?
+    '''
+    chunks = iter_export_rows(query, (audience_id,))
+    return stream_export('scores', chunks, SCORE_EXPORT_COLUMNS, name)
+
 @app.route('/logout')
 def logout():
     session.clear()
     flash('Đã đăng xuất thành công!', 'success')
     return redirect(url_for('index'))
 
+@app.cli.command('init-db')
+def init_db_command():
+    """Initialize the database (run once before starting several workers)."""
+    init_db()
+    click.echo("Database initialized")
+
 @app.errorhandler(404)
 def not_found(error):
     return render_template('404.html'), 404
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+Mock LLM server for CoachEduAI
+An OpenAI-compatible stand-in for load testing the chatbot without network
+access or API credit. Point the app at it with:
+
+    OPENAI_API_KEY=mock OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python main.py
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = ('Đây là câu trả lời mẫu của CoachAI cho câu hỏi của bạn về bài tập, '
+         'gồm các bước giải chi tiết, ví dụ minh họa và gợi ý ôn luyện thêm.').split()
+
+config = {
+    'latency': float(os.environ.get('MOCK_LLM_LATENCY', 0.5)),
+    'tokens_per_second': float(os.environ.get('MOCK_LLM_TOKENS_PER_SECOND', 50)),
+    'response_tokens': int(os.environ.get('MOCK_LLM_RESPONSE_TOKENS', 120)),
+    'error_rate': float(os.environ.get('MOCK_LLM_ERROR_RATE', 0)),
+}
+
+def make_tokens(count):
+    """Build a canned answer of `count` tokens (one word per token)"""
+    return [WORDS[i % len(WORDS)] + ' ' for i in range(count)]
+
+def make_exercise_tokens(messages):
+    """Answer a JSON-mode exercise generation prompt ("Số lượng: N") with N exercises"""
+    prompt = str(messages[-1].get('content', '')) if messages else ''
+    match = re.search(r'Số lượng: (\d+)', prompt)
+    exercises = []
+    for _ in range(int(match.group(1)) if match else 1):
+        a, b = random.randint(2, 50), random.randint(2, 50)
+        exercises.append({'title': f'Bài tập mẫu {uuid.uuid4().hex[:6]}', 'content': f'Tính {a} + {b}',
+                          'answer': str(a + b), 'detailed_solution': f'{a} + {b} = {a + b}',
+                          'hints': 'Cộng hai số'})
+    text = json.dumps({'exercises': exercises}, ensure_ascii=False)
+    # Roughly four characters per token, to keep the configured token rate meaningful
+    return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self.send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'mock'}]})
+        else:
+            self.send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self.send_json(400, {'error': {'message': 'Invalid JSON body', 'type': 'invalid_request_error'}})
+            return
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_json(404, {'error': {'message': 'Not found', 'type': 'invalid_request_error'}})
+            return
+
+        # Injected failures look like provider rate limits or outages
+        if random.random() < config['error_rate']:
+            if random.random() < 0.5:
+                self.send_json(429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}})
+            else:
+                self.send_json(500, {'error': {'message': 'Internal server error', 'type': 'server_error'}})
+            return
+
+        count = min(config['response_tokens'], body.get('max_tokens') or config['response_tokens'])
+        if (body.get('response_format') or {}).get('type') == 'json_object':
+            tokens = make_exercise_tokens(body.get('messages', []))
+        else:
+            tokens = make_tokens(count)
+        completion_id = 'chatcmpl-' + uuid.uuid4().hex
+        model = body.get('model', 'mock')
+        prompt_tokens = sum(len(str(m.get('content', '')).split()) for m in body.get('messages', []))
+        delay = 1.0 / config['tokens_per_second'] if config['tokens_per_second'] > 0 else 0
+
+        time.sleep(config['latency'])
+
+        if body.get('stream'):
+            self.stream_completion(completion_id, model, tokens, delay)
+            return
+
+        time.sleep(delay * len(tokens))
+        self.send_json(200, {
+            'id': completion_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': model,
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': ''.join(tokens).strip()},
+                         'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': len(tokens),
+                      'total_tokens': prompt_tokens + len(tokens)}
+        })
+
+    def stream_completion(self, completion_id, model, tokens, delay):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send_chunk(delta, finish_reason=None):
+            chunk = {'id': completion_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                     'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            self.wfile.flush()
+
+        try:
+            send_chunk({'role': 'assistant'})
+            for token in tokens:
+                send_chunk({'content': token})
+                time.sleep(delay)
+            send_chunk({}, 'stop')
+            self.wfile.write(b"data: [DONE]\n\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up (timeout or cancelled request)
+            pass
+
+def main():
+    parser = argparse.ArgumentParser(description='OpenAI-compatible mock LLM server')
+    parser.add_argument('--host', default=os.environ.get('MOCK_LLM_HOST', '127.0.0.1'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('MOCK_LLM_PORT', 8001)))
+    parser.add_argument('--latency', type=float, default=config['latency'],
+                        help='seconds before the first token')
+    parser.add_argument('--tokens-per-second', type=float, default=config['tokens_per_second'],
+                        help='generation speed (0 = no delay)')
+    parser.add_argument('--response-tokens', type=int, default=config['response_tokens'],
+                        help='tokens per answer (capped by max_tokens)')
+    parser.add_argument('--error-rate', type=float, default=config['error_rate'],
+                        help='fraction of requests answered with 429/500')
+    args = parser.parse_args()
+
+    config.update(latency=args.latency, tokens_per_second=args.tokens_per_second,
+                  response_tokens=args.response_tokens, error_rate=args.error_rate)
+
+    server = ThreadingHTTPServer((args.host, args.port), MockLLMHandler)
+    server.daemon_threads = True
+    print(f"🤖 Mock LLM listening on http://{args.host}:{args.port}/v1")
+    print(f"   latency={args.latency}s, {args.tokens_per_second} tokens/s, "
+          f"{args.response_tokens} tokens, error rate {args.error_rate}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n🛑 Mock LLM stopped")
+
+if __name__ == '__main__':
+    main()